@@ -0,0 +1,44 @@
+"""
+Benchmark the time and memory it takes to add a parameter grid with `scheduler.add`
+
+Usage:
+    python benchmarks/add_time.py [max_points]
+"""
+
+import sys
+import tracemalloc
+from time import perf_counter
+import numpy as np
+
+import numpipe
+
+def add_time(npoints):
+    """return the time (in seconds) and memory (in MB) to add a grid of npoints instances
+       (an outer product of two parameters, zipped with a labeled parameter)"""
+    job = numpipe.scheduler()
+
+    @job.cache()
+    def sim(x, y, z):
+        pass
+
+    n = int(np.sqrt(npoints//10))
+    m = npoints//(10*n*n)*10
+
+    tracemalloc.start()
+    t_start = perf_counter()
+    job.add(sim, 'grid', **numpipe.outer(dict(x=np.linspace(0, 1, n), y=np.linspace(0, 1, n))),
+            z=numpipe.parameter(np.arange(m), labels=[f'z{i}' for i in range(m)]))
+    runtime = perf_counter() - t_start
+    memory = tracemalloc.get_traced_memory()[0]/1e6
+    tracemalloc.stop()
+
+    return runtime, memory, len(job.blocks)
+
+if __name__ == '__main__':
+    max_points = int(float(sys.argv[1])) if len(sys.argv) > 1 else 10**6
+
+    npoints = 10**4
+    while npoints <= max_points:
+        runtime, memory, nblocks = add_time(npoints)
+        print(f'{nblocks:>9} instances: {1e3*runtime:8.1f} ms, {memory:7.1f} MB')
+        npoints *= 10
@@ -0,0 +1,48 @@
+"""
+Benchmark the time it takes to `import numpipe` and check that heavy dependencies are deferred
+
+Usage:
+    python benchmarks/import_time.py [repeats]
+"""
+
+import sys
+import subprocess
+import statistics
+from time import perf_counter
+
+### socket is not listed: multiprocessing imports it
+HEAVY_MODULES = ['matplotlib', 'h5py', 'toml', 'tqdm', 'telegram', 'termcolor', 'colorama']
+
+CHECK = f"""
+import sys
+import numpipe
+loaded = [m for m in {HEAVY_MODULES} if m in sys.modules and type(sys.modules[m]).__name__ != '_LazyModule']
+print(' '.join(loaded))
+"""
+
+def import_time(repeats=10):
+    """return the wall-times (in seconds) of a fresh interpreter importing numpipe, relative to a bare interpreter"""
+    def run(code):
+        t_start = perf_counter()
+        subprocess.run([sys.executable, '-c', code], check=True)
+        return perf_counter() - t_start
+
+    baseline = statistics.median(run('import numpy') for _ in range(repeats))
+    times = [run('import numpipe') - baseline for _ in range(repeats)]
+    return times
+
+def heavy_imports():
+    """return the heavy modules that are loaded by `import numpipe`"""
+    output = subprocess.run([sys.executable, '-c', CHECK], check=True, capture_output=True, text=True)
+    return output.stdout.split()
+
+if __name__ == '__main__':
+    repeats = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    times = import_time(repeats)
+    print(f'import numpipe: {1e3*statistics.median(times):.1f} ms (median of {repeats}, excluding numpy)')
+
+    loaded = heavy_imports()
+    if loaded:
+        print(f'heavy modules loaded at import: {", ".join(loaded)}')
+        sys.exit(1)
+    print('no heavy modules loaded at import')
@@ -1,18 +1,36 @@
+"""
+Show the status of a numpipe coordinator (python sim.py serve)
+
+Usage:
+    python bin/status.py [host:port] [key file]
+
+The key is network.authkey in the config (or NUMPIPE_NETWORK__AUTHKEY), otherwise the key file of the coordinator
+(.{script}.authkey next to the script)
+"""
+
+import sys
 import socket
 import pickle
-import sys
 from time import sleep
-from numpipe.networking import send_msg, recv_msg
+from numpipe.networking import channel, load_authkey
+from numpipe.server import parse_address
 
-address = ('localhost', 6000)
+address = parse_address(sys.argv[1] if len(sys.argv) > 1 else 'localhost:6000')
+authkey = load_authkey(sys.argv[2] if len(sys.argv) > 2 else '')
 
-conn = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-conn.connect(address)
-
-send_msg(conn, pickle.dumps(['get', 'ID']))
-recv_msg(conn)
+conn = channel.connect(socket.create_connection(address), authkey)
 while True:
-    send_msg(conn, b'ready')
-    progress = pickle.loads(recv_msg(conn))
-    print(progress)
+    conn.send(pickle.dumps(('status',)))
+    message = conn.recv()
+    if message is None:
+        break
+
+    status = pickle.loads(message)
+    if not isinstance(status, dict):
+        ### the coordinator stopped
+        break
+
+    print(', '.join(f'{key}: {value}' for key, value in status.items()), end='\r', flush=True)
     sleep(.2)
+
+print()
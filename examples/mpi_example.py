@@ -1,3 +1,9 @@
+"""
+Run the blocks of a sweep on the ranks of an MPI job: rank 0 schedules, the other ranks execute
+
+    mpirun -n 4 python mpi_example.py --executor mpi
+"""
+
 import numpy as np
 from random import random
 from numpipe import scheduler
@@ -9,7 +15,7 @@ import sys
 job = scheduler()
 
 @job.cache
-def sim():
+def sim(i):
     x = np.random.randint(0, 1000)
 
     size = MPI.COMM_WORLD.Get_size()
@@ -20,9 +26,12 @@ def sim():
 
     return dict(x=x)
 
+for i in range(8):
+    job.add(sim, i=i)
+
 @job.at_end
 def vis():
-    var = job.load(sim)
-    print(f'The stored value: x = {var.x}')
+    for name, var in job.load(sim):
+        print(f'The stored value of {name}: x = {var.x}')
 
 job.run()
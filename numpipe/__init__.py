@@ -3,23 +3,25 @@ numpipe
 =======
 """
 
-from . import h5cache
-from . import networking
-from . import slurm
-from . import utility
-from . import fileio
-from . import execution
-from . import parser
-from . import display
-from . import notify
-from . import config
-from . import mpl_tools
-from . import parameters
+import importlib
+
 from . import progress
 
 from .utility import once
 from .numpipe import scheduler
-from .parameters import parameter, gather, outer
+from .parameters import parameter, gather, outer, adaptive
+from .sharedmem import shared
+
+### submodules with heavy dependencies are imported on first access
+_submodules = ['h5cache', 'networking', 'slurm', 'utility', 'fileio', 'execution', 'parser',
+               'display', 'notify', 'config', 'mpl_tools', 'parameters', 'storage',
+               'sharding', 'sharedmem']
+
+def __getattr__(name):
+    if name in _submodules:
+        return importlib.import_module(f'.{name}', __name__)
+
+    raise AttributeError(f"module '{__name__}' has no attribute '{name}'")
 
 _pbars = progress.progress_bars()
 def pbar(it):
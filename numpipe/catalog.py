@@ -0,0 +1,204 @@
+"""
+Catalog of targets, stored in a SQLite database next to the targets
+
+The catalog records the status, fingerprint, size, runtime and timestamps of every target, so that
+cache-status queries do not need to touch the filesystem. It is reconciled with a single directory
+scan whenever the directory was modified outside of the catalog (or the catalog is missing)
+
+The catalog is shared by the processes of a run (e.g. the shards of a sweep), which wait for each other's
+transactions; a catalog that is corrupt is set aside and rebuilt from the targets on disk
+"""
+
+import os
+import sqlite3
+import logging
+from time import time
+
+BUSY_TIMEOUT = 60       # seconds to wait for the transaction of another process
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS targets (
+    path        TEXT PRIMARY KEY,
+    label       TEXT,
+    status      TEXT,
+    fingerprint TEXT,
+    size        INTEGER,
+    runtime     REAL,
+    started     REAL,
+    finished    REAL
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key         TEXT PRIMARY KEY,
+    value       TEXT
+);
+"""
+
+COLUMNS = ('path', 'label', 'status', 'fingerprint', 'size', 'runtime', 'started', 'finished')
+
+class catalog:
+    def __init__(self, filepath, dirpath):
+        """
+        Catalog of targets
+
+        Arguments:
+            filepath     path to the SQLite database
+            dirpath      directory that holds the targets
+        """
+        self.filepath = filepath
+        self.dirpath = dirpath
+
+        try:
+            self._connect()
+        except sqlite3.OperationalError:
+            ### e.g. the database is locked: not a reason to discard it
+            raise
+        except sqlite3.DatabaseError as err:
+            self.conn.close()
+            self._set_aside(err)
+            self._connect()
+
+    def _connect(self):
+        ### a rollback journal, unlike WAL, also works on network filesystems shared by several nodes; the journal
+        ### is truncated instead of deleted after every transaction, so that writes to the catalog do not modify
+        ### the directory (see is_stale)
+        self.conn = sqlite3.connect(self.filepath, timeout=BUSY_TIMEOUT)
+        self.conn.execute(f'PRAGMA busy_timeout={int(BUSY_TIMEOUT*1000)}')
+        self.conn.execute('PRAGMA journal_mode=TRUNCATE')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.executescript(SCHEMA)
+
+        self.entries = dict()
+        for row in self.conn.execute(f'SELECT {", ".join(COLUMNS)} FROM targets'):
+            self.entries[row[0]] = dict(zip(COLUMNS, row))
+
+    def _set_aside(self, err):
+        """move a corrupt database (and its journal) aside; the new catalog is rebuilt from the targets on disk
+           when it is first refreshed, since it was never synchronized"""
+        logging.warning(f"the catalog '{self.filepath}' is corrupt ({err}) and is rebuilt from the targets on disk; "
+                        f"the old catalog is kept as '{self.filepath}.corrupt'")
+        for suffix in ('', '-journal'):
+            if os.path.exists(self.filepath + suffix):
+                os.replace(self.filepath + suffix, f'{self.filepath}.corrupt{suffix}')
+
+    def _dir_mtime(self):
+        return str(os.stat(self.dirpath).st_mtime_ns)
+
+    def _get_meta(self, key):
+        row = self.conn.execute('SELECT value FROM meta WHERE key = ?', (key,)).fetchone()
+        return None if row is None else row[0]
+
+    def is_stale(self):
+        """Return true if the directory was modified since the catalog was last synchronized"""
+        return self._get_meta('dir_mtime') != self._dir_mtime()
+
+    def refresh(self, blocks):
+        """
+        Reconcile the catalog with the targets on disk with a single directory scan;
+        only done if the directory was modified since the catalog was last synchronized
+
+        Arguments:
+            blocks     dictionary of {label: block}
+        """
+        if not self.is_stale():
+            return
+
+        present = set(os.listdir(self.dirpath))
+        rows = []
+        for label, block in blocks.items():
+            target = block.target
+            on_disk = os.path.basename(target.files()[0]) in present
+
+            if self.exists(target):
+                ### trust the catalog unless the target disappeared
+                if not on_disk:
+                    rows.append(self._entry(target, label, 'missing'))
+            elif on_disk and target.exists():
+                rows.append(self._entry(target, label, 'complete'))
+
+        self._write(rows)
+        self.sync()
+
+    def exists(self, target):
+        """Return true if the target is complete according to the catalog"""
+        entry = self.entries.get(str(target))
+        return entry is not None and entry['status'] == 'complete'
+
+    def reload(self, targets):
+        """Re-read the entries of a list of targets from the database, e.g. after they were recorded by
+           another process, and return their statuses"""
+        paths = [str(target) for target in targets]
+        for i in range(0, len(paths), 500):
+            chunk = paths[i:i+500]
+            query = f'SELECT {", ".join(COLUMNS)} FROM targets WHERE path IN ({", ".join("?"*len(chunk))})'
+            for row in self.conn.execute(query, chunk):
+                self.entries[row[0]] = dict(zip(COLUMNS, row))
+
+        return [self.entries.get(path, dict()).get('status') for path in paths]
+
+    def get(self, target, key, default=None):
+        """Get a recorded value (e.g. 'runtime') for a target"""
+        entry = self.entries.get(str(target))
+        if entry is None or entry[key] is None:
+            return default
+
+        return entry[key]
+
+    def _entry(self, target, label, status, **kwargs):
+        entry = dict(self.entries.get(str(target), dict()))
+        entry.update(path=str(target), label=label, status=status)
+        entry.update(kwargs)
+        if status == 'complete':
+            entry['size'] = target.size()
+
+        return {column: entry.get(column) for column in COLUMNS}
+
+    def _write(self, entries):
+        if not entries:
+            return
+
+        with self.conn:
+            self.conn.executemany(f'INSERT OR REPLACE INTO targets ({", ".join(COLUMNS)}) VALUES ({", ".join("?"*len(COLUMNS))})',
+                                  [tuple(entry[column] for column in COLUMNS) for entry in entries])
+
+        for entry in entries:
+            self.entries[entry['path']] = entry
+
+    def record(self, target, label, status, **kwargs):
+        """
+        Record the status of a target in a single transaction
+
+        Arguments:
+            target      the target
+            label       name of the block
+            status      'running', 'complete', 'failed', 'skipped' (a dependency failed), 'cancelled' or 'missing'
+            **kwargs    other columns to record (fingerprint, runtime, started, finished)
+        """
+        self._write([self._entry(target, label, status, **kwargs)])
+
+    def record_all(self, targets, labels, status, **kwargs):
+        """Record the same status of a list of targets in a single transaction (see record);
+           kwargs values that are lists are given per target"""
+        entries = []
+        for i, (target, label) in enumerate(zip(targets, labels)):
+            values = {key: value[i] if isinstance(value, list) else value for key, value in kwargs.items()}
+            entries.append(self._entry(target, label, status, **values))
+
+        self._write(entries)
+
+    def remove(self, targets):
+        """Mark a list of targets as missing"""
+        self._write([self._entry(target, self.get(target, 'label'), 'missing') for target in targets])
+
+    def sync(self):
+        """Mark the catalog as synchronized with the current state of the directory"""
+        ### the first transaction creates the journal, which modifies the directory once more
+        for attempt in range(2):
+            dir_mtime = self._dir_mtime()
+            with self.conn:
+                self.conn.execute('INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)', ('dir_mtime', dir_mtime))
+                self.conn.execute('INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)', ('synced', str(time())))
+            if dir_mtime == self._dir_mtime():
+                break
+
+    def close(self):
+        self.conn.close()
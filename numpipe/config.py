@@ -1,13 +1,104 @@
+"""
+Configuration, read once per process from (in increasing priority):
+    * built-in defaults
+    * the configuration file (~/.config/numpipe/numpipe.conf, or the path in $NUMPIPE_CONFIG)
+    * environment variables NUMPIPE_{SECTION}__{KEY}, e.g. NUMPIPE_PROGRESS__MININTERVAL=60
+"""
+
+import os
 import pathlib
-import toml
+from copy import deepcopy
+from functools import lru_cache
+
+DEFAULTS = {
+    'execution': {
+        'parallel_default': True,
+        'batch_size': 1000,
+        'speculation': 0.0,
+        'retry_backoff': 1.0,
+        'max_tasks_per_worker': 0,
+        'max_worker_memory': 0.0,
+        'shared_memory_threshold': 10000000,
+        'handoff_memory': 0.0,
+        'stream_interval': 1.0,
+    },
+    'hdf5': {
+        'swmr': False,
+    },
+    'network': {
+        'authkey': '',
+    },
+    'notifications': {
+        'delay_default': 120,
+        'telegram': {
+            'token': '',
+            'chat_id': 0,
+        },
+    },
+    'progress': {
+        'character': '#',
+        'mininterval': 0.1,
+    },
+}
+
+ENV_PREFIX = 'NUMPIPE_'
 
 def get_config_path():
     """get the path to the configuration file"""
-    path = pathlib.Path('~/.config/numpipe/numpipe.conf').expanduser()
-    return path
+    path = os.environ.get('NUMPIPE_CONFIG', '~/.config/numpipe/numpipe.conf')
+    return pathlib.Path(path).expanduser()
+
+def merge(config, other):
+    """recursively merge the dictionary other into config"""
+    for key, value in other.items():
+        if isinstance(value, dict) and isinstance(config.get(key), dict):
+            merge(config[key], value)
+        else:
+            config[key] = value
+
+def convert(value, default):
+    """convert an environment variable string to the type of its default value"""
+    if isinstance(default, bool):
+        return value.lower() in ('1', 'true', 'yes', 'on')
+    if isinstance(default, (int, float)):
+        return type(default)(value)
+
+    return value
+
+def env_overrides(environ=os.environ):
+    """get configuration values from NUMPIPE_{SECTION}__{KEY} environment variables"""
+    overrides = dict()
+    for name, value in environ.items():
+        if not name.startswith(ENV_PREFIX) or '__' not in name:
+            continue
+
+        keys = name[len(ENV_PREFIX):].lower().split('__')
+        default = DEFAULTS
+        section = overrides
+        for key in keys[:-1]:
+            default = default.get(key, {}) if isinstance(default, dict) else {}
+            section = section.setdefault(key, {})
+
+        section[keys[-1]] = convert(value, default.get(keys[-1]) if isinstance(default, dict) else None)
+
+    return overrides
+
+@lru_cache(maxsize=None)
+def _load_config():
+    config = deepcopy(DEFAULTS)
 
-def get_config():
-    """get the configuration file contents as a dictionary"""
     path = get_config_path()
-    config = toml.load(path)
+    if path.is_file():
+        import toml
+        merge(config, toml.load(path))
+
+    merge(config, env_overrides())
     return config
+
+def get_config():
+    """get the configuration as a dictionary (the file is only read once per process)"""
+    return _load_config()
+
+def reload_config():
+    """discard the stored configuration so that it is read again on next use"""
+    _load_config.cache_clear()
@@ -1,7 +1,19 @@
-from termcolor import colored
-import colorama
 import subprocess
-colorama.init()
+from numpipe import config
+from numpipe.utility import lazy_import
+
+termcolor = lazy_import('termcolor')
+colorama = lazy_import('colorama')
+_colorama_initialized = False
+
+def colored(text, *args, **kwargs):
+    """termcolor.colored; colorama is initialized on first use, to keep it out of `import numpipe`"""
+    global _colorama_initialized
+    if not _colorama_initialized:
+        colorama.init()
+        _colorama_initialized = True
+
+    return termcolor.colored(text, *args, **kwargs)
 
 def prompt_to_delete():
     # delete = input(colored(f"Continue with job? (y/n) ", color='yellow', attrs=['bold']))
@@ -43,6 +55,49 @@ def slurm_message(sbatch_filename, wall_time, ntasks, no_submit):
         subprocess.run(['sbatch', sbatch_filename])
         print(colored('\nSlurm job submitted', color='yellow', attrs=['bold']))
 
+def slurm_array_message(submit_filename, num_elements, wall_time, nblocks, no_submit):
+    """Display details related to Slurm job arrays
+
+    Arguments:
+        submit_filename     name of the script that submits the job arrays
+        num_elements        number of elements of every job array
+        wall_time           wall-time of an element, in hours
+        nblocks             number of blocks
+        no_submit           if True, do not ask to submit the Slurm jobs
+    """
+
+    print(colored('submit script', color='yellow', attrs=['bold']))
+    subprocess.run(['cat',  f'{submit_filename}'])
+
+    print(colored('\nSlurm job arrays', color='yellow', attrs=['bold']))
+    print('    Number of blocks:', colored(f'{nblocks}', attrs=['bold']))
+    print('    Number of job arrays:', colored(f'{len(num_elements)}', attrs=['bold']))
+    print('    Number of elements:', colored(f'{sum(num_elements)}', attrs=['bold']), f'({", ".join(map(str, num_elements))})')
+    print('    Max wall-time per element:', colored(f'{wall_time:.2f} hours', attrs=['bold']))
+    print('    Max CPU-hour usage:', colored(f'{sum(num_elements)*wall_time:.2f} hours', attrs=['bold']))
+
+    if not no_submit:
+        submit_job = input(colored('\nSubmit Slurm jobs? (y/n) ', color='yellow', attrs=['bold']))
+        if submit_job != 'y':
+            print(colored('\nNot submitting Slurm jobs', color='yellow', attrs=['bold']))
+            return
+
+        subprocess.run(['sh', submit_filename])
+        print(colored('\nSlurm jobs submitted', color='yellow', attrs=['bold']))
+
+def serve_message(address, authkey_path):
+    """Display the address that workers connect to
+
+    Arguments:
+        address          (host, port) of the coordinator
+        authkey_path     path of the key file that workers authenticate with (unless network.authkey is set)
+    """
+    host, port = address
+    print(colored('Coordinator listening on', color='yellow', attrs=['bold']), f'{host or "all interfaces"}:{port}')
+    print(f'    start workers with: python <script> worker --connect {{host}}:{port}')
+    if not config.get_config()['network']['authkey']:
+        print(f'    workers authenticate with the key in {authkey_path}')
+
 def delete_message(filepaths):
     """Display data that is to be deleted
     
@@ -63,27 +118,27 @@ def delete_message(filepaths):
     else:
         return False
 
-def display_message(blocks, instances, at_end_functions):
+def display_message(blocks, at_end_functions):
     """Message to shown when 'display' command is run
     
     Arguments:
+        blocks              block registry
+        at_end_functions    dictionary of {name: at-end function}
     """
 
     print(colored("cached functions:", color='yellow', attrs=['bold']))
-    for name, block in blocks.items():
-        func = block.deferred_function
-        if func.__name__ in instances:
+    for fid, func in enumerate(blocks.functions):
+        size = blocks.function_size(fid)
+        if size == 0:
             continue
-        print('    ', colored(name, color='yellow'), ' -- ', func.__doc__, sep='')
 
-    for name, labels in instances.items():
-        func = blocks[labels[0]].deferred_function
-        print('    ', colored(name, color='yellow'), ' -- ', func.__doc__, sep='')
-        print('      ', f'[{len(labels)} instances] ', end='')
-        for label in labels:
-            subname = '-'.join(label.split('-')[1:])
-            print(subname, end=' ')
-        print('')
+        print('    ', colored(func.__name__, color='yellow'), ' -- ', func.__doc__, sep='')
+        if blocks.function_is_instance[fid]:
+            print('      ', f'[{size} instances] ', end='')
+            for id in blocks.function_ids(fid):
+                subname = '-'.join(blocks.label(id).split('-')[1:])
+                print(subname, end=' ')
+            print('')
 
     print(colored("\nat-end functions:", color='yellow', attrs=['bold']))
     for name,func in at_end_functions.items():
@@ -103,12 +158,28 @@ def cached_function_message():
 
     print(colored("Running cached functions", color='yellow'), end='')
 
-def cached_function_summary(num_executed, num_exceptions):
-    """display message when all cached functions have ran"""
+def cached_function_summary(num_executed, num_exceptions, num_duplicates=0, num_skipped=0, num_cancelled=0):
+    """display message when all cached functions have ran
+
+    Arguments:
+        num_executed      number of blocks that were executed (including duplicates)
+        num_exceptions    number of blocks that failed
+        num_duplicates    number of duplicate blocks that were linked instead of ran (default: 0)
+        num_skipped       number of blocks that were skipped because a dependency failed (default: 0)
+        num_cancelled     number of blocks that were cancelled by --fail-fast (default: 0)
+    """
     print()
     print(colored("Execution summary", color='yellow'))
-    l1 = 'runs' if num_executed != 1 else 'run'
+    num_runs = num_executed - num_duplicates - num_skipped - num_cancelled
+    l1 = 'runs' if num_runs != 1 else 'run'
     l2 = 'failures' if num_exceptions != 1 else 'failure'
-    message = f'    {num_executed} {l1}, {num_exceptions} {l2}'
+    message = f'    {num_runs} {l1}, {num_exceptions} {l2}'
+    if num_duplicates:
+        l3 = 'computations' if num_duplicates != 1 else 'computation'
+        message += f', {num_duplicates} duplicate {l3} avoided'
+    if num_skipped:
+        message += f', {num_skipped} skipped'
+    if num_cancelled:
+        message += f', {num_cancelled} cancelled'
     print(message)
     print()
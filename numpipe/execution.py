@@ -4,18 +4,48 @@ Execution of functions
 
 import os
 import sys
-import h5py
+import signal
+import threading
+import weakref
+import hashlib
+import pickle
 import numpy as np
+from time import time
 from typing import Iterable
 import traceback
 import types
 from functools import partial
 
 import numpipe
-from numpipe.fileio import load_symbols, write_symbols
-from numpipe.h5cache import h5cache
+from numpipe.storage import target, h5_target
 from numpipe.utility import once
-from numpipe import display, config
+from numpipe.sharedmem import is_marked
+from numpipe import display, config, handoff, streaming
+
+_held = weakref.WeakValueDictionary()   # {id: array} of unmarked arrays whose content is fixed for the run
+_held_hashes = dict()                   # {id: (weak reference, hash)} of marked and held arrays
+
+def hold_hash(array):
+    """hash an array once, for arrays whose content is fixed for the run (e.g. placed in shared memory)"""
+    _held[id(array)] = array
+
+def hash_value(value):
+    """return bytes that identify a value, for use in a fingerprint"""
+    if isinstance(value, np.ndarray):
+        if is_marked(value) or _held.get(id(value)) is value:
+            ### marked arrays are read-only, and held arrays are fixed, so that they are hashed once
+            ref, digest = _held_hashes.get(id(value), (None, None))
+            if ref is None or ref() is not value:
+                digest = hashlib.sha1(np.ascontiguousarray(value).data).digest()
+                _held_hashes[id(value)] = (weakref.ref(value), digest)
+            return str((value.dtype, value.shape)).encode() + digest
+
+        return str((value.dtype, value.shape)).encode() + np.ascontiguousarray(value).tobytes()
+
+    try:
+        return pickle.dumps(value)
+    except Exception:
+        return repr(value).encode()
 
 def is_windows():
     platform = sys.platform
@@ -35,47 +65,22 @@ class deferred_function:
 
         # self.arg = first_argument(name, num_iterations=num_iterations)
 
+    def fingerprint(self):
+        """return a hash of the function name and its arguments"""
+        digest = hashlib.sha1(self.__name__.encode())
+        for value in self.args:
+            digest.update(hash_value(value))
+        for key in sorted(self.kwargs):
+            digest.update(key.encode())
+            digest.update(hash_value(self.kwargs[key]))
+
+        return digest.hexdigest()
+
     def __call__(self):
         # return self.function(self.arg, *self.args, **self.kwargs)
         np.random.seed(int.from_bytes(os.urandom(4), byteorder='little'))
         return self.function(*self.args, **self.kwargs)
 
-class target:
-    """
-    A target is the output of a cached function and determines whether it needs to be rerun
-    It specifies the type of storage file
-    """
-    def __init__(self, filepath):
-        self.filepath = filepath
-
-    def load(self):
-        """Load symbols"""
-        return load_symbols(self.filepath)
-
-    def write(self, symbols):
-        """Write symbols"""
-        write_symbols(self.filepath, symbols)
-
-    def write_args(self, symbols):
-        """Write instance argument symbols to args group"""
-        with h5py.File(self.filepath, 'a') as f:
-            g = f.require_group('args')
-            for name,symbol in symbols.items():
-                try:
-                    g[name] = symbol
-                except TypeError:
-                    continue
-
-    def exists(self):
-        """Return true if the target exists"""
-        if os.path.isfile(self.filepath):
-            return True
-        else:
-            return False
-
-    def remove(self):
-        os.remove(self.filepath)
-
 class block:
     """
     A (execution) block consists of a deffered function, a target, and optional dependencies
@@ -100,8 +105,134 @@ class block:
 
             self.dependencies.extend(new_deps)
 
+class batch_block:
+    """
+    A batch of execution blocks of a vectorized function: the deferred function is called once for
+    all blocks, and its output is split along the leading axis into the target of each block
+    """
+    def __init__(self, deferred_function, targets, kwargs):
+        self.deferred_function = deferred_function
+        self.targets = targets
+        self.kwargs = kwargs
+
+def split_batch(symbols, size, name):
+    """split a dictionary of batched symbols along their leading axis into a list of dictionaries"""
+    for key, value in symbols.items():
+        if np.ndim(value) == 0 or np.shape(value)[0] != size:
+            raise ValueError(f"Invalid return value: symbol '{key}' of vectorized function '{name}' needs a leading axis of length {size}")
+
+    return [type(symbols)({key: value[i] for key, value in symbols.items()}) for i in range(size)]
+
+def run_batch(batch, name, cache_time, caches):
+    """run a batch block and write the output of every block to its target"""
+    func = batch.deferred_function
+    size = len(batch.targets)
+    for target, kwargs in zip(batch.targets, batch.kwargs):
+        target.prepare()
+        target.write_args(kwargs)
+        streaming.started(target)
+
+    symbols = func()
+
+    ### Generator functions
+    if isinstance(symbols, types.GeneratorType):
+        caches.extend(target.cache(cache_time=streaming.cache_time(target, cache_time)) for target in batch.targets)
+
+        for next_symbols in symbols:
+            for target, cache, split in zip(batch.targets, caches, split_batch(next_symbols, size, func.__name__)):
+                if type(split) is once:
+                    ### the cache releases the file before it is written to (see h5cache)
+                    cache.flush()
+                    target.write(split)
+                else:
+                    cache.add(split)
+
+        for cache in caches:
+            cache.flush()
+
+    ### Standard Functions
+    else:
+        if symbols is None:
+            symbols = dict()
+        if not isinstance(symbols, dict):
+            raise ValueError(f"Invalid return type: function '{name}' needs to return a dictionary of symbols")
+
+        for target, split in zip(batch.targets, split_batch(symbols, size, func.__name__)):
+            target.write(split)
+
+    ### atomically commit the written output to the targets
+    for target in batch.targets:
+        target.commit()
+
+def execute_batch(batch, name, cache_time, number, total):
+    t_start = time()
+    desc = f'({1+number}-{number+len(batch.targets)}/{total}) {name}'
+    numpipe._pbars.set_desc(desc)
+    numpipe._pbars.make_placeholder()
+    if is_windows():
+        numpipe._pbars.set_njobs(total)
+
+    caches = []
+    try:
+        run_batch(batch, name, cache_time, caches)
+    except:
+        for cache in caches:
+            cache.flush()
+        for target in batch.targets:
+            target.discard(temporary_only=True)
+        numpipe._pbars.fail_bar()
+        raise Exception(f"Cached function '{name}' failed:\n" + "".join(traceback.format_exception(*sys.exc_info())))
+
+    with numpipe._pbars.lock:
+        numpipe._pbars.finish_bar()
+
+    return time() - t_start
+
+def execute_batch_debug(batch, name, cache_time, number, total):
+    t_start = time()
+    desc = f'({1+number}-{number+len(batch.targets)}/{total}) {name}'
+    numpipe._pbars.set_desc(desc)
+    numpipe._pbars.make_placeholder()
+
+    caches = []
+    try:
+        run_batch(batch, name, cache_time, caches)
+    except Exception as err:
+        for cache in caches:
+            cache.flush()
+        for target in batch.targets:
+            target.discard(temporary_only=True)
+        numpipe._pbars.fail_bar()
+        raise err
+
+    with numpipe._pbars.lock:
+        numpipe._pbars.finish_bar()
+
+    return time() - t_start
+
+def execute_with_timeout(timeout, func, args):
+    """
+    Call an execution function and raise a TimeoutError inside it if it runs longer than timeout seconds
+
+    The timeout uses SIGALRM, so it is only enforced in the main thread of a process and not on Windows
+    """
+    if not hasattr(signal, 'SIGALRM') or threading.current_thread() is not threading.main_thread():
+        return func(*args)
+
+    def alarm(signum, frame):
+        raise TimeoutError(f'the block did not finish within {timeout} seconds')
+
+    handler = signal.signal(signal.SIGALRM, alarm)
+    signal.setitimer(signal.ITIMER_REAL, timeout)
+    try:
+        return func(*args)
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, handler)
+
 # @yield_traceback
-def execute_block(block, name, instances, cache_time, number, total):
+def execute_block(block, name, is_instance, cache_time, number, total):
+    t_start = time()
     desc = f'({1+number}/{total}) {name}'
     numpipe._pbars.set_desc(desc)
     numpipe._pbars.make_placeholder()
@@ -111,19 +242,23 @@ def execute_block(block, name, instances, cache_time, number, total):
     cache = None
     try:
         func = block.deferred_function
-        if func.__name__ in instances and name in instances[func.__name__]:
+        block.target.prepare()
+        if is_instance:
             ### write arguments if instance funcitont 
             block.target.write_args(func.kwargs)
+        streaming.started(block.target)
 
         symbols = func()
 
         ### Generator functions
         if isinstance(symbols, types.GeneratorType):
-            cache = h5cache(block.target.filepath, cache_time=cache_time)
+            cache = block.target.cache(cache_time=streaming.cache_time(block.target, cache_time))
 
             ### iterate over all symbols, caching each one
             for next_symbols in symbols:
                 if type(next_symbols) is once:
+                    ### the cache releases the file before it is written to (see h5cache)
+                    cache.flush()
                     block.target.write(next_symbols)
                 else:
                     cache.add(next_symbols)
@@ -140,23 +275,36 @@ def execute_block(block, name, instances, cache_time, number, total):
             else:
                 raise ValueError(f"Invalid return type: function '{name}' needs to return a dictionary of symbols")
 
+        ### atomically commit the written output to the target
+        block.target.commit()
+
+        ### the output is kept in memory for the blocks that depend on it (see numpipe.handoff)
+        if isinstance(symbols, dict):
+            handoff.capture(symbols)
+
     except:
         if cache is not None:
             cache.flush()
+        block.target.discard(temporary_only=True)
         numpipe._pbars.fail_bar()
         raise Exception(f"Cached function '{name}' failed:\n" + "".join(traceback.format_exception(*sys.exc_info())))
 
     with numpipe._pbars.lock:
         numpipe._pbars.finish_bar()
 
-def execute_block_debug(block, name, instances, cache_time, number, total):
+    return time() - t_start
+
+def execute_block_debug(block, name, is_instance, cache_time, number, total):
+    t_start = time()
     desc = f'({1+number}/{total}) {name}'
     numpipe._pbars.set_desc(desc)
     numpipe._pbars.make_placeholder()
 
+    cache = None
     try:
         func = block.deferred_function
-        if func.__name__ in instances and name in instances[func.__name__]:
+        block.target.prepare()
+        if is_instance:
             ### write arguments if instance funcitont 
             block.target.write_args(func.kwargs)
 
@@ -164,11 +312,13 @@ def execute_block_debug(block, name, instances, cache_time, number, total):
 
         ### Generator functions
         if isinstance(symbols, types.GeneratorType):
-            cache = h5cache(block.target.filepath, cache_time=cache_time)
+            cache = block.target.cache(cache_time=cache_time)
 
             ### iterate over all symbols, caching each one
             for next_symbols in symbols:
                 if type(next_symbols) is once:
+                    ### the cache releases the file before it is written to (see h5cache)
+                    cache.flush()
                     block.target.write(next_symbols)
                 else:
                     cache.add(next_symbols)
@@ -185,9 +335,17 @@ def execute_block_debug(block, name, instances, cache_time, number, total):
             else:
                 raise ValueError(f"Invalid return type: function '{name}' needs to return a dictionary of symbols")
 
+        ### atomically commit the written output to the target
+        block.target.commit()
+
     except Exception as err:
+        if cache is not None:
+            cache.flush()
+        block.target.discard(temporary_only=True)
         numpipe._pbars.fail_bar()
         raise err
 
     with numpipe._pbars.lock:
         numpipe._pbars.finish_bar()
+
+    return time() - t_start
@@ -0,0 +1,329 @@
+"""
+Executors that run blocks for the scheduler
+
+An executor runs execution functions (see numpipe.execution) with their arguments somewhere else than
+the scheduler's process. The scheduler submits work with a key, and waits for (key, success, value)
+results, where value is the return value of the function (its runtime) or the exception it raised.
+Submitted work may be queued until a worker is free; started returns the keys of the work that workers
+started since it was last called.
+Work that is no longer needed can be cancelled; executors that cannot interrupt a running block still
+return its result, which the scheduler ignores
+"""
+
+import os
+import signal
+import logging
+from time import sleep, time
+from multiprocessing import Process, Pipe, resource_tracker
+from multiprocessing.connection import wait as wait_connections
+
+import numpipe
+from numpipe.sharedmem import shared_arrays
+from numpipe.handoff import output_store
+
+MEMORY_POLL_INTERVAL = .5      # seconds between checks of the memory of the workers
+
+class worker_error(Exception):
+    """a block did not finish because its worker process died or was killed"""
+
+def resident_memory(pid):
+    """resident memory of a process in bytes, or None if it cannot be read (only supported on Linux)"""
+    try:
+        with open(f'/proc/{pid}/statm') as f:
+            return int(f.read().split()[1])*os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return None
+
+def _exit(signum, frame):
+    raise SystemExit(1)
+
+def _pool_worker(conn):
+    """run blocks received over a pipe until the pipe is closed"""
+    ### on termination, the stack is unwound so that shared locks (e.g. of the progress bars) are released
+    signal.signal(signal.SIGTERM, _exit)
+
+    while True:
+        try:
+            message = conn.recv()
+        except EOFError:
+            return
+        if message is None:
+            return
+
+        key, func, args = message
+        try:
+            result = (key, True, func(*args))
+        except Exception as err:
+            result = (key, False, err)
+
+        conn.send(result)
+
+class _pool_process:
+    """a worker process of a pool_executor, and the block it runs"""
+    def __init__(self):
+        self.conn, child_conn = Pipe()
+        self.process = Process(target=_pool_worker, args=(child_conn,), daemon=True)
+        self.process.start()
+        child_conn.close()
+        self.task = None
+        self.num_tasks = 0
+
+    def kill(self, timeout=1):
+        """terminate the process, and kill it if it did not exit within timeout seconds"""
+        self.process.terminate()
+        self.process.join(timeout)
+        if self.process.is_alive():
+            self.process.kill()
+            self.process.join()
+        self.conn.close()
+
+class pool_executor:
+    def __init__(self, processes, max_tasks=None, max_memory=None, shared=None, handoff_memory=None):
+        """
+        Run blocks in a pool of local processes; a worker that runs a cancelled block is killed and replaced
+
+        Arguments:
+            processes     number of processes
+            max_tasks     number of blocks after which a worker is replaced by a new process (default: no limit)
+            max_memory    resident memory (in GB) of a worker above which it is replaced by a new process after its
+                          block, or killed (and its block failed) while the block runs (default: no limit)
+            shared        list of read-only arrays in the arguments of the blocks, copied once into shared memory
+                          and sent to the workers by reference (see numpipe.sharedmem)
+            handoff_memory  memory (in GB) of the outputs of finished blocks kept in shared memory for the blocks
+                            that depend on them (see numpipe.handoff; default: outputs are not kept)
+        """
+        ### shared memory is created before the workers are started (see shared_arrays)
+        self.shared = shared_arrays(shared or [])
+
+        ### outputs are published by the workers, and owned by the store in this process; the workers share the
+        ### resource tracker of this process, so that outputs outlive the workers that published them
+        self.handoff = None
+        if handoff_memory:
+            resource_tracker.ensure_running()
+            self.handoff = output_store(handoff_memory*1e9)
+
+        self.num_workers = processes
+        self.workers = [_pool_process() for i in range(processes)]
+        self.pending = []
+        self.dispatched = []        # keys of the blocks sent to a worker since the last call of started
+        self.max_tasks = max_tasks
+        self.max_memory = max_memory
+        self.last_memory_poll = 0
+
+        if max_memory is not None and resident_memory(os.getpid()) is None:
+            logging.warning('the memory of the workers cannot be measured on this platform, and is not limited')
+            self.max_memory = None
+
+        ### a few extra blocks are queued to keep the workers busy
+        self.capacity = 2*processes
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        for worker in self.workers:
+            if worker.process.is_alive():
+                worker.kill()
+
+        self.shared.close()
+        if self.handoff is not None:
+            self.handoff.close()
+
+    def submit(self, key, func, args):
+        self.pending.append((key, func, args))
+        self._send()
+
+    def _send(self):
+        for worker in self.workers:
+            if not self.pending:
+                return
+            if worker.task is None:
+                worker.task = self.pending.pop(0)
+                worker.conn.send_bytes(self.shared.dumps(worker.task))
+                self.dispatched.append(worker.task[0])
+
+    def started(self):
+        """return the keys of the blocks that a worker started since the last call"""
+        keys, self.dispatched = self.dispatched, []
+        return keys
+
+    def _replace(self, worker):
+        """kill a worker and start a new one in its place"""
+        worker.kill()
+        self.workers[self.workers.index(worker)] = _pool_process()
+
+    def cancel(self, key):
+        """cancel a block: drop it if it is pending, or kill the worker that runs it; return True (the block is stopped)"""
+        self.pending = [task for task in self.pending if task[0] != key]
+        for worker in self.workers:
+            if worker.task is not None and worker.task[0] == key:
+                self._replace(worker)
+        self._send()
+        return True
+
+    def wait(self, timeout):
+        """wait up to timeout seconds for results, and return all available results"""
+        busy = [worker for worker in self.workers if worker.task is not None]
+        ready = wait_connections([worker.conn for worker in busy] + [worker.process.sentinel for worker in busy], timeout)
+
+        results = []
+        for worker in busy:
+            if worker.conn in ready:
+                try:
+                    results.append(worker.conn.recv())
+                    worker.task = None
+                    worker.num_tasks += 1
+                    if self._exhausted(worker):
+                        self._replace(worker)
+                    continue
+                except EOFError:
+                    pass
+
+            if worker.conn in ready or worker.process.sentinel in ready:
+                worker.process.join(1)
+                exitcode = worker.process.exitcode
+                message = f'the worker process died while running the block (exit code {exitcode})'
+                if exitcode == -signal.SIGKILL:
+                    message += ', possibly killed by the out-of-memory killer'
+                results.append((worker.task[0], False, worker_error(message)))
+                self._replace(worker)
+
+        results += self._check_memory()
+        self._send()
+        return results
+
+    def _exhausted(self, worker):
+        """return true if an idle worker is to be replaced, because of max_tasks or max_memory"""
+        if self.max_tasks is not None and worker.num_tasks >= self.max_tasks:
+            return True
+        if self.max_memory is not None:
+            memory = resident_memory(worker.process.pid)
+            return memory is not None and memory > self.max_memory*1e9
+
+        return False
+
+    def _check_memory(self):
+        """kill the workers whose block exceeds max_memory, and return the failed results of their blocks"""
+        if self.max_memory is None or time() - self.last_memory_poll < MEMORY_POLL_INTERVAL:
+            return []
+
+        self.last_memory_poll = time()
+        results = []
+        for worker in self.workers:
+            if worker.task is None:
+                continue
+
+            memory = resident_memory(worker.process.pid)
+            if memory is not None and memory > self.max_memory*1e9:
+                message = f'the worker process used {memory/1e9:.2f} GB, more than the limit of {self.max_memory:g} GB, and was killed'
+                results.append((worker.task[0], False, worker_error(message)))
+                self._replace(worker)
+
+        return results
+
+    def close(self):
+        """wait for the workers to exit"""
+        for worker in self.workers:
+            worker.conn.send(None)
+        for worker in self.workers:
+            worker.process.join()
+
+### tags of MPI messages
+TASK = 1
+RESULT = 2
+
+def mpi_comm():
+    from mpi4py import MPI
+    return MPI.COMM_WORLD
+
+class mpi_executor:
+    def __init__(self, comm):
+        """
+        Run blocks on the other ranks of an MPI communicator (see mpi_worker); rank 0 is the scheduler
+
+        Arguments:
+            comm      the MPI communicator
+        """
+        if comm.Get_size() < 2:
+            raise ValueError('the mpi executor needs at least 2 MPI ranks (one scheduler and one or more workers)')
+
+        self.comm = comm
+        self.idle = list(range(comm.Get_size() - 1, 0, -1))
+        self.pending = []
+        self.dispatched = []        # keys of the blocks sent to a worker since the last call of started
+        self.num_workers = comm.Get_size() - 1
+        self.handoff = None
+
+        ### every worker has a block ready to receive when it reports back
+        self.capacity = 2*(comm.Get_size() - 1)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def submit(self, key, func, args):
+        self.pending.append((key, func, args))
+        self._send()
+
+    def _send(self):
+        while self.idle and self.pending:
+            key, func, args = self.pending.pop(0)
+            self.comm.send(('task', key, func, args), dest=self.idle.pop(), tag=TASK)
+            self.dispatched.append(key)
+
+    def started(self):
+        """return the keys of the blocks that a worker started since the last call"""
+        keys, self.dispatched = self.dispatched, []
+        return keys
+
+    def cancel(self, key):
+        """cancel a pending block; return False if the block already runs (it finishes, and its result is returned)"""
+        num_pending = len(self.pending)
+        self.pending = [task for task in self.pending if task[0] != key]
+        return len(self.pending) < num_pending
+
+    def wait(self, timeout):
+        """wait up to timeout seconds for results, and return all available results"""
+        from mpi4py import MPI
+
+        deadline = time() + timeout
+        results = []
+        while True:
+            status = MPI.Status()
+            while self.comm.Iprobe(source=MPI.ANY_SOURCE, tag=RESULT, status=status):
+                results.append(self.comm.recv(source=status.Get_source(), tag=RESULT))
+                self.idle.append(status.Get_source())
+                status = MPI.Status()
+
+            self._send()
+            if results or time() > deadline:
+                return results
+            sleep(.005)
+
+    def close(self):
+        pass
+
+    def shutdown(self):
+        """stop all workers"""
+        for rank in range(1, self.comm.Get_size()):
+            self.comm.send(('stop',), dest=rank, tag=TASK)
+
+def mpi_worker(comm):
+    """run blocks sent by rank 0 (see mpi_executor) until it sends a stop message"""
+    while True:
+        message = comm.recv(source=0, tag=TASK)
+        if message[0] == 'stop':
+            return
+
+        _, key, func, args = message
+
+        ### a worker shows one progress bar at a time
+        numpipe._pbars.reset()
+        try:
+            result = (key, True, func(*args))
+        except Exception as err:
+            result = (key, False, err)
+
+        comm.send(result, dest=0, tag=RESULT)
@@ -3,32 +3,203 @@ Code related to file io:
     * reading / writing symbols to the hdf5 file
 """
 
-import h5py
-from numpipe.utility import Bunch
+import math
+from numpipe.utility import Bunch, prefetch_iter, lazy_import
 
-def load_symbols(filepath):
-    """Load all symbols from h5 filepath"""
+h5py = lazy_import('h5py')
+
+def record_selection(records=None, stride=None):
+    """Combine a record range and a stride into a single slice along the record axis
+
+       Arguments:
+           records       slice of records to select (default: all records)
+           stride        step between selected records (default: 1)
+    """
+    if records is None:
+        records = slice(None)
+    elif isinstance(records, int):
+        records = slice(records, records+1 if records != -1 else None)
+    elif not isinstance(records, slice):
+        raise TypeError(f"Invalid records argument: expected a slice, not '{type(records).__name__}'")
+
+    step = 1 if records.step is None else records.step
+    if stride is not None:
+        step *= stride
+
+    if step < 1:
+        raise ValueError('Invalid records argument: only positive strides are supported')
+
+    return slice(records.start, records.stop, step)
+
+def is_record_dataset(dset):
+    """Return true if dset is an extendable dataset of records (written by a generator function)"""
+    return dset.maxshape is not None and len(dset.maxshape) > 0 and dset.maxshape[0] is None
+
+def read_dataset(dset, selection=slice(None)):
+    """Read a dataset, applying a record selection if the dataset consists of records
+
+       Arguments:
+           dset          h5py dataset
+           selection     slice along the record axis
+    """
+    if selection == slice(None) or not is_record_dataset(dset):
+        return dset[...]
+
+    start, stop, step = selection.indices(dset.shape[0])
+    return dset[start:stop:step]
+
+def split_symbols(symbols):
+    """Split a list of symbol names into (top-level names, args names)
+
+       'args' selects the entire args group and 'args.name' selects a single argument.
+       None is returned in place of a list when everything should be selected.
+    """
+    if symbols is None:
+        return None, None
+
+    if isinstance(symbols, str):
+        symbols = [symbols]
+
+    names = []
+    arg_names = []
+    for symbol in symbols:
+        if symbol == 'args':
+            arg_names = None
+        elif symbol.startswith('args.'):
+            if arg_names is not None:
+                arg_names.append(symbol[5:])
+        else:
+            names.append(symbol)
+
+    return names, arg_names
+
+def load_group(group, symbols=None, records=None, stride=None):
+    """Load symbols from an h5py group (see load_symbols)"""
+    names, arg_names = split_symbols(symbols)
+    selection = record_selection(records, stride)
+
+    if names is None:
+        names = [name for name in group if not isinstance(group[name], h5py.Group)]
 
     collection = {}
-    args = {}
-    with h5py.File(filepath, 'r') as f:
-        for dset_name in f:
-            if isinstance(f[dset_name], h5py.Group):
-                continue
-            collection[dset_name] = f[dset_name][...]
-
-        bunch = Bunch(collection)
-        if 'args' in f:
-            for dset_name in f['args']:
-                args[dset_name] = f['args'][dset_name][...]
-            if args:
-                bunch['args'] = Bunch(args)
+    for dset_name in names:
+        if dset_name not in group:
+            raise KeyError(f"Invalid symbol: '{dset_name}' does not exist in '{group.file.filename}'")
+        collection[dset_name] = read_dataset(group[dset_name], selection)
+
+    bunch = Bunch(collection)
+    if 'args' in group and (arg_names is None or arg_names):
+        if arg_names is None:
+            arg_names = list(group['args'])
+
+        args = {}
+        for dset_name in arg_names:
+            args[dset_name] = group['args'][dset_name][...]
+        if args:
+            bunch['args'] = Bunch(args)
 
     return bunch
 
+def load_symbols(filepath, symbols=None, records=None, stride=None, group='/', swmr=False):
+    """Load symbols from h5 filepath
+
+       Arguments:
+           filepath      path to file
+           symbols       list of symbol names to load (default: all); use 'args' or 'args.name' for arguments
+           records       slice of records to load from generator outputs (default: all)
+           stride        step between loaded records (default: 1)
+           group         name of the group in the h5 file that holds the symbols (default: root)
+           swmr          read a file that is being written in SWMR mode (see h5cache), without locking it
+    """
+    kwargs = dict(swmr=True, locking=False) if swmr else dict()
+    with h5py.File(filepath, 'r', **kwargs) as f:
+        return load_group(f[group], symbols=symbols, records=records, stride=stride)
+
+def read_new_records(filepath, positions, names=None, group='/', swmr=False):
+    """Read the records of generator outputs past a position per symbol, e.g. the records flushed since the last read
+
+       Arguments:
+           filepath      path to file
+           positions     {name: number of records already read} (default: 0)
+           names         list of record symbol names (default: all record symbols); symbols not written yet are skipped
+           group         name of the group in the h5 file that holds the symbols (default: root)
+           swmr          read a file that is being written in SWMR mode (see load_symbols)
+
+       Returns a {name: array of records} dictionary
+    """
+    kwargs = dict(swmr=True, locking=False) if swmr else dict()
+    with h5py.File(filepath, 'r', **kwargs) as f:
+        g = f[group]
+        if names is None:
+            names = [name for name in g if isinstance(g[name], h5py.Dataset) and is_record_dataset(g[name])]
+
+        return {name: g[name][positions.get(name, 0):] for name in names if name in g}
+
+def stream_chunk_size(dsets, chunk=None):
+    """Determine the number of records per streamed block, aligned to the HDF5 chunk boundaries
+
+       Arguments:
+           dsets         list of h5py record datasets
+           chunk         requested number of records per block (rounded up to a chunk boundary)
+    """
+    size = 1
+    for dset in dsets:
+        if dset.chunks is not None:
+            size = size*dset.chunks[0] // math.gcd(size, dset.chunks[0])
+
+    if chunk is not None:
+        size *= max(1, -(-chunk // size))
+
+    return size
+
+def stream_group(group, symbols=None, chunk=None, prefetch=True):
+    """Iterate over aligned blocks of records from an h5py group (see stream_symbols)"""
+    names, _ = split_symbols(symbols)
+
+    if names is None:
+        names = [name for name in group if isinstance(group[name], h5py.Dataset)
+                                          and is_record_dataset(group[name])]
+
+    dsets = dict()
+    for name in names:
+        if name not in group:
+            raise KeyError(f"Invalid symbol: '{name}' does not exist in '{group.file.filename}'")
+        if not is_record_dataset(group[name]):
+            raise ValueError(f"Invalid symbol: '{name}' was not yielded by a generator function and cannot be streamed")
+        dsets[name] = group[name]
+
+    if not dsets:
+        return
+
+    num_records = min(dset.shape[0] for dset in dsets.values())
+    size = stream_chunk_size(dsets.values(), chunk)
+
+    def read(start):
+        stop = min(start + size, num_records)
+        return Bunch({name: dset[start:stop] for name, dset in dsets.items()})
+
+    starts = range(0, num_records, size)
+    if prefetch:
+        yield from prefetch_iter(read(start) for start in starts)
+    else:
+        yield from (read(start) for start in starts)
+
+def stream_symbols(filepath, symbols=None, chunk=None, prefetch=True, group='/'):
+    """Iterate over aligned blocks of records of generator outputs in an h5 file
+
+       Arguments:
+           filepath      path to file
+           symbols       list of record symbol names to stream (default: all record symbols)
+           chunk         minimum number of records per block, rounded up to the HDF5 chunk boundary (default: one chunk)
+           prefetch      read the next block in a background thread (default: True)
+           group         name of the group in the h5 file that holds the symbols (default: root)
+    """
+    with h5py.File(filepath, 'r') as f:
+        yield from stream_group(f[group], symbols=symbols, chunk=chunk, prefetch=prefetch)
+
 def write_symbols(filepath, symbols):
     """Write all symbols to h5 file, where symbols is a {name: value} dictionary
-       
+
        Arguments:
            filepath      path to file
            symbols       {name: vale} dictionary
@@ -1,6 +1,8 @@
-import h5py
 import numpy as np
 import time
+from numpipe.utility import lazy_import
+
+h5py = lazy_import('h5py')
 
 def auto_chunk_size(size_record):
     """
@@ -70,8 +72,12 @@ class npcache:
         """empty the cache (cached data will be overwritten in future adds)"""
         self.current_record = 0
 
+def create_record_dataset(f, h5path, shape, dtype, chunk_size):
+    """create an empty resizable dataset of records of the given shape"""
+    return f.create_dataset(h5path, shape=(0,) + shape, chunks=(chunk_size,) + shape, maxshape=(None,) + shape, dtype=dtype)
+
 class h5cache:
-    def __init__(self, filepath, cache_size='100M', cache_time=300):
+    def __init__(self, filepath, cache_size='100M', cache_time=300, swmr=False):
         """
         dictionary of (label, numpy array) to be outputed to an hdf5 file
 
@@ -79,14 +85,20 @@ class h5cache:
             filepath     filepath to h5 file
             cache_size   cache memory size (default: 100 MB)
             cache_time   time (in seconds) to hold the cache (default: 5 minutes)
+            swmr         if True, hold the file open in single-writer/multiple-reader mode between flushes, so that
+                         other processes can read the flushed records while they are written (the file must have
+                         been created with libver='latest'); flush releases the file
         """
         self.filepath   = filepath
         self.cache_size = strformat_to_bytes(cache_size)
         self.cache_time = cache_time
         self.time_start = time.time()
+        self.swmr = swmr
 
         self.cache = dict()
         self.h5path = dict()
+        self.file = None                # file held open in SWMR mode
+        self.new_datasets = dict()      # {h5path: (shape, dtype, chunk_size)} of datasets not yet created in SWMR mode
 
     def add(self, records, group='/', chunk_size=None):
         """
@@ -113,8 +125,12 @@ class h5cache:
 
                 h5path = f'{group}/{name}'
 
-                with h5py.File(self.filepath, 'a') as f:
-                    dset = f.create_dataset(h5path, shape=(0,) + shape, chunks=(chunk_size,) + shape, maxshape=(None,) + shape, dtype=dtype)
+                if self.swmr:
+                    ### datasets cannot be created in SWMR mode, and are created when the file is next opened
+                    self.new_datasets[h5path] = (shape, dtype, chunk_size)
+                else:
+                    with h5py.File(self.filepath, 'a') as f:
+                        create_record_dataset(f, h5path, shape, dtype, chunk_size)
 
                 self.h5path[name] = h5path
                 self.cache[name] = npcache(shape, dtype)
@@ -124,19 +140,54 @@ class h5cache:
             is_full = max(is_full, record_is_full)
 
         if is_full or (time.time() - self.time_start) > self.cache_time:
-            self.flush()
+            self._write()
             self.time_start = time.time() 
 
+    def _open(self):
+        """the file in SWMR mode, opened (and reopened to create new datasets) as needed"""
+        if self.new_datasets and self.file is not None:
+            self.close()
+
+        if self.file is None:
+            self.file = h5py.File(self.filepath, 'a', libver='latest')
+            for h5path, (shape, dtype, chunk_size) in self.new_datasets.items():
+                create_record_dataset(self.file, h5path, shape, dtype, chunk_size)
+            self.new_datasets = dict()
+            self.file.swmr_mode = True
+
+        return self.file
+
+    def _write(self):
+        """write the cached data to the h5 file"""
+        if self.swmr:
+            f = self._open()
+            self._write_records(f)
+            f.flush()
+        else:
+            with h5py.File(self.filepath, 'a') as f:
+                self._write_records(f)
+
+    def _write_records(self, f):
+        for name in self.cache.keys():
+            dset = f[self.h5path[name]]
+            cache = self.cache[name]
+            if cache.current_record == 0:
+                continue
+
+            dset.resize((dset.shape[0] + cache.current_record,) + cache.shape)
+            dset[-cache.current_record:] = cache.data[:cache.current_record]
+
+            cache.clear()
+
     def flush(self):
         """
-        Flush all remaining cached data to h5 file
+        Flush all remaining cached data to h5 file, and release the file
         """
-        with h5py.File(self.filepath, 'a') as f:
-            for name in self.cache.keys():
-                dset = f[self.h5path[name]]
-                cache = self.cache[name]
-
-                dset.resize((dset.shape[0] + cache.current_record,) + cache.shape)
-                dset[-cache.current_record:] = cache.data[:cache.current_record]
-
-                cache.clear()
+        self._write()
+        self.close()
+
+    def close(self):
+        """release the file held open in SWMR mode"""
+        if self.file is not None:
+            self.file.close()
+            self.file = None
@@ -0,0 +1,195 @@
+"""
+In-memory handoff of the outputs of finished blocks to the blocks that depend on them
+
+A block with dependents publishes the symbols it returned (see execute_block) in shared memory segments, in
+addition to writing its target. The scheduler keeps the published outputs within a memory budget (see output_store)
+and sends the outputs of its dependencies along with a block, so that job.load inside the block returns read-only
+views of the shared memory instead of reading the target. Outputs that are not available are read from the target
+"""
+
+from multiprocessing import shared_memory
+import numpy as np
+
+from numpipe.fileio import split_symbols
+from numpipe.utility import Bunch
+
+_available = dict()     # {target path: output} of the dependencies of the running block
+_captured = None        # list that receives the symbols returned by the running block, if they are published
+_attached = []          # segments attached by the running block
+
+def execute_with_handoff(available, capture, func, args):
+    """
+    Call an execution function with the outputs of its dependencies available to load
+
+    Arguments:
+        available    dictionary of {target path: output} (see publish)
+        capture      if True, publish the symbols returned by the block
+        func         execution function
+        args         arguments of the execution function
+
+    Returns (return value of func, output of the block or None)
+    """
+    global _available, _captured
+    _available = available
+    _captured = [] if capture else None
+    try:
+        value = func(*args)
+        output = publish(_captured[0]) if _captured else None
+    finally:
+        _available = dict()
+        _captured = None
+        _release_attached()
+
+    return value, output
+
+def capture(symbols):
+    """called by execute_block with the symbols returned by the block, after its target is committed"""
+    if _captured is not None:
+        _captured.append(symbols)
+
+def publish(symbols):
+    """
+    Copy symbols into shared memory segments, to be owned by the scheduler
+
+    Returns the output as a dictionary of {name: (segment name, shape, dtype)}, or None if a symbol is not
+    a numeric array (such symbols are only loaded from the target)
+    """
+    arrays = {name: np.asarray(value) for name, value in symbols.items()}
+    if not arrays or any(array.dtype.kind not in 'biufc' for array in arrays.values()):
+        return None
+
+    output = dict()
+    for name, array in arrays.items():
+        segment_name = None
+        if array.nbytes:
+            segment = shared_memory.SharedMemory(create=True, size=array.nbytes)
+            np.ndarray(array.shape, dtype=array.dtype, buffer=segment.buf)[...] = array
+            segment_name = segment.name
+            segment.close()
+        output[name] = (segment_name, array.shape, array.dtype)
+
+    return output
+
+def nbytes(output):
+    return sum(int(np.prod(shape))*dtype.itemsize for _, shape, dtype in output.values())
+
+def release(output):
+    """remove the segments of an output"""
+    for segment_name, _, _ in output.values():
+        if segment_name is None:
+            continue
+        try:
+            segment = shared_memory.SharedMemory(name=segment_name)
+        except FileNotFoundError:
+            continue
+        segment.close()
+        segment.unlink()
+
+def _release_attached():
+    """detach the segments attached by the block that finished; segments still referenced by arrays stay attached"""
+    global _attached
+    remaining = []
+    for segment in _attached:
+        try:
+            segment.close()
+        except BufferError:
+            remaining.append(segment)
+
+    _attached = remaining
+
+def load(target, symbols=None, records=None, stride=None):
+    """
+    Load symbols of a target from the output of a dependency (see numpipe.storage.target.load)
+
+    Returns None if the output is not available, or records are selected, so that the target is loaded instead
+    """
+    output = _available.get(str(target))
+    if output is None or records is not None or stride is not None:
+        return None
+
+    names, arg_names = split_symbols(symbols)
+    if names is None:
+        names = list(output)
+    if any(name not in output for name in names):
+        return None
+
+    collection = dict()
+    for name in names:
+        segment_name, shape, dtype = output[name]
+        if segment_name is None:
+            collection[name] = np.empty(shape, dtype=dtype)
+            continue
+        try:
+            segment = shared_memory.SharedMemory(name=segment_name)
+        except FileNotFoundError:
+            ### the output was removed from the store
+            return None
+        _attached.append(segment)
+        array = np.ndarray(shape, dtype=dtype, buffer=segment.buf)
+        array.flags.writeable = False
+        collection[name] = array
+
+    bunch = Bunch(collection)
+
+    ### arguments are small, and are read from the target
+    if arg_names is None or arg_names:
+        arg_symbols = ['args'] if arg_names is None else [f'args.{name}' for name in arg_names]
+        args = target.load(symbols=arg_symbols)
+        if hasattr(args, 'args'):
+            bunch['args'] = args.args
+
+    return bunch
+
+class output_store:
+    def __init__(self, budget):
+        """
+        Outputs of finished blocks in shared memory, owned by the scheduler; the oldest outputs are removed
+        to stay within the budget
+
+        Arguments:
+            budget      memory budget (in bytes)
+        """
+        self.budget = budget
+        self.outputs = dict()       # {target path: output}, oldest first
+        self.function_paths = dict()     # {function id: set of target paths}
+        self.size = 0
+
+    def add(self, fid, path, output):
+        """add the output of a block of a function"""
+        self.remove(path)
+        if nbytes(output) > self.budget:
+            release(output)
+            return
+
+        self.outputs[path] = output
+        self.function_paths.setdefault(fid, dict())[path] = None
+        self.size += nbytes(output)
+        while self.size > self.budget:
+            self.remove(next(iter(self.outputs)))
+
+    def remove(self, path):
+        output = self.outputs.pop(path, None)
+        if output is None:
+            return
+
+        for paths in self.function_paths.values():
+            paths.pop(path, None)
+        self.size -= nbytes(output)
+        release(output)
+
+    def available(self, dep_fids, dep_paths):
+        """the outputs in the store of all blocks of functions, and of individual blocks"""
+        available = dict()
+        for fid in dep_fids:
+            for path in self.function_paths.get(fid, ()):
+                available[path] = self.outputs[path]
+        for path in dep_paths:
+            if path in self.outputs:
+                available[path] = self.outputs[path]
+
+        return available
+
+    def close(self):
+        """remove all outputs"""
+        for path in list(self.outputs):
+            self.remove(path)
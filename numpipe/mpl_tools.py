@@ -1,8 +1,7 @@
-import matplotlib.pyplot as plt
 import pathlib
-from tqdm import tqdm
 
 def set_theme(name):
+    import matplotlib.pyplot as plt
     if name == 'normal':
         return
     elif name == 'xkcd':
@@ -28,6 +27,7 @@ def save_figures(prefix, dirpath=None, figures=None, exempt=None, ext='png'):
         exempt    list of figure numbers to not display, overriding figures argument (default: none)
         ext       file format extension (default: png)
     """
+    import matplotlib.pyplot as plt
     all_fignums = plt.get_fignums()
     if figures is None:
         fignums = all_fignums
@@ -53,6 +53,7 @@ def save_animation(animation, filename, *args, **kwargs):
             *args       additional arguments to pass to anim.save
             **kwargs    additional keyword arguments to pass to anim.save
     """
+    from tqdm import tqdm
     if isinstance(animation, list):
         anim = animation[0]
         extra_anim = animation[1:]
@@ -1,4 +1,10 @@
+import os
+import hmac
 import struct
+import hashlib
+import secrets
+import threading
+from time import time
 
 def send_msg(sock, msg):
     """Prefix each message with a 4-byte length (network byte order)"""
@@ -23,3 +29,189 @@ def recvall(sock, n):
             return None
         data += packet
     return data
+
+### authenticated channels (used by the TCP coordinator and its workers, see numpipe.server)
+
+NONCE_SIZE = 32
+TAG_SIZE = 32
+HANDSHAKE_TIMEOUT = 10      # seconds to complete the handshake of a new connection
+
+class authentication_error(Exception):
+    """the other end of a connection does not have the key, or a message was altered"""
+
+def load_authkey(keyfile, create=False):
+    """
+    The shared key of a coordinator and its workers: network.authkey in the config (or the environment variable
+    NUMPIPE_NETWORK__AUTHKEY), otherwise the content of keyfile
+
+    Arguments:
+        keyfile     path of the key file, readable by the workers (e.g. on a shared filesystem)
+        create      if True, create the key file with a random key if it does not exist (readable only by the user)
+    """
+    from numpipe import config
+    key = config.get_config()['network']['authkey']
+    if key:
+        return key.encode()
+
+    if create and not os.path.exists(keyfile):
+        fd = os.open(keyfile, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        with os.fdopen(fd, 'w') as f:
+            f.write(secrets.token_hex(32))
+
+    try:
+        with open(keyfile) as f:
+            return f.read().strip().encode()
+    except FileNotFoundError:
+        raise authentication_error(f"no key to authenticate with the coordinator: set network.authkey in the config (or NUMPIPE_NETWORK__AUTHKEY), or make '{keyfile}' readable") from None
+
+def _mac(key, *parts):
+    return hmac.new(key, b''.join(parts), hashlib.sha256).digest()
+
+def _server_reply(sock, key, server_nonce, reply):
+    """check the reply of a client to the nonce of the server, answer it, and return the key of the session"""
+    if reply is None or len(reply) != NONCE_SIZE + TAG_SIZE:
+        raise authentication_error('invalid handshake')
+
+    client_nonce, tag = reply[:NONCE_SIZE], reply[NONCE_SIZE:]
+    if not hmac.compare_digest(tag, _mac(key, b'client', server_nonce, client_nonce)):
+        raise authentication_error('the client does not have the key')
+
+    send_msg(sock, _mac(key, b'server', client_nonce, server_nonce))
+    return _mac(key, b'session', server_nonce, client_nonce)
+
+class channel:
+    def __init__(self, sock, session_key, is_server):
+        """
+        A connection on which every message is authenticated: messages carry an HMAC of their content and their
+        sequence number under a key of the session, so that messages are only accepted from the other end of the
+        session, unaltered and in order (messages are not encrypted). Use channel.accept and channel.connect
+
+        Arguments:
+            sock            connected socket
+            session_key     key of the session, derived in the handshake
+            is_server       True for the accepting end
+        """
+        self.sock = sock
+        self.session_key = session_key
+        self.send_label, self.recv_label = (b'S', b'C') if is_server else (b'C', b'S')
+        self.num_sent = 0
+        self.num_received = 0
+        self.lock = threading.Lock()
+
+    @classmethod
+    def accept(cls, sock, key):
+        """authenticate an accepted connection; raises authentication_error if the client does not have the key
+           (see server_handshake to authenticate connections without blocking)"""
+        sock.settimeout(HANDSHAKE_TIMEOUT)
+        try:
+            server_nonce = secrets.token_bytes(NONCE_SIZE)
+            send_msg(sock, server_nonce)
+            session_key = _server_reply(sock, key, server_nonce, recv_msg(sock))
+        except OSError as err:
+            raise authentication_error(f'handshake failed: {err}') from None
+        sock.settimeout(None)
+
+        return cls(sock, session_key, is_server=True)
+
+    @classmethod
+    def connect(cls, sock, key):
+        """authenticate a connection to a server; raises authentication_error if the server does not have the key"""
+        sock.settimeout(HANDSHAKE_TIMEOUT)
+        server_nonce = recv_msg(sock)
+        if server_nonce is None or len(server_nonce) != NONCE_SIZE:
+            raise authentication_error('invalid handshake')
+
+        client_nonce = secrets.token_bytes(NONCE_SIZE)
+        send_msg(sock, client_nonce + _mac(key, b'client', server_nonce, client_nonce))
+        tag = recv_msg(sock)
+        if tag is None or not hmac.compare_digest(tag, _mac(key, b'server', client_nonce, server_nonce)):
+            raise authentication_error('the server does not have the key')
+        sock.settimeout(None)
+
+        return cls(sock, _mac(key, b'session', server_nonce, client_nonce), is_server=False)
+
+    def send(self, data):
+        with self.lock:
+            tag = _mac(self.session_key, self.send_label, self.num_sent.to_bytes(8, 'big'), data)
+            send_msg(self.sock, data + tag)
+            self.num_sent += 1
+
+    def recv(self):
+        """the next message, or None if the connection is closed; raises authentication_error for an invalid message"""
+        message = recv_msg(self.sock)
+        if message is None:
+            return None
+
+        data, tag = message[:-TAG_SIZE], message[-TAG_SIZE:]
+        if len(message) < TAG_SIZE or not hmac.compare_digest(tag, _mac(self.session_key, self.recv_label, self.num_received.to_bytes(8, 'big'), data)):
+            raise authentication_error('invalid message')
+        self.num_received += 1
+
+        return data
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    def close(self):
+        self.sock.close()
+
+class server_handshake:
+    def __init__(self, sock, key):
+        """
+        The accepting end of a handshake (see channel.accept) that is driven by a select loop, so that a client that
+        is slow to authenticate does not block the server
+
+        Arguments:
+            sock     accepted socket
+            key      key (bytes) that the client must have
+        """
+        self.sock = sock
+        self.key = key
+        self.deadline = time() + HANDSHAKE_TIMEOUT
+        self.server_nonce = secrets.token_bytes(NONCE_SIZE)
+        self.buffer = b''
+
+        ### the nonce fits in the send buffer of a new socket
+        sock.setblocking(False)
+        send_msg(sock, self.server_nonce)
+
+    def expired(self):
+        return time() > self.deadline
+
+    def receive(self):
+        """
+        Read the available part of the reply of the client
+
+        Returns the authenticated channel once the reply is complete, otherwise None; raises authentication_error if
+        the client does not have the key
+        """
+        try:
+            data = self.sock.recv(4 + NONCE_SIZE + TAG_SIZE - len(self.buffer))
+        except BlockingIOError:
+            return None
+        except OSError as err:
+            raise authentication_error(f'handshake failed: {err}') from None
+        if not data:
+            raise authentication_error('the connection was closed during the handshake')
+
+        self.buffer += data
+        if len(self.buffer) < 4 + NONCE_SIZE + TAG_SIZE:
+            return None
+
+        msglen, = struct.unpack('>I', self.buffer[:4])
+        if msglen != NONCE_SIZE + TAG_SIZE:
+            raise authentication_error('invalid handshake')
+
+        self.sock.setblocking(True)
+        try:
+            session_key = _server_reply(self.sock, self.key, self.server_nonce, self.buffer[4:])
+        except OSError as err:
+            raise authentication_error(f'handshake failed: {err}') from None
+
+        return channel(self.sock, session_key, is_server=True)
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    def close(self):
+        self.sock.close()
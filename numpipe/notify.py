@@ -1,11 +1,6 @@
-import socket
 from datetime import datetime
 from time import time, sleep
 from numpipe import config
-import matplotlib.pyplot as plt
-import matplotlib as mpl
-
-DEFAULT_DELAY = config.get_config()['notifications']['delay_default']
 
 def get_bot_token():
     """get bot token from config file"""
@@ -39,14 +34,20 @@ def generate_time_str(time):
 
     return ret.strip()
 
-def check_idle_matplotlib(delay=DEFAULT_DELAY, check_every=.5):
+def check_idle_matplotlib(delay=None, check_every=.5):
     """
     Check if the user is idle based on matplotlib plot interactions (mouse move, key press, window interactions)
 
     Arguments:
-        delay         time (in seconds) to check before declaring idle
+        delay         time (in seconds) to check before declaring idle (default: from config file)
         check_every   time (in seconds) between interaction checks
     """
+    import matplotlib.pyplot as plt
+    import matplotlib as mpl
+
+    if delay is None:
+        delay = config.get_config()['notifications']['delay_default']
+
     nfigures_before = len(plt.get_fignums())
     if not nfigures_before:
         raise RuntimeError('cannot check for user idleness if there are no figures')
@@ -113,6 +114,7 @@ def send_message(message):
 def send_message_from(message, filename):
     """send a text message with """
     from telegram import Bot, ParseMode
+    import socket
 
     host = socket.gethostname()
     message = f'*{message}*' + f'\n_{host}:{filename}_'
@@ -129,6 +131,7 @@ def send_finish_message(filename, njobs, time, num_exceptions):
         time         runtime of the jobs
         num_exceptions   number of jobs that threw exceptions
     """
+    import socket
     host = socket.gethostname()
     time_str = generate_time_str(time)
     tab = '    '
@@ -157,6 +160,7 @@ def send_images(filename, exempt=[]):
         filename     name of the python file (without .py extension)
         exempt       (optional) a list of figure numbers to not send
     """
+    import matplotlib.pyplot as plt
     if not plt.get_fignums():
         return
 
@@ -209,6 +213,7 @@ def send_videos(anims):
 
     from telegram import Bot
     import tempfile 
+    import matplotlib.pyplot as plt
     plt.close('all')
 
     bot = Bot(token=get_bot_token())
@@ -250,7 +255,7 @@ def send_animation(bot, chat_id, anim_list, filepath, *args, **kwargs):
     anim.save(filepath, extra_anim=anim_list[1:], *args, **kwargs)
     anim._func = store_func
 
-def send_notifications(notifications, delay=DEFAULT_DELAY, check_idle=True, idle=False):
+def send_notifications(notifications, delay=None, check_idle=True, idle=False):
     """send a collection of notifications
 
     Arguments:
@@ -6,7 +6,6 @@ Defines the scheduler class, which does the following:
     * cache results as they come in
 """
 
-import h5py
 import os
 import sys
 import pathlib
@@ -14,38 +13,50 @@ import logging
 from inspect import signature
 from multiprocessing import Pool, Value
 import threading
-import socket
-import pickle
-import numpy as np
-import subprocess
 from time import sleep, time
 from functools import partial
+from collections import defaultdict
 from typing import Iterable, types
-import matplotlib.pyplot as plt
 import traceback
-from copy import copy
-import itertools
 import warnings
+import numpy as np
 
 import numpipe
-from numpipe import slurm, display, notify, mpl_tools, config
-from numpipe.execution import deferred_function, target, block, execute_block, execute_block_debug
+from numpipe import slurm, display, notify, mpl_tools, config, handoff, streaming
+from numpipe.execution import deferred_function, execute_block, execute_block_debug, execute_batch, execute_batch_debug, execute_with_timeout, hold_hash
+from numpipe.registry import block_registry, dispatch_queue, COMPLETE
+from numpipe.parameters import grid
+from numpipe.storage import get_storage, h5_target, group_target, shard_filepath, repack_container, remove_lock
+from numpipe.catalog import catalog
 from numpipe.utility import doublewrap
 from numpipe.parser import run_parser
-from numpipe.networking import recv_msg,send_msg
+from numpipe.sharding import parse_shard, partition
+from numpipe.sharedmem import is_marked
+from numpipe.executors import pool_executor, mpi_executor, mpi_worker, mpi_comm, worker_error
+from numpipe.networking import recv_msg,send_msg,load_authkey
 
 USE_SERVER = False
+MIN_SPECULATION_SAMPLES = 5     # finished blocks of a function needed before its stragglers are copied
+TIMEOUT_GRACE = 10              # seconds past its timeout after which a block that did not stop is killed
 
 class scheduler:
     """Deferred function evaluation and access to cached function output"""
 
-    def __init__(self, dirpath=None):
+    def __init__(self, dirpath=None, storage=None):
+        """
+        Arguments:
+            dirpath      directory where targets are stored (default: directory of the script)
+            storage      storage backend for targets: 'hdf5', 'npy', 'memory' or a target subclass (default: 'hdf5')
+        """
         warnings.simplefilter("default")
 
-        self.blocks = dict()
-        self.instances = dict()
-        self.instance_counts = dict()
-        self.instance_dependency = dict()
+        self.blocks = block_registry(self.target)
+        self.consolidated = dict()
+        self.vectorized = dict()
+        self.deduplicated = set()
+        self.memory_hints = dict()
+        self.timeouts = dict()
+        self.retries = dict()
         self.at_end_functions = dict()
         self.animations = dict() 
 
@@ -61,9 +72,11 @@ class scheduler:
             pathlib.Path(self.dirpath).mkdir(parents=False, exist_ok=True) 
 
         self.filename = os.path.splitext(os.path.basename(sys.argv[0]))[0]
-
+        self.storage = get_storage(storage)
 
         if USE_SERVER:
+            import socket
+            import pickle
             address = ('localhost', 6000)
             self.pipe = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
             self.pipe.connect(address)
@@ -71,9 +84,10 @@ class scheduler:
 
         self.complete = False
         self.notifications = []
+        self.catalog = None
 
     #TODO implement load all, jdefer
-    def load(self, function=None, instance=None, defer=False):
+    def load(self, function=None, instance=None, defer=False, symbols=None, records=None, stride=None, live=False):
         """
         Load cached symbols for particular function
 
@@ -81,18 +95,35 @@ class scheduler:
             function     name of cached function (if None: load all cached functions)
             instance     name of instance (if None: load all instances)
             defer        If True, defer loading
+            symbols      list of symbol names to load (default: all); use 'args' or 'args.name' for arguments
+            records      slice of records to load from generator outputs, e.g. slice(-100, None) (default: all)
+            stride       step between loaded records (default: 1)
+            live         if True, load the records flushed so far by a running block, e.g. from another process while
+                         the block runs (or the complete output of a finished block); call refresh() on the output to
+                         read newly flushed records. HDF5 targets are only read while they run if hdf5.swmr is enabled
+                         in the config
         """
 
         func_name = function.__name__
         if not isinstance(instance, str) and isinstance(instance, Iterable):
             instance = '-'.join([str(x) for x in instance])
 
-        if func_name in self.instances.keys():
+        load_kwargs = dict(symbols=symbols, records=records, stride=stride)
+
+        def load_target(target):
+            if live:
+                return target.live(**load_kwargs)
+
+            ### the output of a dependency may be in memory (see numpipe.handoff), or still be produced (see numpipe.streaming)
+            streaming.wait(target)
+            return handoff.load(target, **load_kwargs) or target.load(**load_kwargs)
+
+        if self.blocks.is_instance_function(func_name):
             if instance is None:
                 class load_next:
-                    def __init__(self, labels, blocks):
-                        self.length = len(labels)
-                        self.labels = iter(labels)
+                    def __init__(self, fid, blocks):
+                        self.length = blocks.function_size(fid)
+                        self.ids = blocks.function_ids(fid)
                         self.blocks = blocks
 
                     def __len__(self): 
@@ -102,19 +133,55 @@ class scheduler:
                         return self
 
                     def __next__(self):
-                        label = next(self.labels)
+                        id = next(self.ids)
+                        label = self.blocks.label(id)
                         name = label[label.find('-')+1:]
-                        return (name, self.blocks[label].target.load())
+                        return (name, load_target(self.blocks.target(id)))
+
+                return load_next(self.blocks.function_index[func_name], self.blocks)
+
+            else:
+                label = f'{func_name}-{instance}'
+        else:
+            label = func_name
+
+        return load_target(self.blocks[label].target)
 
-                labels = self.get_labels(func_name)
-                return load_next(labels, self.blocks)
+    def stream(self, function, instance=None, symbols=None, chunk=None):
+        """
+        Iterate over aligned blocks of records yielded by a cached generator function,
+        without loading all records into memory
+
+        Arguments:
+            function     cached function
+            instance     name of instance (if None: iterate over (name, stream) for all instances)
+            symbols      list of record symbol names to stream (default: all record symbols)
+            chunk        minimum number of records per block, rounded up to the HDF5 chunk boundary
+        """
+        func_name = function.__name__
+        if not isinstance(instance, str) and isinstance(instance, Iterable):
+            instance = '-'.join([str(x) for x in instance])
+
+        stream_kwargs = dict(symbols=symbols, chunk=chunk)
 
+        if self.blocks.is_instance_function(func_name):
+            if instance is None:
+                def stream_next():
+                    for id in self.blocks.function_ids(self.blocks.function_index[func_name]):
+                        label = self.blocks.label(id)
+                        name = label[label.find('-')+1:]
+                        target = self.blocks.target(id)
+                        yield (name, streaming.stream(target, **stream_kwargs) or target.stream(**stream_kwargs))
+
+                return stream_next()
             else:
                 label = f'{func_name}-{instance}'
         else:
             label = func_name
 
-        return self.blocks[label].target.load()
+        ### the records of a running dependency are streamed as they are produced (see numpipe.streaming)
+        target = self.blocks[label].target
+        return streaming.stream(target, **stream_kwargs) or target.stream(**stream_kwargs)
 
     def execute(self):
         warnings.warn('use scheduler.run() instead of scheduler.execute()', DeprecationWarning)
@@ -122,11 +189,43 @@ class scheduler:
 
     def run(self):
         """Run the requested cached functions and at-end functions"""
-        self._init_logging()
         self.args = run_parser()
+        self._init_logging()
+
+        if self.args.action == 'worker':
+            from numpipe.server import tcp_worker, parse_address
+            tcp_worker(*parse_address(self.args.connect), load_authkey(self._authkey_path()))
+            return
+
+        ### executor of blocks outside of the local process pool
+        self.remote_executor = None
+        if getattr(self.args, 'executor', 'pool') == 'mpi':
+            ### rank 0 schedules the blocks, the other ranks execute them
+            comm = mpi_comm()
+            if comm.Get_rank() != 0:
+                mpi_worker(comm)
+                return
+
+            self.remote_executor = mpi_executor(comm)
+        elif self.args.action == 'serve':
+            from numpipe.server import tcp_executor
+            authkey_path = self._authkey_path()
+            self.remote_executor = tcp_executor(self.args.host, self.args.port, timeout=self.args.heartbeat_timeout,
+                                                authkey=load_authkey(authkey_path, create=True))
+            display.serve_message(self.remote_executor.address, authkey_path)
+
+        if self.remote_executor is None:
+            self._run()
+            return
+
+        try:
+            self._run()
+        finally:
+            self.remote_executor.shutdown()
+
+    def _run(self):
         numpipe._pbars.mininterval = self.args.mininterval
         numpipe._pbars.character = config.get_config()['progress']['character']
-        self.fix_block_names()
 
         if self.args.notify_message is not None:
             self.notifications.append(partial(notify.send_message_from, self.args.notify_message, self.filename))
@@ -140,42 +239,94 @@ class scheduler:
             self.clean()
             return
 
+        self._open_catalog()
+
         if self.args.delete is not None:
             self.delete()
+            self._sync_catalog()
             return
 
         self.num_blocks_executed = 0
+        self.foreign = []
+        shard = getattr(self.args, 'shard', None)
+        if shard is not None and self.catalog is None:
+            raise ValueError("--shard requires a persistent storage backend")
+
         if not self.args.at_end:
 
             ### determine which functions to execute based on file and command line
-            if self.args.rerun is None:
-                blocks_to_execute = {name: block for name, block in self.blocks.items() if not block.target.exists()}
-            elif len(self.args.rerun) == 0:
-                blocks_to_execute = self.blocks
+            excluded = set()
+            for name in self.args.exclude:
+                excluded.update(self.blocks.id(label) for label in self.get_labels(name))
+
+            if self.args.rerun is None or len(self.args.rerun) == 0:
+                ### all blocks: pulled from the registry as they are dispatched, without collecting them first
+                selection = None
+                if self.args.rerun is None:
+                    skip = lambda id: id in excluded or self.is_cached(self.blocks.target(id))
+                else:
+                    skip = lambda id: id in excluded
+
+                self.resolve_dependencies_down(dict())
+                if shard is not None:
+                    ### shards are selected from all blocks, whether or not they are cached, so that
+                    ### every shard makes the same choice while other shards complete their blocks
+                    selection = self._shard_ids(id for id in self.blocks.ids() if id not in excluded)
+
+                ids = self.blocks.ids() if selection is None else selection
+                self.num_blocks_executed = sum(1 for id in ids if not skip(id))
+                rerun_elsewhere = None if self.args.rerun is not None else set()
+
+                if self.args.rerun is not None:
+                    overwriten = self._overwrite(self.blocks.target(id) for id in ids if not skip(id))
+                    if not overwriten:
+                        display.abort_message()
+                        return
             else:
                 blocks_to_execute = dict()
                 for name in self.args.rerun:
                     labels = self.get_labels(name)
                     blocks_to_execute.update({label: self.blocks[label] for label in labels})
 
-            for name in self.args.exclude:
-                for key in self.get_labels(name):
-                    blocks_to_execute.pop(key, 0)
+                for id in excluded:
+                    blocks_to_execute.pop(self.blocks.label(id), 0)
 
-            self.resolve_dependencies_down(blocks_to_execute)
-            self.num_blocks_executed = len(blocks_to_execute)
+                self.resolve_dependencies_down(blocks_to_execute)
+                rerun_ids = [block.id for block in blocks_to_execute.values()]
 
-            overwriten = self._overwrite([block.target for block in blocks_to_execute.values()])
-            if not overwriten:
-                display.abort_message()
-                return
+                if shard is not None:
+                    ### dependencies are resolved before sharding, so that every shard selects from the same blocks
+                    self.resolve_dependencies_up(blocks_to_execute)
+                    selection = self._shard_ids(block.id for block in blocks_to_execute.values())
+                    in_shard = set(selection)
+                    rerun_elsewhere = {id for id in rerun_ids if id not in in_shard}
+                    rerun_ids = [id for id in rerun_ids if id in in_shard]
+
+                overwriten = self._overwrite([self.blocks.target(id) for id in rerun_ids])
+                if not overwriten:
+                    display.abort_message()
+                    return
+
+                if shard is None:
+                    self.resolve_dependencies_up(blocks_to_execute)
+                    selection = [block.id for block in blocks_to_execute.values()]
+
+                skip = None
+                self.num_blocks_executed = len(selection)
 
-            self.resolve_dependencies_up(blocks_to_execute)
+            if shard is not None:
+                self._find_foreign_dependencies(selection, excluded, rerun_elsewhere)
 
             if self.args.action == 'slurm':
-                slurm.create_lookup(self.filename, blocks_to_execute.keys())
+                ids = self.blocks.ids() if selection is None else selection
+                if self.args.batch:
+                    self._create_job_arrays([id for id in ids if skip is None or not skip(id)])
+                    return
 
-                sbatch_filename = slurm.create_sbatch(self.filename, blocks_to_execute.keys(), 
+                labels = [self.blocks.label(id) for id in ids if skip is None or not skip(id)]
+                slurm.create_lookup(self.filename, labels)
+
+                sbatch_filename = slurm.create_sbatch(self.filename, labels, 
                         time=self.args.time, memory=self.args.memory)
                 wall_time = slurm.wall_time(self.args.time)
 
@@ -193,83 +344,175 @@ class scheduler:
             t_start = time()
             if self.num_blocks_executed:
                 display.cached_function_message()
-
-                if self.args.debug:
-                    remaining = list(blocks_to_execute.keys())
-                    num_blocks_ran = 0
-
-                    while remaining:
-                        to_delete = []
-                        for name in remaining:
-                            block = blocks_to_execute[name]
-                            if self.ready_to_run(block):
-                                execute_block_debug(block, name, self.instances,
-                                         self.args.cache_time, num_blocks_ran, self.num_blocks_executed)
-                                to_delete.append(name)
-                                block.complete = True
-                                num_blocks_ran += 1
-
-                        for name in to_delete:
-                            remaining.remove(name)
-
-                        sleep(.1)
+                blocks = dispatch_queue(self.blocks, selection, skip, batch_size=self._batch_size)
+                num_blocks_ran = 0
+                self.representatives = dict()
+                self.duplicates = dict()
+                self.num_duplicates = 0
+                self.num_skipped = 0
+                self.num_cancelled = 0
+                self.speculative = dict()
+                self.handoff = None
+                self.spools = dict()
+                num_exceptions = 0
+                aborted = False
+
+                if self.args.debug or not self.storage.shared:
+                    while not blocks.empty() and not aborted:
+                        ids = blocks.next_batch()
+                        self._blocks_skipped(blocks)
+                        if not ids:
+                            self._poll_foreign_dependencies()
+                            sleep(.1)
+                            continue
+
+                        ids = self._deduplicate(ids)
+                        if not ids:
+                            continue
+
+                        if self._run_serial(ids, num_blocks_ran):
+                            self._representatives_finished(ids, success=True)
+                        else:
+                            num_exceptions += len(ids)
+                            self._blocks_failed(ids)
+                            num_exceptions += self._representatives_finished(ids, success=False)
+                            if self.args.fail_fast:
+                                ### the remaining blocks are not run
+                                aborted = True
+                                logging.error('--fail-fast: the remaining blocks are cancelled')
+
+                        num_blocks_ran += len(ids)
                 else:
-                    with Pool(processes=nprocs) as pool:
-                        results = dict()
-                        remaining = list(blocks_to_execute.keys())
-                        num_blocks_ran = 0
-                        num_exceptions = 0
-                        while remaining or results:
-                            to_delete = []
-                            for name in remaining:
-                                block = blocks_to_execute[name]
-                                if self.ready_to_run(block):
-                                    results[name] = pool.apply_async(execute_block, 
-                                            (block, name, self.instances, self.args.cache_time, num_blocks_ran, self.num_blocks_executed))
-                                    to_delete.append(name)
-                                    num_blocks_ran += 1
-
-                            for name in to_delete:
-                                remaining.remove(name)
-
-                            to_delete = []
-                            for name, result in results.items():
-                                if result.ready():
-                                    try:
-                                        result.get()
-                                    except Exception as err:
-                                        num_exceptions += 1
-                                        logging.error(err)
-
-                                    self.blocks[name].complete = True
-                                    to_delete.append(name)
-
-                            for name in to_delete:
-                                results.pop(name)
+                    with self._executor(nprocs) as executor:
+                        self.handoff = executor.handoff
 
-                            sleep(.1)
+                        ### blocks are pulled as workers free up
+                        results = dict()
+                        started = dict()                # {key: (submit time, then start time on a worker, number)}
+                        retrying = dict()               # {key: (time of the next attempt, number)} of failed blocks
+                        attempts = defaultdict(int)     # {key: number of failed attempts}
+                        runtimes = defaultdict(list)    # {function id: runtimes of the blocks finished in this run}
+
+                        def submit(key, ids, number):
+                            func, args = self._execution_args(ids, number)
+                            results[key] = ids
+                            executor.submit(key, func, args)
+                            started[key] = (time(), number)
+
+                        while (not blocks.empty() and not aborted) or results or retrying:
+                            for key, (t_retry, ids, number) in list(retrying.items()):
+                                if time() >= t_retry:
+                                    del retrying[key]
+                                    submit(key, ids, number)
+
+                            while not aborted and len(results) < executor.capacity:
+                                ids = blocks.next_batch()
+                                self._blocks_skipped(blocks)
+                                if not ids:
+                                    break
+
+                                ids = self._deduplicate(ids)
+                                if not ids:
+                                    continue
+
+                                submit(ids[0], ids, num_blocks_ran)
+                                num_blocks_ran += len(ids)
+
+                            finished = executor.wait(timeout=.1)
+                            for key in executor.started():
+                                if key in started:
+                                    ### the block is running, rather than queued in the executor
+                                    started[key] = (time(), started[key][1])
+                                    self._blocks_started(results[key])
+                            finished += self._timed_out(executor, started)
+                            if not finished:
+                                self._poll_foreign_dependencies()
+                                self._speculate(executor, results, started, runtimes)
+
+                            for key, success, value in finished:
+                                output = None
+                                if success and isinstance(value, tuple):
+                                    ### the block published its output for its dependents (see numpipe.handoff)
+                                    value, output = value
+
+                                if key not in results:
+                                    ### the other copy of a block that ran speculatively finished first
+                                    if isinstance(key, tuple):
+                                        self.blocks.target(key[1]).speculative().discard()
+                                    if output is not None:
+                                        handoff.release(output)
+                                    continue
+
+                                key = self._speculation_finished(executor, key, success, results)
+                                if key is None:
+                                    if output is not None:
+                                        handoff.release(output)
+                                    continue
+
+                                ids = results.pop(key)
+                                _, number = started.pop(key)
+                                if success:
+                                    if output is not None:
+                                        self.handoff.add(self.blocks.block_function(key), str(self.blocks.target(key)), output)
+                                    if len(ids) == 1:
+                                        runtimes[self.blocks.block_function(key)].append(value)
+                                    self._blocks_finished(ids, value)
+                                    for id in ids:
+                                        self.blocks.set_status(id, COMPLETE)
+                                    self._streams_finished(ids)
+                                    self._representatives_finished(ids, success)
+                                    continue
+
+                                if isinstance(value, worker_error):
+                                    value = f"Cached function '{self.blocks.label(key)}' failed: {value}"
+                                logging.error(value)
+                                self._streams_finished(ids, error=value)
+                                num_retries = self.retries.get(self.blocks.function_name(key), 0)
+                                if attempts[key] < num_retries and not aborted:
+                                    attempts[key] += 1
+                                    delay = config.get_config()['execution']['retry_backoff']*2**(attempts[key] - 1)
+                                    logging.warning(f"retrying '{self.blocks.label(key)}' in {delay:g} seconds (attempt {attempts[key] + 1} of {num_retries + 1})")
+                                    retrying[key] = (time() + delay, ids, number)
+                                    continue
+
+                                num_exceptions += len(ids)
+                                self._blocks_failed(ids)
+                                num_exceptions += self._representatives_finished(ids, success)
+
+                                if self.args.fail_fast and not aborted:
+                                    ### the remaining blocks are not run
+                                    aborted = True
+                                    self._cancel_all(executor, results, started, retrying)
+                                    logging.error('--fail-fast: the remaining blocks are cancelled')
+
+                        for spool in self.spools.values():
+                            streaming.remove(spool)
 
                         if USE_SERVER:
                             t = threading.Thread(target=self.listening_thread) 
                             t.start()
 
-                        pool.close()
-                        pool.join()
+                        executor.close()
 
-                        self.complete = True
-
-                        if blocks_to_execute:
-                            self.notifications.append(partial(notify.send_finish_message,
-                                                        filename=self.filename, 
-                                                        njobs=len(blocks_to_execute),
-                                                        time=time() - t_start,
-                                                        num_exceptions=num_exceptions))
-                        
                         if USE_SERVER:
                             t.join()
                             self.pipe.close()
 
-                        display.cached_function_summary(self.num_blocks_executed, num_exceptions)
+                if aborted:
+                    self.num_cancelled += max(0, self.num_blocks_executed - num_blocks_ran - self.num_duplicates - self.num_skipped)
+
+                self.complete = True
+
+                self.notifications.append(partial(notify.send_finish_message,
+                                            filename=self.filename, 
+                                            njobs=self.num_blocks_executed,
+                                            time=time() - t_start,
+                                            num_exceptions=num_exceptions))
+
+                display.cached_function_summary(self.num_blocks_executed, num_exceptions, self.num_duplicates,
+                                                self.num_skipped, self.num_cancelled)
+
+            self._sync_catalog()
 
         numpipe._pbars.set_njobs(1)
         numpipe._pbars.reset()
@@ -277,7 +520,7 @@ class scheduler:
         
 
         ### At-end functions
-        if self.at_end_functions and not self.args.no_at_end:
+        if self.at_end_functions and not self.args.no_at_end and shard is None:
             display.at_end_message()
 
             for func in self.at_end_functions.values():
@@ -286,17 +529,515 @@ class scheduler:
             if self.args.notify:
                 self.send_notifications(check_idle=False, idle=True)
 
-    def ready_to_run(self, block):
-        if block.dependencies is None:
+    def is_cached(self, target):
+        """return true if the target is complete, using the catalog when available"""
+        if self.catalog is not None:
+            return self.catalog.exists(target)
+
+        return target.exists()
+
+    def _open_catalog(self):
+        """open the catalog of targets and reconcile it with the directory if needed"""
+        if self.storage.persistent:
+            self.catalog = catalog(f'{self.dirpath}/{self.filename}.catalog', self.dirpath)
+            self.catalog.refresh(self.blocks)
+
+    def _sync_catalog(self):
+        if self.catalog is not None:
+            self.catalog.sync()
+
+    def _executor(self, nprocs):
+        """the executor that runs blocks outside of the scheduler's process"""
+        if self.remote_executor is not None:
+            return self.remote_executor
+
+        executor = pool_executor(nprocs, max_tasks=self.args.max_tasks_per_worker or None,
+                                         max_memory=self.args.max_worker_memory or None, shared=self._shared_arguments(),
+                                         handoff_memory=self.args.handoff_memory or None)
+        if len(executor.shared):
+            logging.info(f'{len(executor.shared)} array arguments ({executor.shared.nbytes/1e6:.1f} MB) placed in shared memory')
+
+        return executor
+
+    def _shared_arguments(self):
+        """the array arguments of the blocks to place in shared memory: arrays marked with numpipe.shared, and arrays
+           larger than execution.shared_memory_threshold (in bytes) in the config"""
+        threshold = config.get_config()['execution']['shared_memory_threshold']
+        arrays = []
+        for instances in self.blocks.grids:
+            for value in instances.kwargs.values():
+                if isinstance(value, np.ndarray) and (is_marked(value) or 0 < threshold <= value.nbytes):
+                    ### the workers see the array as it is now, so that its hash is computed once as well
+                    hold_hash(value)
+                    arrays.append(value)
+
+        return arrays
+
+    def _shard_ids(self, ids):
+        """the ids of the blocks in the shard given by --shard, out of the candidate ids"""
+        index, num_shards = parse_shard(self.args.shard)
+        ids = sorted(ids)
+
+        weights = None
+        if self.args.shard_by == 'runtime':
+            weights = self._runtime_estimates(ids)
+
+        shards = partition(len(ids), num_shards, weights)
+        return [id for id, shard in zip(ids, shards.tolist()) if shard == index]
+
+    def _runtime_estimates(self, ids, default=None):
+        """runtime of every block from previous runs; blocks that never ran use the mean runtime of their function,
+           or the default if no block of the function ran (default: the mean runtime of all blocks)"""
+        runtimes = np.array([self.catalog.get(self.blocks.target(id), 'runtime', np.nan) for id in ids], dtype=float)
+        fids = np.array([self.blocks.block_function(id) for id in ids], dtype=int)
+        known = np.isfinite(runtimes)
+        if default is None:
+            default = runtimes[known].mean() if known.any() else 1.0
+
+        for fid in np.unique(fids):
+            in_function = fids == fid
+            known_in_function = in_function & known
+            runtimes[in_function & ~known] = runtimes[known_in_function].mean() if known_in_function.any() else default
+
+        return runtimes.tolist()
+
+    def _create_job_arrays(self, ids):
+        """create (and optionally submit) Slurm job arrays that run a list of blocks
+
+        Blocks are grouped into stages by dependency depth, so that a stage only starts once the previous stages
+        are complete, and by the memory hint of their function. Every group is a job array, whose elements are
+        packed with blocks up to the wall-time
+        """
+        if self.catalog is None:
+            raise ValueError("Slurm job arrays require a persistent storage backend")
+
+        wall_time = slurm.wall_time(self.args.time)
+        capacity = 3600*wall_time
+        default = capacity if self.args.runtime_estimate is None else self.args.runtime_estimate
+        runtimes = self._runtime_estimates(ids, default=default)
+
+        ### dependency depth of every function, counting only the functions that run; the depth of a function
+        ### is the highest stage level of its blocks, since a block-level dependency (on a function or a block)
+        ### only delays a single block
+        running_fids = {self.blocks.block_function(id) for id in ids}
+        running = set(ids)
+        _, block_deps, _, _ = self.blocks.resolve()
+        delayed = dict()      # {fid: running blocks with block-level dependencies}
+        for id in block_deps.keys() & running:
+            delayed.setdefault(self.blocks.block_function(id), []).append(id)
+
+        depths = dict()
+        base_depths = dict()
+        block_levels = dict()
+        def base_depth(fid):
+            if fid not in base_depths:
+                dep_fids = [D for D in self.blocks.resolve()[0][fid][0] if D in running_fids]
+                base_depths[fid] = 1 + max(map(depth, dep_fids), default=-1)
+            return base_depths[fid]
+
+        def depth(fid):
+            if fid not in depths:
+                depths[fid] = max([base_depth(fid)] + [block_level(id) for id in delayed.get(fid, [])])
+            return depths[fid]
+
+        def block_level(id):
+            fid = self.blocks.block_function(id)
+            if id not in block_deps:
+                return base_depth(fid)
+            if id not in block_levels:
+                dep_fids, dep_ids = block_deps[id]
+                block_levels[id] = max([base_depth(fid)] + [1 + depth(D) for D in dep_fids if D in running_fids]
+                                         + [1 + block_level(D) for D in dep_ids if D in running])
+            return block_levels[id]
+
+        groups = dict()
+        for idx, id in enumerate(ids):
+            fid = self.blocks.block_function(id)
+            memory = self.memory_hints.get(self.blocks.functions[fid].__name__, self.args.memory)
+            groups.setdefault((block_level(id), memory), []).append(idx)
+
+        levels = sorted({level for level, memory in groups})
+        stages = [[] for level in levels]
+        for (level, memory), indices in sorted(groups.items()):
+            bins = slurm.pack([runtimes[i] for i in indices], capacity)
+            elements = [[self.blocks.label(ids[indices[i]]) for i in b] for b in bins]
+            stages[levels.index(level)].append((memory, elements))
+
+        at_end = bool(self.at_end_functions) and not self.args.no_at_end
+        submit_filename = slurm.create_job_arrays(self.filename, stages, time=self.args.time, at_end=at_end,
+                                                  at_end_memory=self.args.memory)
+
+        num_elements = [len(elements) for stage in stages for memory, elements in stage]
+        display.slurm_array_message(submit_filename, num_elements, wall_time, len(ids), self.args.no_submit)
+
+    def _find_foreign_dependencies(self, selection, excluded, rerun):
+        """find the dependencies of the blocks in this shard that run in other shards
+
+        Arguments:
+            selection     ids of the blocks in this shard
+            excluded      ids of the blocks that are not run by any shard
+            rerun         ids of the blocks that other shards re-run, so that their cached data is out of date
+                          (None: all blocks are re-run)
+        """
+        in_shard = set(selection)
+        dependencies = set()
+        for fid in {self.blocks.block_function(id) for id in selection}:
+            dep_fids, dep_ids = self.blocks.resolve()[0][fid]
+            for dep_fid in dep_fids:
+                dependencies.update(self.blocks.function_ids(dep_fid))
+            dependencies.update(dep_ids)
+        for id in in_shard.intersection(self.blocks.block_dependencies):
+            dependencies.update(self.blocks.dependencies(id))
+
+        for id in sorted(dependencies - in_shard):
+            if self.blocks.is_complete(id):
+                continue
+            if id in excluded or (rerun is not None and id not in rerun and self.is_cached(self.blocks.target(id))):
+                self.blocks.set_status(id, COMPLETE)
+            else:
+                self.foreign.append(id)
+
+        self._last_poll = 0
+
+    def _poll_foreign_dependencies(self):
+        """mark the dependencies that run in other shards complete once they are recorded as finished in the catalog"""
+        if not self.foreign or time() - self._last_poll < 1:
+            return
+
+        self._last_poll = time()
+        statuses = self.catalog.reload([self.blocks.target(id) for id in self.foreign])
+
+        remaining = []
+        for id, status in zip(self.foreign, statuses):
+            if status == 'complete':
+                self.blocks.set_status(id, COMPLETE)
+            elif status in ('failed', 'skipped', 'cancelled'):
+                self.blocks.fail([id])
+            else:
+                remaining.append(id)
+
+        self.foreign = remaining
+
+    def _batch_size(self, fid):
+        """number of blocks of a function to execute with a single call"""
+        batch_size = self.vectorized.get(self.blocks.functions[fid].__name__)
+        if batch_size is None or not self.blocks.swept_keys(fid):
+            return 1
+        if batch_size is True:
+            return config.get_config()['execution']['batch_size']
+
+        return batch_size
+
+    def _execution_args(self, ids, number, debug=False, speculative=False):
+        """the execution function and its arguments for a list of blocks (a speculative copy of a single block writes to
+           a separate target, see _speculate)"""
+        fid = self.blocks.block_function(ids[0])
+        func_name = self.blocks.functions[fid].__name__
+        if func_name in self.vectorized and self.blocks.swept_keys(fid):
+            name = self.blocks.label(ids[0]) if len(ids) == 1 else f'{self.blocks.label(ids[0])}..{self.blocks.label(ids[-1])}'
+            func = execute_batch_debug if debug else execute_batch
+            args = (self.blocks.detach_batch(ids), name, self.args.cache_time, number, self.num_blocks_executed)
+        else:
+            id = ids[0]
+            block = self.blocks.detach(id)
+            name = self.blocks.label(id)
+            if speculative:
+                block.target = self.speculative[id]
+                name = f'{name} (speculative)'
+
+            func = execute_block_debug if debug else execute_block
+            args = (block, name, self.blocks.is_instance(id), self.args.cache_time, number, self.num_blocks_executed)
+
+        if func_name in self.timeouts and not self.args.debug:
+            func, args = execute_with_timeout, (self.timeouts[func_name], func, args)
+
+        if not debug and not speculative:
+            spooled, live = self._streams(ids)
+            if spooled or live:
+                func, args = streaming.execute_with_streams, (spooled, live, func, args)
+
+        if self.handoff is not None and not debug:
+            func, args = handoff.execute_with_handoff, self._handoff_args(ids, func, args)
+
+        return func, args
+
+    def _run_serial(self, ids, number):
+        """run a list of blocks in the scheduler's process, with the retries of their function; return True if
+           they succeeded (failures are logged)"""
+        num_retries = self.retries.get(self.blocks.function_name(ids[0]), 0)
+        for attempt in range(num_retries + 1):
+            if attempt:
+                delay = config.get_config()['execution']['retry_backoff']*2**(attempt - 1)
+                logging.warning(f"retrying '{self.blocks.label(ids[0])}' in {delay:g} seconds (attempt {attempt + 1} of {num_retries + 1})")
+                sleep(delay)
+
+            self._blocks_started(ids)
+            func, args = self._execution_args(ids, number, debug=True)
+            try:
+                runtime = func(*args)
+            except Exception:
+                logging.error(f"Cached function '{self.blocks.label(ids[0])}' failed:\n" + traceback.format_exc())
+                continue
+
+            self._blocks_finished(ids, runtime)
+            for id in ids:
+                self.blocks.set_status(id, COMPLETE)
             return True
-        
-        for D in block.dependencies:
-            if not self.blocks[D].complete:
-                return False
-        
-        return True
+
+        return False
+
+    def _streams(self, ids):
+        """
+        The streams of a list of blocks that are about to run (see numpipe.streaming): the target paths of the blocks
+        that have streaming dependents (their spools are created), and the target paths of the
+        running producers that the blocks stream from
+        """
+        spooled = set()
+        for id in ids:
+            if self.blocks.has_stream_children(id):
+                target = self.blocks.target(id)
+                self.spools[id] = streaming.spool_path(target)
+                streaming.create(self.spools[id])
+                spooled.add(str(target))
+
+        live = set()
+        fid = self.blocks.block_function(ids[0])
+        if self.blocks.function_stream[fid] and self.spools:
+            dep_fids, _ = self.blocks.resolve()[0][fid]
+            live = {str(self.blocks.target(D)) for D in self.spools if self.blocks.block_function(D) in dep_fids}
+
+        return spooled, live
+
+    def _streams_finished(self, ids, error=None):
+        """append the final frame to the spools of blocks that finished, or failed with an error"""
+        for id in ids:
+            self.blocks.set_running(id, False)
+            if id in self.spools:
+                if error is None:
+                    streaming.finish(self.spools[id])
+                else:
+                    streaming.abort(self.spools[id], error)
+
+    def _handoff_args(self, ids, func, args):
+        """the arguments of execute_with_handoff for a list of blocks: the outputs of their dependencies in the store,
+           and whether the block publishes its output (a single block that other blocks depend on)"""
+        dep_fids, dep_paths = set(), set()
+        for id in ids:
+            fids, dep_ids = self.blocks.direct_dependencies(id)
+            dep_fids.update(fids)
+            dep_paths.update(str(self.blocks.target(D)) for D in dep_ids)
+
+        fid = self.blocks.block_function(ids[0])
+        capture = len(ids) == 1 and self.blocks.functions[fid].__name__ not in self.vectorized and self.blocks.has_children(ids[0])
+        return self.handoff.available(dep_fids, dep_paths), capture, func, args
+
+    def _speculate(self, executor, results, started, runtimes):
+        """
+        Start speculative copies of stragglers while workers are idle. A straggler is a block that has run for longer than
+        --speculation times the 95th percentile runtime of the blocks of its function that finished in this run. The copy
+        writes to a separate target; the first copy to finish successfully is kept and the other is cancelled
+        """
+        if not self.args.speculation:
+            return
+
+        t_now = time()
+        for key, (t_start, number) in list(started.items()):
+            if len(results) >= executor.num_workers:
+                return
+            if key in self.speculative or len(results[key]) > 1 or key in self.spools:
+                continue
+
+            samples = runtimes[self.blocks.block_function(key)]
+            if len(samples) < MIN_SPECULATION_SAMPLES or t_now - t_start <= self.args.speculation*np.percentile(samples, 95):
+                continue
+
+            logging.info(f"'{self.blocks.label(key)}' has run for {t_now - t_start:.1f} seconds, starting a speculative copy")
+            self.speculative[key] = self.blocks.target(key).speculative()
+            func, args = self._execution_args([key], number, speculative=True)
+            results[('speculative', key)] = [key]
+            executor.submit(('speculative', key), func, args)
+
+    def _timed_out(self, executor, started):
+        """
+        Kill blocks that are still running well past their timeout (execute_with_timeout could not interrupt them, e.g.
+        in a call to compiled code), if the executor can stop them, and return their results as (key, False, TimeoutError)
+        """
+        if not self.timeouts:
+            return []
+
+        timed_out = []
+        t_now = time()
+        for key, (t_start, _) in started.items():
+            timeout = self.timeouts.get(self.blocks.function_name(key))
+            if timeout is not None and t_now - t_start > timeout + TIMEOUT_GRACE and executor.cancel(key):
+                self.blocks.target(key).discard(temporary_only=True)
+                timed_out.append((key, False, TimeoutError(f"'{self.blocks.label(key)}' did not finish within {timeout} seconds and was killed")))
+
+        return timed_out
+
+    def _cancel_all(self, executor, results, started, retrying):
+        """cancel the blocks that are waiting to be retried, and the blocks in flight that the executor can stop
+           (others finish normally)"""
+        cancelled = [id for _, ids, _ in retrying.values() for id in ids]
+        retrying.clear()
+        for key in [key for key in results if not isinstance(key, tuple)]:
+            if not executor.cancel(key):
+                continue
+
+            ids = results.pop(key)
+            del started[key]
+            for id in ids:
+                self.blocks.target(id).discard(temporary_only=True)
+            cancelled.extend(ids)
+
+            target = self.speculative.pop(key, None)
+            if target is not None:
+                del results[('speculative', key)]
+                if executor.cancel(('speculative', key)):
+                    target.discard()
+
+        self.num_cancelled += len(cancelled)
+        self._streams_finished(cancelled, error='cancelled')
+        if self.catalog is not None:
+            self.catalog.record_all([self.blocks.target(id) for id in cancelled], [self.blocks.label(id) for id in cancelled],
+                    'cancelled', finished=time())
+
+    def _speculation_finished(self, executor, key, success, results):
+        """
+        Resolve a result of a block that has a speculative copy (see _speculate). Return the key of the original block if
+        the result is to be handled as its result, or None if the result is to be ignored
+        """
+        if isinstance(key, tuple):
+            _, id = key
+            del results[key]
+            target = self.speculative[id]
+            if not success:
+                ### the original keeps running, and is not copied again
+                target.discard()
+                self.speculative[id] = None
+                return None
+
+            if executor.cancel(id):
+                self.blocks.target(id).discard(temporary_only=True)
+            self.blocks.target(id).adopt(target)
+            del self.speculative[id]
+            return id
+
+        target = self.speculative.pop(key, None)
+        if target is not None:
+            del results[('speculative', key)]
+            if executor.cancel(('speculative', key)):
+                target.discard()
+
+        return key
+
+    def _blocks_started(self, ids):
+        """record that a list of blocks started running"""
+        for id in ids:
+            self.blocks.set_running(id)
+        if self.catalog is not None:
+            self.catalog.record_all([self.blocks.target(id) for id in ids], [self.blocks.label(id) for id in ids], 'running',
+                    fingerprint=[self.blocks.fingerprint(id) for id in ids], started=time())
+
+    def _blocks_finished(self, ids, runtime):
+        """finalize the targets of a list of blocks that ran successfully (in runtime seconds) and record them"""
+        targets = [self.blocks.target(id) for id in ids]
+        for target_type in {type(target) for target in targets}:
+            target_type.finalize_all([target for target in targets if type(target) is target_type])
+
+        if self.catalog is not None:
+            self.catalog.record_all(targets, [self.blocks.label(id) for id in ids], 'complete',
+                    runtime=runtime/len(ids), finished=time())
+
+    def _blocks_failed(self, ids):
+        """record a list of blocks that failed; the blocks that depend on them are skipped"""
+        self.blocks.fail(ids)
+        if self.catalog is not None:
+            self.catalog.record_all([self.blocks.target(id) for id in ids], [self.blocks.label(id) for id in ids], 'failed',
+                    finished=time())
+
+    def _blocks_skipped(self, blocks):
+        """record the blocks that the dispatch queue skipped because a dependency failed"""
+        if not blocks.skipped:
+            return
+
+        ids = blocks.skipped
+        blocks.skipped = []
+        for id in ids:
+            logging.warning(f"'{self.blocks.label(id)}' is skipped because a dependency failed")
+        self.num_skipped += len(ids)
+
+        if self.catalog is not None:
+            self.catalog.record_all([self.blocks.target(id) for id in ids], [self.blocks.label(id) for id in ids], 'skipped',
+                    finished=time())
+
+    def _deduplicate(self, ids):
+        """remove duplicates from a list of blocks about to be dispatched and return the remaining blocks
+
+        A block of a function cached with deduplicate=True is a duplicate if its function and arguments (its fingerprint)
+        are the same as those of a block that was dispatched before it, the representative. Instead of running, the
+        target of a duplicate is linked to the target of the representative once the representative has finished.
+        Repetitions of an instance (blocks with the same name, e.g. independent random samples) are never duplicates
+        """
+        unique = []
+        for id in ids:
+            if self.blocks.function_name(id) not in self.deduplicated or not self.blocks.target(id).linkable:
+                unique.append(id)
+                continue
+
+            fingerprint = self.blocks.fingerprint(id)
+            representative = self.representatives.setdefault(fingerprint, id)
+            if representative != id and self.blocks.name(representative) == self.blocks.name(id):
+                unique.append(id)
+            elif representative == id:
+                self.duplicates[id] = []
+                unique.append(id)
+            elif representative in self.duplicates:
+                self.duplicates[representative].append(id)
+            else:
+                self._link_duplicates(representative, [id])
+
+        return unique
+
+    def _representatives_finished(self, ids, success):
+        """link (or fail) the duplicates of finished blocks; return the number of failed duplicates"""
+        num_failed = 0
+        for id in ids:
+            duplicates = self.duplicates.pop(id, None)
+            if duplicates is None:
+                continue
+
+            if success:
+                self._link_duplicates(id, duplicates)
+            else:
+                ### later duplicates become representatives again and are retried
+                self.representatives.pop(self.blocks.fingerprint(id))
+                if duplicates:
+                    self._blocks_failed(duplicates)
+                    num_failed += len(duplicates)
+
+        return num_failed
+
+    def _link_duplicates(self, representative, ids):
+        """link the targets of a list of duplicate blocks to the target of their representative"""
+        if not ids:
+            return
+
+        source = self.blocks.target(representative)
+        targets = [self.blocks.target(id) for id in ids]
+        for target in targets:
+            target.link(source)
+
+        if self.catalog is not None:
+            self.catalog.record_all(targets, [self.blocks.label(id) for id in ids], 'complete',
+                    fingerprint=self.blocks.fingerprint(representative), runtime=0, finished=time())
+
+        for id in ids:
+            self.blocks.set_status(id, COMPLETE)
+        self.num_duplicates += len(ids)
 
     def listening_thread(self):
+        import pickle
         while not self.complete:
             print('waiting...')
             request = recv_msg(self.pipe)
@@ -313,134 +1054,80 @@ class scheduler:
                 send_msg(self.pipe, pickle.dumps(int_dict))
                 print('progress sent')
 
-    # @static_vars(counter=0)
     def add(self, _func, _instance_name=None, **kwargs):
         """
-        Add an instance (a function with specified kwargs)
+        Add an instance (a function with specified kwargs), or a grid of instances if any kwargs are parameters
         """
         if _instance_name is None:
             _instance_name = ''
 
-        def get_new_name(name, addons):
-            if name and not addons:
-                return name
-            elif name and addons:
-                return name + '-' + '-'.join(addons)
-            else:
-                return '-'.join(addons)
-
-        kwarg_params = dict()
-        kwarg_params_outer = dict()
-        for key, val in kwargs.items():
-            if isinstance(val, numpipe.parameter):
-                if val.outer:
-                    kwarg_params_outer[key] = val
-                else:
-                    kwarg_params[key] = val
-
-        if kwarg_params_outer and kwarg_params:
-            args1 = [p.arg for p in kwarg_params_outer.values()]
-            labels1 = itertools.product(*[p.labels for p in kwarg_params_outer.values()])
-
-            for vals1 in itertools.product(*args1):
-                post1 = list(filter(lambda x: x, next(labels1)))
-
-                args2 = [p.arg for p in kwarg_params.values()]
-                labels2 = zip(*[p.labels for p in kwarg_params.values()])
-                for vals2 in zip(*args2):
-                    new_kwargs = copy(kwargs)
-                    replace = dict(zip(kwarg_params.keys(), vals2))
-                    replace.update(zip(kwarg_params_outer.keys(), vals1))
-                    new_kwargs.update(replace)
-
-                    post2 = post1 + list(filter(lambda x: x, next(labels2)))
-                    new_name = get_new_name(_instance_name, post2)
-
-                    self.add(_func, new_name, **new_kwargs)
-
-            return #TODO: return a block_collection that can call depends() on all or be indexed
-        elif kwarg_params_outer:
-            args = [p.arg for p in kwarg_params_outer.values()]
-            labels = itertools.product(*[p.labels for p in kwarg_params_outer.values()])
-            for vals in itertools.product(*args):
-                new_kwargs = copy(kwargs)
-                replace = dict(zip(kwarg_params_outer.keys(), vals))
-                new_kwargs.update(replace)
-                
-                post = filter(lambda x: x, next(labels))
-                new_name = get_new_name(_instance_name, post)
-                self.add(_func, new_name, **new_kwargs)
-
-            return #TODO: return a block_collection that can call depends() on all or be indexed
-        elif kwarg_params:
-            args = [p.arg for p in kwarg_params.values()]
-            labels = zip(*[p.labels for p in kwarg_params.values()])
-            for vals in zip(*args):
-                new_kwargs = copy(kwargs)
-                replace = dict(zip(kwarg_params.keys(), vals))
-                new_kwargs.update(replace)
-
-                post = filter(lambda x: x, next(labels))
-                new_name = get_new_name(_instance_name, post)
-                self.add(_func, new_name, **new_kwargs)
-
-            return #TODO: return a block_collection that can call depends() on all or be indexed
-
-        if _instance_name in self.instance_counts[_func.__name__]:
-            self.instance_counts[_func.__name__][_instance_name] += 1
-        else:
-            self.instance_counts[_func.__name__][_instance_name] = 0
-
-        count = self.instance_counts[_func.__name__][_instance_name]
-
-        if _instance_name:
-            block_name = f'{_func.__name__}-{_instance_name}-{count}'
-        else:
-            block_name = f'{_func.__name__}-{count}'
-
-        filepath = f'{self.dirpath}/{self.filename}-{block_name}.h5'
+        return self.blocks.add_grid(_func.__name__, grid(_instance_name, kwargs))
+        #TODO: return a block_collection for grids that can call depends() on all or be indexed
 
-        self.blocks[block_name] = block(
-                          deferred_function(_func, kwargs=kwargs, num_iterations=None),
-                          target(filepath),
-                          dependencies=self.instance_dependency.get(_func.__name__, None))
-        self.instances[_func.__name__].append(block_name)
+    def target(self, block_name, func_name=None):
+        """create the target of a block using the storage backend
 
-        return self.blocks[block_name]
+           Arguments:
+               block_name     name of the block
+               func_name      name of the cached function, if the block is an instance
+        """
+        filepath = f'{self.dirpath}/{self.filename}-{block_name}{self.storage.extension}'
 
-    def fix_block_names(self):
-        for func_name, D in self.instance_counts.items():
-            for name, counts in D.items():
-                if counts == 0:
-                    old_block_name = f'{func_name}-{name}-0' if name else f'{func_name}-0'
-                    new_block_name = f'{func_name}-{name}' if name else f'{func_name}'
-                    self.blocks[new_block_name] = self.blocks[old_block_name]
-                    self.blocks.pop(old_block_name)
+        if func_name in self.consolidated:
+            container = shard_filepath(f'{self.dirpath}/{self.filename}-{func_name}', block_name,
+                                       shards=self.consolidated[func_name])
+            return group_target(filepath, container, block_name[len(func_name)+1:])
 
-                    index = self.instances[func_name].index(old_block_name)
-                    self.instances[func_name][index] = new_block_name
+        return self.storage(filepath)
 
-                    filepath = f'{self.dirpath}/{self.filename}-{new_block_name}.h5'
-                    self.blocks[new_block_name].target.filepath = filepath
+    def _authkey_path(self):
+        """path of the key file shared by the coordinator and its workers (serve and worker actions)"""
+        return f'{self.dirpath}/.{self.filename}.authkey'
 
     @doublewrap
-    def cache(self, func, depends=None):
-        """decorator to add a cached function to be conditionally ran"""
+    def cache(self, func, depends=None, consolidate=False, vectorize=False, memory=None, timeout=None, retries=0, stream=False,
+              deduplicate=False):
+        """decorator to add a cached function to be conditionally ran
+
+           Arguments:
+               func           function to cache
+               depends        cached function(s) that must run before this function
+               consolidate    store all instances of the function as groups inside a single container file;
+                              an integer value shards the instances over that many container files
+               vectorize      call the function once for a batch of instances: arguments that differ between
+                              instances are passed as arrays (leading axis: instance), and every returned
+                              symbol is split along its leading axis into the instance targets;
+                              an integer value sets the batch size (default: execution.batch_size in the config)
+               memory         memory (in GB) needed by a single block, used for Slurm job arrays (default: --memory)
+               timeout        time (in seconds) after which a running block (a vectorized batch) is stopped and fails
+               retries        number of times a failed block is retried, after a delay that doubles with every attempt
+                              (execution.retry_backoff in the config is the first delay)
+               stream         start the blocks once the blocks of the functions in depends are running, and iterate over
+                              their records with job.stream while they are produced (see numpipe.streaming)
+               deduplicate    compute instances with the same arguments (but different names) only once, and link the
+                              targets of the duplicates to the result; only for deterministic functions
+        """
+        if memory is not None:
+            self.memory_hints[func.__name__] = memory
+        if timeout is not None:
+            self.timeouts[func.__name__] = timeout
+        if retries:
+            self.retries[func.__name__] = retries
+        if deduplicate:
+            self.deduplicated.add(func.__name__)
+
         sig = signature(func)
         if len(sig.parameters) == 0:
-            filepath = f'{self.dirpath}/{self.filename}-{func.__name__}.h5'
-            self.blocks[func.__name__] = block(
-                        deferred_function(func, num_iterations=None),
-                        target(filepath),
-                        dependencies=depends)
+            self.blocks.register(func, is_instance=False, dependencies=depends, stream=stream)
+            self.blocks.add(func.__name__)
         else:
-            self.instances[func.__name__] = []
-            self.instance_counts[func.__name__] = dict()
-            if depends is not None:
-                if isinstance(depends, str) or not isinstance(depends, Iterable):
-                    self.instance_dependency[func.__name__] = [depends]
-                else:
-                    self.instance_dependency[func.__name__] = depends
+            self.blocks.register(func, is_instance=True, dependencies=depends, stream=stream)
+            if consolidate:
+                if not issubclass(self.storage, h5_target):
+                    raise ValueError(f"Cached function '{func.__name__}' cannot be consolidated with the '{self.storage.__name__}' storage backend")
+                self.consolidated[func.__name__] = int(consolidate)
+            if vectorize:
+                self.vectorized[func.__name__] = vectorize
 
         return func
 
@@ -452,6 +1139,7 @@ class scheduler:
     def plots(self, func):
         """decorator to add a function to be executed at the end for plotting purposes"""
         def wrap():
+            import matplotlib.pyplot as plt
             show_copy = plt.show
             plt.show = lambda: None
             mpl_tools.set_theme(self.args.theme)
@@ -540,13 +1228,13 @@ class scheduler:
         return class_type
 
     def display_functions(self):
-        display.display_message(self.blocks, self.instances, self.at_end_functions)
+        display.display_message(self.blocks, self.at_end_functions)
 
     def _clean(self, filepaths):
         """clean a set of filepaths
 
            Argumnets: 
-               filepaths      list of filepaths to hdf5 files
+               filepaths      list of filepaths to targets, or to temporary files of targets
         """
         if filepaths:
             if not self.args.force:
@@ -556,7 +1244,12 @@ class scheduler:
                     return False
 
             for filepath in filepaths:
-                os.remove(filepath)
+                dirpath, basename = os.path.split(filepath)
+                if basename.startswith('.') and basename.endswith('.tmp'):
+                    ### output left behind by a block that failed or was stopped (see target.temporary_path)
+                    self.storage(os.path.join(dirpath, basename[1:-len('.tmp')])).discard(temporary_only=True)
+                else:
+                    self.storage(filepath).remove()
 
         return True
 
@@ -566,8 +1259,8 @@ class scheduler:
            Argumnets: 
                targets        list of targets to delete
         """
-        targets_to_delete = list(filter(lambda t: t.exists(), targets))
-        filepaths = [target.filepath for target in targets_to_delete]
+        targets_to_delete = list(filter(self.is_cached, targets))
+        filepaths = [str(target) for target in targets_to_delete]
 
         if filepaths:
             if not self.args.force:
@@ -576,36 +1269,29 @@ class scheduler:
                 if not delete:
                     return False
 
-        for target in targets_to_delete:
-            target.remove()
+        for target_type in {type(target) for target in targets_to_delete}:
+            target_type.remove_all([target for target in targets_to_delete if type(target) is target_type])
+
+        if self.catalog is not None:
+            self.catalog.remove(targets_to_delete)
 
         return True
 
     def get_labels(self, name):
         """get a list of block labels for a given name"""
-        if name in self.blocks.keys():
+        if name in self.blocks:
             return [name]
-        elif name in self.instances.keys():
-            return self.instances[name]
-        elif name[-3:] == '.h5':
-            actual_name = name[name.find('-')+1:-3]
-            if actual_name in self.blocks.keys():
+        elif self.blocks.is_instance_function(name):
+            return self.blocks.function_labels(name)
+        elif self.storage.extension and name.endswith(self.storage.extension):
+            actual_name = name[name.find('-')+1:-len(self.storage.extension)]
+            if actual_name in self.blocks:
                 return [actual_name]
 
         raise ValueError(f"Invalid argument: function '{name}' does not correspond to any cached function")
 
     def resolve_dependencies_down(self, blocks):
-        for label, block in self.blocks.items():
-            for D in copy(block.dependencies):
-                all_deps = self.instances.get(D)
-                if all_deps is not None:
-                    block.dependencies.remove(D)
-                    block.dependencies.extend(all_deps)
-
-        for label, block in self.blocks.items():
-            for D in block.dependencies:
-                if label not in self.blocks[D].children:
-                    self.blocks[D].children.append(label)
+        self.blocks.resolve()
 
         if self.args.rerun is not None and len(self.args.rerun) != 0:
             # DOWN the tree
@@ -614,8 +1300,10 @@ class scheduler:
                 while block_dependencies:
                     new_blocks = dict()
                     for label, block in block_dependencies.items():
-                        for child in block.children:
-                            new_blocks[child] = self.blocks[child]
+                        for child in self.blocks.children(block.id):
+                            child_label = self.blocks.label(child)
+                            if child_label not in blocks:
+                                new_blocks[child_label] = self.blocks[child_label]
 
                     blocks.update(new_blocks)
                     block_dependencies = new_blocks
@@ -624,14 +1312,25 @@ class scheduler:
     def resolve_dependencies_up(self, blocks):
         # UP the tree
         block_dependencies = blocks
+        visited_functions = set()
         while block_dependencies:
             new_blocks = dict()
             for label, block in block_dependencies.items():
-                for dependency in block.dependencies:
-                    if not self.blocks[dependency].target.exists():
+                dep_fids, dep_ids = self.blocks.direct_dependencies(block.id)
+                deps = list(dep_ids)
+                for fid in dep_fids:
+                    if fid not in visited_functions:
+                        visited_functions.add(fid)
+                        deps.extend(self.blocks.function_ids(fid))
+
+                for D in deps:
+                    dependency = self.blocks.label(D)
+                    if dependency in blocks or dependency in new_blocks or self.blocks.is_complete(D):
+                        continue
+                    if not self.is_cached(self.blocks.target(D)):
                         new_blocks[dependency] = self.blocks[dependency]
                     else:
-                        self.blocks[dependency].complete = True
+                        self.blocks.set_status(D, COMPLETE)
 
             blocks.update(new_blocks)
             block_dependencies = new_blocks
@@ -656,8 +1355,13 @@ class scheduler:
         return
 
     def clean(self):
-        pathlist = pathlib.Path(self.dirpath).glob(f'{self.filename}-*.h5')
-        current = [block.target.filepath for block in self.blocks.values()]
+        pathlist = pathlib.Path(self.dirpath).glob(f'{self.filename}-*{self.storage.extension}')
+        current = set()
+        containers = set()
+        for block in self.blocks.values():
+            current.update(block.target.files())
+            if isinstance(block.target, group_target):
+                containers.add(block.target.container)
 
         filepaths = []
         for path in pathlist:
@@ -665,12 +1369,33 @@ class scheduler:
             if path_str not in current:
                 filepaths.append(path_str)
 
+        filepaths.extend(str(path) for path in pathlib.Path(self.dirpath).glob(f'.{self.filename}-*.tmp'))
+
         confirm = self._clean(filepaths)
         if not confirm:
             display.abort_message()
+            return
+
+        ### reclaim the space of the groups removed from containers, and remove the lock files of containers;
+        ### containers and lock files held by a running process are left alone
+        for container in containers:
+            if os.path.isfile(container) and repack_container(container) is None:
+                logging.warning(f"'{container}' is not repacked because another process uses it")
+        for path in pathlib.Path(self.dirpath).glob(f'{self.filename}-*.lock'):
+            remove_lock(str(path)[:-len('.lock')])
 
     def _init_logging(self):
-        self.logfile = pathlib.Path(self.dirpath) / f'{self.filename}.log'
+        ### processes that run at the same time (shards, MPI ranks and workers) write to separate logs
+        suffix = ''
+        if getattr(self.args, 'shard', None) is not None:
+            suffix += f'-shard{parse_shard(self.args.shard)[0]}'
+        if getattr(self.args, 'executor', 'pool') == 'mpi' and mpi_comm().Get_rank() != 0:
+            suffix += f'-rank{mpi_comm().Get_rank()}'
+        if self.args.action == 'worker':
+            import socket
+            suffix += f'-worker-{socket.gethostname()}-{os.getpid()}'
+
+        self.logfile = pathlib.Path(self.dirpath) / f'{self.filename}{suffix}.log'
         logging.basicConfig(filename=self.logfile, filemode='w', level=logging.INFO,
                             format='%(levelname)s: %(message)s')
         logging.captureWarnings(True)
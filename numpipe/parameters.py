@@ -1,25 +1,158 @@
+from collections.abc import Sized
 import numpy as np
 from numpipe.utility import flatten_along
 
+class lazy_values:
+    def __init__(self, iterable, length=None):
+        """values of a parameter that are pulled from an iterator (e.g. a generator) as they are needed
+
+        Only the values that are still needed are kept: a value is released once its block completes
+        (see grid.release), and values of blocks that are already complete are skipped when they are pulled
+
+        Arguments:
+            iterable    iterable of values
+            length      number of values (default: unbounded)
+        """
+        self.iterator = iter(iterable)
+        self.values = dict()        # {index: value} of the values pulled and not released
+        self.num_pulled = 0
+        self.length = length
+        self.is_released = None     # function(index) that returns true if a value is no longer needed (see grid.bind)
+        self.num_grids = 0          # number of grids that use the values
+
+    def __getitem__(self, idx):
+        while self.num_pulled <= idx:
+            try:
+                value = next(self.iterator)
+            except StopIteration:
+                raise IndexError(f'parameter has no value at index {idx}: the generator is exhausted')
+
+            if self.num_pulled == idx or not self.releasable() or not self.is_released(self.num_pulled):
+                self.values[self.num_pulled] = value
+            self.num_pulled += 1
+
+        if idx not in self.values:
+            raise IndexError(f'parameter value at index {idx} was released once its block completed: '
+                              'blocks with generator parameters can only run once per process')
+
+        return self.values[idx]
+
+    def releasable(self):
+        """values can only be released if a single grid uses them"""
+        return self.is_released is not None and self.num_grids == 1
+
+    def release(self, idx):
+        if self.releasable():
+            self.values.pop(idx, None)
+
+class adaptive_values:
+    def __init__(self, bounds, metric, budget, initial=5, per_round=None, criterion='gradient'):
+        """values of an adaptive parameter: a coarse grid that is refined in rounds, where a scalar
+        metric of the output changes the most, until the budget is spent
+
+        Arguments:
+            bounds       (lower, upper) bounds of the values
+            metric       function(output) that returns a scalar from the output of an instance
+            budget       total number of values
+            initial      number of values in the initial (uniform) grid (default: 5)
+            per_round    number of values added in every round (default: initial)
+            criterion    where to refine: 'gradient' or 'curvature' of the metric (default: 'gradient')
+        """
+        if criterion not in ('gradient', 'curvature'):
+            raise ValueError(f"invalid adaptive criterion '{criterion}': must be 'gradient' or 'curvature'")
+        if initial < 2:
+            raise ValueError('an adaptive parameter needs at least 2 initial values')
+
+        self.bounds = bounds
+        self.metric = metric
+        self.length = budget
+        self.per_round = initial if per_round is None else per_round
+        self.criterion = criterion
+        self.values = list(np.linspace(bounds[0], bounds[1], min(initial, budget)))
+        self.results = dict()     # {index: metric of the output}
+
+    def __getitem__(self, idx):
+        if idx >= len(self.values):
+            raise IndexError(f'adaptive parameter has no value at index {idx} yet')
+
+        return self.values[idx]
+
+    def available(self):
+        """number of values chosen so far"""
+        return len(self.values)
+
+    def add_result(self, idx, output):
+        """record the output of the instance with value index idx (None if it failed)"""
+        self.results[idx] = np.nan if output is None else float(self.metric(output))
+
+    def refine(self):
+        """choose the values of the next round once the results of all current values are known;
+           return true if new values were added"""
+        if len(self.values) >= self.length or len(self.results) < len(self.values):
+            return False
+
+        x = np.array(self.values, dtype=float)
+        y = np.array([self.results[i] for i in range(len(x))])
+        order = np.argsort(x)
+        x, y = x[order], y[order]
+
+        ### intervals are compared in coordinates scaled to the bounds and the range of the metric;
+        ### failed instances do not contribute to the metric
+        finite = np.isfinite(y)
+        yscale = np.ptp(y[finite]) if finite.sum() > 1 else 0
+        dx = np.diff(x)/abs(self.bounds[1] - self.bounds[0])
+        dy = np.nan_to_num(np.diff(y)/yscale if yscale > 0 else np.zeros_like(dx))
+
+        if self.criterion == 'gradient':
+            loss = np.hypot(dx, dy)
+        else:
+            ### area of the triangle formed by every interior point and its neighbours
+            area = np.zeros(len(dx) + 1)
+            area[1:-1] = np.abs(dx[:-1]*dy[1:] - dx[1:]*dy[:-1])/2
+            loss = np.sqrt(area[:-1] + area[1:]) + dx
+
+        num_new = min(self.per_round, self.length - len(self.values), len(loss))
+        for i in sorted(np.argsort(loss)[::-1][:num_new]):
+            self.values.append((x[i] + x[i+1])/2)
+
+        return True
+
+def num_values(values):
+    """number of values of a parameter (None if unbounded)"""
+    if isinstance(values, (lazy_values, adaptive_values)):
+        return values.length
+
+    return len(values)
+
 class parameter():
-    def __init__(self, arg, axis=None, gather=False, outer=False, labels=None):
+    def __init__(self, arg, axis=None, gather=False, outer=False, labels=None, length=None):
         """a parameter for input to the scheduler.add function
 
         Arguments:
-            arg       iterable / numpy array for values of the parameter
+            arg       iterable / numpy array / range / generator for values of the parameter;
+                      ranges and generators are not materialized
             axis      axis / axes over which to apply the parameter (default: all)
             gather    whether to gather results together at the end (default: False)
             outer     whether to perform an outer product over other parameters (default: False)
             labels    label for each argument to be added to the filename (default: none)
+            length    number of values to use (default: all); required for generators that are
+                      used in an outer product or are not zipped with a parameter of known length
         """
-        self.arg = flatten_along(np.asarray(arg), axis)
+        if isinstance(arg, adaptive_values) or (isinstance(arg, range) and axis is None):
+            self.arg = arg
+        elif not isinstance(arg, (Sized, np.ndarray)) and hasattr(arg, '__iter__'):
+            self.arg = lazy_values(arg, length)
+        else:
+            self.arg = flatten_along(np.asarray(arg), axis)
+
+        if length is not None and not isinstance(self.arg, (lazy_values, adaptive_values)):
+            self.arg = self.arg[:length]
+
         self.axis = axis
         self.gather = gather
         self.outer = outer
         self.labels = labels
-        if self.labels is None:
-            self.labels = ['']*len(self.arg)
-        else:
+        if self.labels is not None:
             self.labels = [str(l) for l in labels]
 
 def gather(params, axis=None, outer=False):
@@ -49,3 +182,205 @@ def outer(params, axis=None, gather=False):
         all_params[name] = parameter(val, axis=axis, gather=gather, outer=True)
 
     return all_params
+
+def adaptive(name, bounds, metric, budget, initial=5, per_round=None, criterion='gradient'):
+    """an adaptive parameter: instances are added in rounds, starting from a coarse grid and refining
+    where a scalar metric of the output has the largest gradient or curvature, until the budget is spent
+
+    Samples are chosen from the results of earlier rounds, so they are reproducible as long as the
+    function and the metric do not change (re-run all instances otherwise). Instances are named by
+    sample index, and can be loaded like any other instance
+
+    Arguments:
+        name         name of the parameter
+        bounds       (lower, upper) bounds of the parameter
+        metric       function(output) that returns a scalar from the output of an instance
+                     (the output is the same as what scheduler.load returns for the instance)
+        budget       total number of instances
+        initial      number of instances in the initial (uniform) grid (default: 5)
+        per_round    number of instances added in every round (default: initial)
+        criterion    where to refine: 'gradient' or 'curvature' of the metric (default: 'gradient')
+    """
+    return {name: parameter(adaptive_values(bounds, metric, budget, initial=initial,
+                                            per_round=per_round, criterion=criterion))}
+
+class grid:
+    def __init__(self, name, kwargs):
+        """the grid of instances created by a single call to scheduler.add
+
+        Instances are rows of the grid: an outer product over the outer parameters (outer loop)
+        and a zip over the other parameters (inner loop). Rows reference the shared parameter arrays,
+        and the kwargs of a row are only materialized when it is needed
+
+        Arguments:
+            name      base name of the instances
+            kwargs    dictionary of {argument name: value}, where values can be parameters
+        """
+        self.name = name
+        self.kwargs = kwargs
+        self.zip_keys = [key for key, val in kwargs.items() if isinstance(val, parameter) and not val.outer]
+        self.outer_keys = [key for key, val in kwargs.items() if isinstance(val, parameter) and val.outer]
+
+        ### an adaptive parameter chooses its values from the results, so it must be the only parameter
+        self.adaptive = None
+        for key in self.zip_keys + self.outer_keys:
+            if isinstance(kwargs[key].arg, adaptive_values):
+                if len(self.zip_keys) + len(self.outer_keys) > 1 or kwargs[key].outer:
+                    raise ValueError(f"adaptive parameter '{key}' cannot be combined with other parameters")
+                self.adaptive = kwargs[key].arg
+
+        zip_lengths = [num_values(kwargs[key].arg) for key in self.zip_keys]
+        if self.zip_keys and all(n is None for n in zip_lengths):
+            raise ValueError(f"the length of generator parameters {self.zip_keys} must be given (parameter(..., length=...))")
+        self.nzip = min((n for n in zip_lengths if n is not None), default=1)
+
+        self.shape = tuple(num_values(kwargs[key].arg) for key in self.outer_keys)
+        if None in self.shape:
+            raise ValueError("the length of generator parameters in an outer product must be given (parameter(..., length=...))")
+        self.size = self.nzip*int(np.prod(self.shape, dtype=np.int64))
+
+        ### only parameters with labels contribute to the names (outer labels first, then zip labels)
+        self.label_keys = [key for key in self.outer_keys + self.zip_keys
+                           if kwargs[key].labels is not None and any(kwargs[key].labels)]
+
+        ### grids of only zip or only outer parameters always separate the base name and labels with '-',
+        ### even if there are no labels (kept so that existing targets keep their names)
+        self.prefix = ''
+        if name and bool(self.zip_keys) != bool(self.outer_keys) and self.adaptive is None:
+            self.prefix, self.name = name + '-', ''
+
+    def __len__(self):
+        return self.size
+
+    def available(self):
+        """number of rows whose kwargs are known"""
+        if self.adaptive is not None:
+            return self.adaptive.available()
+
+        return self.size
+
+    def indices(self, rows):
+        """dictionary of {parameter name: index into its values} for a row (or an array of rows)"""
+        outer_rows, zip_rows = divmod(rows, self.nzip)
+        indices = dict.fromkeys(self.zip_keys, zip_rows)
+        for key, n in zip(reversed(self.outer_keys), reversed(self.shape)):
+            outer_rows, indices[key] = divmod(outer_rows, n)
+
+        return indices
+
+    def row_kwargs(self, row):
+        """the kwargs of a row"""
+        kwargs = dict(self.kwargs)
+        for key, idx in self.indices(row).items():
+            kwargs[key] = self.kwargs[key].arg[idx]
+
+        return kwargs
+
+    def batch_values(self, key, rows):
+        """the values of an argument for a batch of rows, as an array with a leading axis over the rows"""
+        if key not in self.kwargs:
+            raise ValueError(f"argument '{key}' must be given to every instance of a vectorized function")
+
+        value = self.kwargs[key]
+        if not isinstance(value, parameter):
+            value = np.asarray(value)
+            return np.broadcast_to(value, (len(rows),) + value.shape)
+
+        idx = self.indices(np.asarray(rows))[key]
+        if isinstance(value.arg, np.ndarray):
+            return value.arg[idx]
+        else:
+            return np.array([value.arg[i] for i in idx])
+
+    def bind(self, is_complete):
+        """
+        Let the values of generator parameters be released once their blocks complete (see release);
+        only parameters that are zipped without an outer product have a value per row
+
+        Arguments:
+            is_complete     function(row) that returns true if the block of a row is complete
+        """
+        if self.outer_keys:
+            return
+
+        for key in self.zip_keys:
+            values = self.kwargs[key].arg
+            if isinstance(values, lazy_values):
+                values.is_released = is_complete
+                values.num_grids += 1
+
+    def release(self, row):
+        """release the values of generator parameters of a row whose block completed (see bind)"""
+        if self.outer_keys:
+            return
+
+        for key in self.zip_keys:
+            values = self.kwargs[key].arg
+            if isinstance(values, lazy_values):
+                values.release(row)
+
+    def row_name(self, row):
+        """the name of a row: the base name and the parameter labels, joined by '-'"""
+        if not self.label_keys:
+            return self.prefix + self.name
+
+        indices = self.indices(row)
+        parts = [self.name] + [self.kwargs[key].labels[indices[key]] for key in self.label_keys]
+        return self.prefix + '-'.join(filter(None, parts))
+
+    def unique_names(self, chunk=65536):
+        """the distinct names of the rows, as ({name: number of rows}, occurrence of every row among the rows with
+           the same name, or None if no name repeats), or None if all rows have the same name
+
+        Rows are processed in chunks, so that only the occurrences grow with the size of the grid (and only if
+        names repeat)
+        """
+        if not self.label_keys:
+            return None
+
+        label_sets = [np.unique(np.asarray(self.kwargs[key].labels, dtype=object), return_inverse=True)
+                      for key in self.label_keys]
+        name_ids = dict()           # {name: id}
+        code_ids = dict()           # {label combination code: name id}
+        totals = []                 # number of rows of every name id so far
+        occurrences = None
+
+        for start in range(0, self.size, chunk):
+            rows = np.arange(start, min(start + chunk, self.size))
+            indices = self.indices(rows)
+            codes = np.zeros(len(rows), dtype=np.int64)
+            for key, (labels, inverse) in zip(self.label_keys, label_sets):
+                codes = codes*len(labels) + inverse[indices[key]]
+
+            ### names are only built for the distinct codes; different codes can still give the same name
+            codes, inverse = np.unique(codes, return_inverse=True)
+            for code in codes.tolist():
+                if code not in code_ids:
+                    name = self._code_name(code, [labels for labels, _ in label_sets])
+                    code_ids[code] = name_ids.setdefault(name, len(name_ids))
+            ids = np.array([code_ids[code] for code in codes.tolist()], dtype=np.int64)[inverse.ravel()]
+
+            ### occurrence of every row among the rows with the same name, offset by the earlier chunks
+            totals.extend([0]*(len(name_ids) - len(totals)))
+            prior = np.array(totals, dtype=np.int64)
+            order = np.argsort(ids, kind='stable')
+            occurrence = np.empty(len(rows), dtype=np.int64)
+            occurrence[order] = np.arange(len(rows)) - np.searchsorted(ids[order], ids[order])
+            occurrence += prior[ids]
+
+            if occurrence.any():
+                if occurrences is None:
+                    occurrences = np.zeros(self.size, dtype=np.int64)
+                occurrences[start:start + len(rows)] = occurrence
+            totals = (prior + np.bincount(ids, minlength=len(prior))).tolist()
+
+        return dict(zip(name_ids, totals)), occurrences
+
+    def _code_name(self, code, label_sets):
+        """the name of a label combination code (see unique_names)"""
+        parts = []
+        for labels in reversed(label_sets):
+            code, digit = divmod(code, len(labels))
+            parts.insert(0, labels[digit])
+
+        return self.prefix + '-'.join(filter(None, [self.name] + parts))
@@ -4,19 +4,25 @@ Defines the argument parser
 import argparse
 from numpipe import config
 
-notifications_default_delay = config.get_config()['notifications']['delay_default']
-processes_default = None if config.get_config()['execution']['parallel_default'] else 1
-mininterval = config.get_config()['progress']['mininterval']
-
 def run_parser():
+    notifications_default_delay = config.get_config()['notifications']['delay_default']
+    processes_default = None if config.get_config()['execution']['parallel_default'] else 1
+    mininterval = config.get_config()['progress']['mininterval']
+    speculation = config.get_config()['execution']['speculation']
+    max_tasks_per_worker = config.get_config()['execution']['max_tasks_per_worker']
+    max_worker_memory = config.get_config()['execution']['max_worker_memory']
+    handoff_memory = config.get_config()['execution']['handoff_memory']
+
     parser = argparse.ArgumentParser()
 
     subparsers = parser.add_subparsers(dest="action")
     display_parser = subparsers.add_parser('display', help='display available functions and descriptions')
-    display_parser = subparsers.add_parser('clean', help='remove all h5files that are no longer cache functions')
+    display_parser = subparsers.add_parser('clean', help='remove all h5files that are no longer cache functions, and compact consolidated files')
     slurm_parse = subparsers.add_parser('slurm', help='run on a system with the Slurm Workload Manager')
+    serve_parse = subparsers.add_parser('serve', help='hand out blocks to workers that connect over TCP')
+    worker_parse = subparsers.add_parser('worker', help='run blocks handed out by a coordinator (see serve)')
 
-    for p in [parser, slurm_parse]:
+    for p in [parser, slurm_parse, serve_parse]:
         p.add_argument('-r', '--rerun', nargs='*', type=str, default=None, help='re-run specific cached functions by name')
         p.add_argument('-f', '--force', action='store_true', help='force over-write any existing cached data')
         p.add_argument('-d', '--delete', nargs='*', type=str, default=None, help='delete specified cached data')
@@ -26,6 +32,11 @@ def run_parser():
         p.add_argument('-p', '--processes', nargs='?', default=processes_default, type=int, help='number of processes to use in parallel execution (default: cpu_count)')
         p.add_argument('-ct', '--cache_time', type=float, default=300, help='time (in seconds) until data cached data is flushed to file')
         p.add_argument('--no-deps', action='store_true', default=False, help='do not rerun functions that depend on other reran functions')
+        p.add_argument('--speculation', type=float, default=speculation, help='start a second copy of a block on an idle worker once it runs longer than this factor times the 95th percentile runtime of its function, e.g. 3 (default: 0, disabled); only for functions that are safe to run twice at once')
+        p.add_argument('--max-tasks-per-worker', type=int, default=max_tasks_per_worker, help='replace a worker process by a new one after this many blocks (0: no limit)')
+        p.add_argument('--max-worker-memory', type=float, default=max_worker_memory, help='resident memory (in GB) of a worker process above which it is replaced after its block, or killed while its block runs (0: no limit)')
+        p.add_argument('--handoff-memory', type=float, default=handoff_memory, help='memory (in GB) of shared memory that holds the outputs of finished blocks, so that the blocks that depend on them load them without reading their targets (0 to disable)')
+        p.add_argument('--fail-fast', action='store_true', default=False, help='cancel the remaining blocks once a block fails (after its retries)')
         p.add_argument('--mininterval', type=float, default=mininterval, help='time (in seconds) for progress bar mininterval argument')
         p.add_argument('--notify', action='store_true', default=False, help='send notifications without delay')
         p.add_argument('--notify-message', type=str, default=None, help='send a custom message with other notifications')
@@ -40,10 +51,21 @@ def run_parser():
         # p.add_argument('--theme', choices=['classic', 'dark'], default='classic', help='matplotlib plot theme')
 
     parser.add_argument('--debug', action='store_true', default=False, help='run in debug mode (single process)')
+    parser.add_argument('--executor', choices=['pool', 'mpi'], default='pool', help='run blocks in a pool of local processes, or on the ranks of an MPI job (rank 0 schedules, e.g. mpirun -n 4 python sim.py --executor mpi)')
+    parser.add_argument('--shard', type=str, default=None, help='only run shard {i}/{n} of the blocks (i from 0 to n-1), e.g. to split a sweep across the elements of a job array')
+    parser.add_argument('--shard-by', choices=['count', 'runtime'], default='count', help='balance shards by number of blocks or by runtimes from previous runs (default: count)')
+
+    serve_parse.add_argument('--host', type=str, default='127.0.0.1', help="address to listen on (default: loopback only). Any host that can reach the address and has the key (network.authkey in the config, or the key file next to the script) can run code in the workers; only listen on trusted networks, e.g. '' for all interfaces of a private cluster")
+    serve_parse.add_argument('--port', type=int, default=6000, help='port to listen on (default: 6000)')
+    serve_parse.add_argument('--heartbeat-timeout', type=float, default=60, help='time (in seconds) without a message from a busy worker before its block is handed to another worker')
+    serve_parse.set_defaults(debug=False, executor='tcp', shard=None)
+
+    worker_parse.add_argument('--connect', type=str, required=True, help='address of the coordinator, formatted as {host}:{port}')
 
     slurm_parse.add_argument('-t', '--time', type=str, default='36', help='maximum run-time for the Slurm job, formated as {hours}:{minutes}:{seconds} (minutes and seconds optional)')
     slurm_parse.add_argument('-m', '--memory', type=float, default=2, help='maximum memory per cpu for the Slurm job in GB')
-    slurm_parse.add_argument('--batch', action='store_true', help='submit the Slurm job in batches')
+    slurm_parse.add_argument('--batch', action='store_true', help='submit job arrays, packing blocks into elements that fit the wall-time based on previous runtimes')
+    slurm_parse.add_argument('--runtime-estimate', type=float, default=None, help='runtime (in seconds) of blocks of functions that never ran, for --batch (default: one block per element)')
     slurm_parse.add_argument('--no-submit', action='store_true', help="don't submit the Slurm job after creating sbatch files")
 
     return parser.parse_args()
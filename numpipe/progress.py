@@ -1,7 +1,7 @@
 from time import sleep
 from random import random
 from multiprocessing import Pool, Lock, Value, Array
-from termcolor import colored
+from numpipe.display import colored
 from time import time
 import os
 import sys
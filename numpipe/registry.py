@@ -0,0 +1,691 @@
+"""
+Compact registry of execution blocks
+
+Blocks are stored column-wise instead of as individual objects: every call to scheduler.add creates
+a grid of blocks with contiguous ids, and the name, kwargs and target of a block are computed from its
+grid on demand. Dependencies are stored once per cached function rather than once per instance, and the
+only state kept for every block is a completion bit; other per-block state only covers some blocks (the counts of
+rows of grids whose labels repeat, the fingerprints of the blocks that ran, and the values of generator parameters
+that were pulled and whose blocks are not complete yet). The registry behaves like a dictionary of {label: block},
+where each block is a lightweight view
+"""
+
+from array import array
+from bisect import bisect_right
+from collections import defaultdict
+from itertools import chain
+from typing import Iterable
+import numpy as np
+
+from numpipe.execution import deferred_function, block as detached_block, batch_block, hash_value
+from numpipe.parameters import grid
+
+PENDING = 0
+COMPLETE = 1
+WAITING = -1      # pulled from a grid whose next blocks are not known yet
+
+def dependency_names(dependencies):
+    """convert a dependency (or list of dependencies) to a list of names"""
+    if dependencies is None:
+        return []
+
+    f = lambda D: D if isinstance(D, str) else D.__name__
+    if isinstance(dependencies, str) or not isinstance(dependencies, Iterable):
+        return [f(dependencies)]
+    else:
+        return [f(D) for D in dependencies]
+
+class block:
+    """A view of a single block in a block_registry"""
+    __slots__ = ('registry', 'id')
+
+    def __init__(self, registry, id):
+        self.registry = registry
+        self.id = id
+
+    @property
+    def label(self):
+        return self.registry.label(self.id)
+
+    @property
+    def deferred_function(self):
+        return self.registry.deferred_function(self.id)
+
+    @property
+    def target(self):
+        return self.registry.target(self.id)
+
+    @property
+    def complete(self):
+        return self.registry.is_complete(self.id)
+
+    @complete.setter
+    def complete(self, value):
+        self.registry.set_status(self.id, COMPLETE if value else PENDING)
+
+    @property
+    def dependencies(self):
+        return [self.registry.label(D) for D in self.registry.dependencies(self.id)]
+
+    @property
+    def children(self):
+        return [self.registry.label(C) for C in self.registry.children(self.id)]
+
+    def depends(self, dependencies):
+        """add dependencies to this block only"""
+        self.registry.add_dependencies(self.id, dependencies)
+        return self
+
+    def __reduce__(self):
+        """blocks are sent to worker processes detached from the registry"""
+        return (detached_block, (self.deferred_function, self.target))
+
+    def detach(self):
+        return self.registry.detach(self.id)
+
+class block_registry:
+    def __init__(self, make_target):
+        """
+        Registry of all blocks
+
+        Arguments:
+            make_target     function(label, func_name) that creates the target of a block
+        """
+        self.make_target = make_target
+
+        ### function columns
+        self.function_index = dict()
+        self.functions = []
+        self.function_is_instance = []
+        self.function_dependencies = []
+        self.function_stream = []            # True if the function streams the records of its dependencies
+        self.function_grids = []
+        self.function_pending = array('q')
+        self.function_running = array('q')   # number of blocks running on a worker
+
+        ### grid columns
+        self.grids = []
+        self.grid_function = array('i')
+        self.grid_start = array('q')
+        self.grid_count = array('q')         # count of the first row, if all rows have the same name
+        self.grid_prior = []                 # {name: count of the first row with the name} of names used by earlier grids,
+                                             # if rows have labels
+        self.grid_counts = []                # occurrence of every row among the rows with its name (None: no name repeats)
+        self.grid_complete = []              # completion bitmap, allocated when a row is first completed
+        self.size = 0
+
+        ### block columns
+        self.block_dependencies = dict()     # sparse: only blocks with their own extra dependencies
+        self.failed = set()                  # blocks that failed (or were skipped because a dependency failed)
+        self.failed_functions = set()        # functions with a failed block
+        self.running = set()                 # blocks running on a worker (not queued)
+        self.fingerprints = dict()           # {id: fingerprint} of the blocks whose fingerprint was computed
+        self.selected = None                 # ids of the blocks selected to run (None: all blocks, see dispatch_queue)
+
+        self.name_counts = dict()
+        self._index = None
+        self._resolved = None
+        self._swept = dict()
+
+    def register(self, func, is_instance, dependencies=None, stream=False):
+        """
+        Register a cached function
+
+        Arguments:
+            func            the function
+            is_instance     True if instances of the function are added with scheduler.add
+            dependencies    dependencies shared by all blocks of the function
+            stream          if True, the blocks of the function are ready once the blocks of these dependencies
+                            are running, and stream their records (see numpipe.streaming)
+        """
+        fid = len(self.functions)
+        self.function_index[func.__name__] = fid
+        self.functions.append(func)
+        self.function_is_instance.append(is_instance)
+        self.function_dependencies.append(dependency_names(dependencies))
+        self.function_stream.append(stream)
+        self.function_grids.append(array('i'))
+        self.function_pending.append(0)
+        self.function_running.append(0)
+
+        return fid
+
+    def add(self, func_name, name='', kwargs=None):
+        """add a single block for a registered function and return it"""
+        return self.add_grid(func_name, grid(name, {} if kwargs is None else kwargs))
+
+    def add_grid(self, func_name, instances):
+        """
+        Add a grid of blocks for a registered function
+
+        Arguments:
+            func_name     name of the function
+            instances     parameters.grid of instances
+
+        Returns the block if the grid has a single row without parameters, otherwise None
+        """
+        fid = self.function_index[func_name]
+        size = len(instances)
+        if size == 0:
+            return None
+
+        groups = instances.unique_names()
+        if groups is None:
+            ### all rows share the same name: row counts follow consecutively
+            key = (fid, instances.row_name(0))
+            count = self.name_counts.get(key, 0)
+            self.name_counts[key] = count + size
+            prior = None
+            counts = None
+        else:
+            ### the count of a row is its occurrence among the rows with the same name, offset by earlier blocks
+            totals, counts = groups
+            prior = dict()
+            for name, total in totals.items():
+                key = (fid, name)
+                if key in self.name_counts:
+                    prior[name] = self.name_counts[key]
+                self.name_counts[key] = prior.get(name, 0) + total
+            count = 0
+
+        gid = len(self.grids)
+        start = self.size
+        self.grids.append(instances)
+        self.grid_function.append(fid)
+        self.grid_start.append(start)
+        self.grid_count.append(count)
+        self.grid_prior.append(prior)
+        self.grid_counts.append(counts)
+        self.grid_complete.append(None)
+
+        self.size += size
+        self.function_grids[fid].append(gid)
+        self.function_pending[fid] += size
+
+        self._index = None
+        self._resolved = None
+        self._swept.pop(fid, None)
+        instances.bind(lambda row: not self.is_needed(start + row))
+
+        if not (instances.zip_keys or instances.outer_keys):
+            return block(self, start)
+
+    def locate(self, id):
+        """the (grid id, row) of a block"""
+        gid = bisect_right(self.grid_start, id) - 1
+        return gid, id - self.grid_start[gid]
+
+    def block_function(self, id):
+        return self.grid_function[self.locate(id)[0]]
+
+    def grid_ids(self, gid):
+        """ids of all blocks of a grid"""
+        return range(self.grid_start[gid], self.grid_start[gid] + len(self.grids[gid]))
+
+    def function_ids(self, fid):
+        """ids of all blocks of a function"""
+        return chain.from_iterable(self.grid_ids(gid) for gid in self.function_grids[fid])
+
+    def function_size(self, fid):
+        """number of blocks of a function"""
+        return sum(len(self.grids[gid]) for gid in self.function_grids[fid])
+
+    def ids(self):
+        """ids of all blocks"""
+        return range(self.size)
+
+    def add_dependencies(self, id, dependencies):
+        self.block_dependencies.setdefault(id, []).extend(dependency_names(dependencies))
+        self._resolved = None
+
+    def label(self, id):
+        """the label of a block: {function}-{name}-{count}, dropping empty names and unique counts"""
+        gid, row = self.locate(id)
+        fid = self.grid_function[gid]
+        func_name = self.functions[fid].__name__
+        if not self.function_is_instance[fid]:
+            return func_name
+
+        name = self.grids[gid].row_name(row)
+        parts = [func_name, name] if name else [func_name]
+        if self.name_counts[(fid, name)] > 1:
+            prior, counts = self.grid_prior[gid], self.grid_counts[gid]
+            if prior is None:
+                count = self.grid_count[gid] + row
+            else:
+                count = prior.get(name, 0) + (0 if counts is None else int(counts[row]))
+            parts.append(str(count))
+
+        return '-'.join(parts)
+
+    def name(self, id):
+        """the name of an instance block, without its count"""
+        gid, row = self.locate(id)
+        return self.grids[gid].row_name(row)
+
+    def deferred_function(self, id):
+        """the function of a block, with its kwargs materialized"""
+        gid, row = self.locate(id)
+        return deferred_function(self.functions[self.grid_function[gid]], kwargs=self.grids[gid].row_kwargs(row))
+
+    def fingerprint(self, id):
+        """the fingerprint of a block (see deferred_function.fingerprint), computed once"""
+        if id not in self.fingerprints:
+            self.fingerprints[id] = self.deferred_function(id).fingerprint()
+
+        return self.fingerprints[id]
+
+    def target(self, id):
+        return self.make_target(self.label(id), self.function_name(id))
+
+    def detach(self, id):
+        """a block that holds its own function and target, independent of the registry"""
+        return detached_block(self.deferred_function(id), self.target(id))
+
+    def swept_keys(self, fid):
+        """names of the arguments whose values differ between the blocks of a function"""
+        if fid not in self._swept:
+            grids = [self.grids[gid] for gid in self.function_grids[fid]]
+            keys = set()
+            for instances in grids:
+                keys.update(instances.zip_keys + instances.outer_keys)
+
+            first = grids[0].kwargs if grids else dict()
+            for instances in grids[1:]:
+                for key in set(first) | set(instances.kwargs):
+                    if key in keys:
+                        continue
+                    if key not in first or key not in instances.kwargs \
+                            or hash_value(first[key]) != hash_value(instances.kwargs[key]):
+                        keys.add(key)
+
+            self._swept[fid] = sorted(keys)
+
+        return self._swept[fid]
+
+    def detach_batch(self, ids):
+        """
+        A batch_block for blocks of the same function, called once for all blocks: arguments that differ
+        between the blocks of the function are passed as arrays (leading axis: block), others unchanged
+        """
+        fid = self.block_function(ids[0])
+        segments = defaultdict(list)
+        for id in ids:
+            gid, row = self.locate(id)
+            segments[gid].append(row)
+
+        kwargs = dict(self.grids[next(iter(segments))].kwargs)
+        for key in self.swept_keys(fid):
+            kwargs[key] = np.concatenate([self.grids[gid].batch_values(key, rows) for gid, rows in segments.items()])
+
+        func = deferred_function(self.functions[fid], kwargs=kwargs)
+        return batch_block(func, [self.target(id) for id in ids], [self.deferred_function(id).kwargs for id in ids])
+
+    def function_name(self, id):
+        return self.functions[self.block_function(id)].__name__
+
+    def is_instance(self, id):
+        """return true if the block is an instance of a function (added with scheduler.add)"""
+        return self.function_is_instance[self.block_function(id)]
+
+    def is_instance_function(self, func_name):
+        fid = self.function_index.get(func_name)
+        return fid is not None and self.function_is_instance[fid]
+
+    def function_labels(self, func_name):
+        """labels of all blocks of a function"""
+        return [self.label(id) for id in self.function_ids(self.function_index[func_name])]
+
+    def instances(self):
+        """dictionary of {function name: [labels]} for all instance functions"""
+        return {func.__name__: self.function_labels(func.__name__) for fid, func in enumerate(self.functions)
+                    if self.function_is_instance[fid]}
+
+    def is_complete(self, id):
+        gid, row = self.locate(id)
+        bitmap = self.grid_complete[gid]
+        return bitmap is not None and bool(bitmap[row >> 3] & (1 << (row & 7)))
+
+    def is_needed(self, id):
+        """return true if a block may still run: it is not complete, and it is selected to run (see dispatch_queue)"""
+        return not self.is_complete(id) and (self.selected is None or id in self.selected)
+
+    def set_status(self, id, status):
+        if status == COMPLETE:
+            self.set_running(id, False)
+        if self.is_complete(id) == (status == COMPLETE):
+            return
+
+        gid, row = self.locate(id)
+        if self.grid_complete[gid] is None:
+            self.grid_complete[gid] = bytearray((len(self.grids[gid]) + 7) >> 3)
+
+        self.grid_complete[gid][row >> 3] ^= 1 << (row & 7)
+        self.function_pending[self.grid_function[gid]] += -1 if status == COMPLETE else 1
+        if status == COMPLETE:
+            self.grids[gid].release(row)
+
+    def set_running(self, id, running=True):
+        """record that a block started running on a worker (running=True), or no longer runs without being complete"""
+        if running == (id in self.running):
+            return
+
+        if running:
+            self.running.add(id)
+        else:
+            self.running.remove(id)
+        self.function_running[self.block_function(id)] += 1 if running else -1
+
+    ### mapping interface
+    @property
+    def index(self):
+        """dictionary of {label: block id}"""
+        if self._index is None:
+            self._index = {self.label(id): id for id in self.ids()}
+
+        return self._index
+
+    def id(self, label):
+        return self.index[label]
+
+    def __getitem__(self, label):
+        return block(self, self.index[label])
+
+    def __contains__(self, label):
+        return label in self.index
+
+    def __len__(self):
+        return self.size
+
+    def __iter__(self):
+        return (self.label(id) for id in self.ids())
+
+    def keys(self):
+        return iter(self)
+
+    def values(self):
+        return (block(self, id) for id in self.ids())
+
+    def items(self):
+        return ((self.label(id), block(self, id)) for id in self.ids())
+
+    ### dependencies
+    def _resolve_names(self, names):
+        """split dependency names into (function ids, block ids)"""
+        fids = []
+        ids = []
+        for name in names:
+            if name in self.function_index:
+                fids.append(self.function_index[name])
+            elif name in self.index:
+                ids.append(self.index[name])
+            else:
+                raise ValueError(f"Invalid dependency: '{name}' does not correspond to any cached function")
+
+        return fids, ids
+
+    def resolve(self):
+        """resolve the dependency names of all functions and blocks to ids"""
+        if self._resolved is not None:
+            return self._resolved
+
+        function_deps = [self._resolve_names(names) for names in self.function_dependencies]
+        block_deps = {id: self._resolve_names(names) for id, names in self.block_dependencies.items()}
+
+        ### children are stored per function where possible, so that no list is created per block
+        children = dict(function=defaultdict(list), block=defaultdict(list))
+        for kind, deps in (('function', enumerate(function_deps)), ('block', block_deps.items())):
+            for child, (dep_fids, dep_ids) in deps:
+                for dep_fid in dep_fids:
+                    children[kind][('function', dep_fid)].append(child)
+                for D in dep_ids:
+                    children[kind][('block', D)].append(child)
+
+        self._resolved = (function_deps, block_deps, children['function'], children['block'])
+        return self._resolved
+
+    def direct_dependencies(self, id):
+        """the dependencies of a block as (function ids, block ids)"""
+        function_deps, block_deps, _, _ = self.resolve()
+        dep_fids, dep_ids = function_deps[self.block_function(id)]
+        if id in block_deps:
+            dep_fids = dep_fids + block_deps[id][0]
+            dep_ids = dep_ids + block_deps[id][1]
+
+        return dep_fids, dep_ids
+
+    def dependencies(self, id):
+        """ids of all blocks that a block depends on"""
+        dep_fids, dep_ids = self.direct_dependencies(id)
+        deps = []
+        for dep_fid in dep_fids:
+            deps.extend(self.function_ids(dep_fid))
+        deps.extend(dep_ids)
+
+        return deps
+
+    def children(self, id):
+        """ids of all blocks that depend on a block"""
+        _, _, function_children, block_children = self.resolve()
+        keys = (('function', self.block_function(id)), ('block', id))
+        children = []
+        for key in keys:
+            for fid in function_children.get(key, ()):
+                children.extend(self.function_ids(fid))
+        for key in keys:
+            children.extend(block_children.get(key, ()))
+
+        return children
+
+    def has_children(self, id):
+        """return true if any block depends on a block"""
+        _, _, function_children, block_children = self.resolve()
+        keys = (('function', self.block_function(id)), ('block', id))
+        return any(function_children.get(key) or block_children.get(key) for key in keys)
+
+    def has_stream_children(self, id):
+        """return true if a function that streams its dependencies depends on the function of a block"""
+        _, _, function_children, _ = self.resolve()
+        return any(self.function_stream[fid] for fid in function_children.get(('function', self.block_function(id)), ()))
+
+    def _dependencies_ready(self, fid, dep_fids, dep_ids):
+        """return true if dependencies of a block of a function are complete; the function dependencies
+           of a streaming function only need to be running"""
+        if self.function_stream[fid]:
+            unfinished = lambda dep_fid: self.function_pending[dep_fid] - self.function_running[dep_fid]
+        else:
+            unfinished = lambda dep_fid: self.function_pending[dep_fid]
+
+        return not any(unfinished(dep_fid) for dep_fid in dep_fids) \
+                and all(self.is_complete(D) for D in dep_ids)
+
+    def function_ready(self, fid):
+        """return true if all dependencies shared by the blocks of a function are complete"""
+        dep_fids, dep_ids = self.resolve()[0][fid]
+        return self._dependencies_ready(fid, dep_fids, dep_ids)
+
+    def ready(self, id):
+        """return true if all dependencies of a block are complete"""
+        fid = self.block_function(id)
+        function_deps, block_deps, _, _ = self.resolve()
+        ready = self._dependencies_ready(fid, *function_deps[fid])
+        if id in block_deps:
+            ### dependencies added to a single block are never streamed
+            dep_fids, dep_ids = block_deps[id]
+            ready = ready and not any(self.function_pending[dep_fid] for dep_fid in dep_fids) \
+                    and all(self.is_complete(D) for D in dep_ids)
+
+        return ready
+
+    def fail(self, ids):
+        """mark blocks complete but failed: the blocks that depend on them are not run (see dependency_failed)"""
+        for id in ids:
+            self.set_status(id, COMPLETE)
+            self.failed.add(id)
+            self.failed_functions.add(self.block_function(id))
+
+    def dependency_failed(self, id):
+        """return true if a dependency of a block failed"""
+        if not self.failed:
+            return False
+
+        dep_fids, dep_ids = self.direct_dependencies(id)
+        return any(dep_fid in self.failed_functions for dep_fid in dep_fids) \
+                or any(D in self.failed for D in dep_ids)
+
+class dispatch_queue:
+    def __init__(self, registry, selection=None, skip=None, batch_size=None):
+        """
+        Pull blocks that are ready to run, one grid at a time, without materializing the blocks
+
+        Arguments:
+            registry     the block_registry
+            selection    ids of the blocks to run (default: all blocks)
+            skip         function(id) that returns true if a block is already complete; skipped blocks
+                         are marked complete instead of being returned
+                         (blocks whose dependencies failed are skipped as well, and collected in the
+                         skipped list; see block_registry.fail)
+            batch_size   function(function id) that returns the number of blocks of the same grid
+                         to pull at once (default: 1)
+        """
+        self.registry = registry
+        self.skip = skip
+        self.batch_size = batch_size
+        registry.selected = None if selection is None else set(selection)
+
+        ### remaining block ids of every grid, in grid order
+        self.sources = dict()
+        if selection is None:
+            for gid in range(len(registry.grids)):
+                self.sources[gid] = self._source(gid, registry.grid_ids(gid), None)
+        else:
+            grids = defaultdict(list)
+            for id in sorted(selection):
+                grids[registry.locate(id)[0]].append(id)
+            for gid in sorted(grids):
+                self.sources[gid] = self._source(gid, grids[gid], set(grids[gid]))
+
+        self.waiting = []       # blocks that wait on their own extra dependencies
+        self.skipped = []       # blocks that were not returned because a dependency failed
+
+    def empty(self):
+        return not (self.sources or self.waiting)
+
+    def _source(self, gid, ids, selected):
+        """iterator over the ids of a grid to run; selected is the set of these ids (None if all)"""
+        if self.registry.grids[gid].adaptive is None:
+            return iter(ids)
+
+        return self._adaptive_source(gid, ids, selected)
+
+    def _adaptive_source(self, gid, ids, selected):
+        """ids of a grid with an adaptive parameter: the blocks of the next round are only known once
+           all blocks of the previous rounds are complete, and WAITING is pulled until then"""
+        registry = self.registry
+        values = registry.grids[gid].adaptive
+        start = registry.grid_start[gid]
+
+        for id in ids:
+            while id - start >= values.available():
+                for row in range(values.available()):
+                    if row in values.results:
+                        continue
+
+                    ### blocks that are not run are loaded from their targets, if they exist
+                    if (selected is None or start + row in selected) and not registry.is_complete(start + row):
+                        continue
+                    try:
+                        output = registry.target(start + row).load()
+                    except Exception:
+                        output = None
+                    values.add_result(row, output)
+
+                if not values.refine():
+                    yield WAITING
+
+            yield id
+
+    def _pull(self, source):
+        """the next id of a source that can run now, WAITING if its next id is not known yet,
+           or None if the source is exhausted"""
+        registry = self.registry
+        for id in source:
+            if id == WAITING:
+                return WAITING
+            elif self.skip is not None and self.skip(id):
+                registry.set_status(id, COMPLETE)
+            elif id in registry.block_dependencies and not registry.ready(id):
+                self.waiting.append(id)
+            elif registry.dependency_failed(id):
+                self._skip_failed(id)
+            else:
+                return id
+
+        return None
+
+    def _skip_failed(self, id):
+        """skip a block whose dependency failed; it counts as failed for its own dependents"""
+        self.registry.fail([id])
+        self.skipped.append(id)
+
+    def next(self):
+        """return the id of the next block that is ready to run, or None if no block is ready now"""
+        registry = self.registry
+        for id in [id for id in self.waiting if registry.ready(id) and registry.dependency_failed(id)]:
+            self.waiting.remove(id)
+            self._skip_failed(id)
+
+        for i, id in enumerate(self.waiting):
+            if registry.ready(id):
+                return self.waiting.pop(i)
+
+        while True:
+            exhausted = None
+            for gid, source in self.sources.items():
+                if not registry.function_ready(registry.grid_function[gid]):
+                    continue
+
+                id = self._pull(source)
+                if id == WAITING:
+                    continue
+                if id is not None:
+                    return id
+
+                exhausted = gid
+                break
+
+            if exhausted is None:
+                return None
+            del self.sources[exhausted]
+
+    def next_batch(self):
+        """return a list of ids of the same grid that are ready to run, or an empty list if no block is ready now"""
+        id = self.next()
+        if id is None:
+            return []
+
+        registry = self.registry
+        fid = registry.block_function(id)
+        size = 1 if self.batch_size is None else self.batch_size(fid)
+
+        ### continue with the following grids of the same function
+        batch = [id]
+        exhausted = []
+        for gid, source in self.sources.items():
+            if len(batch) == size:
+                break
+            if registry.grid_function[gid] != fid:
+                continue
+
+            while len(batch) < size:
+                id = self._pull(source)
+                if id is None:
+                    exhausted.append(gid)
+                if id is None or id == WAITING:
+                    break
+                batch.append(id)
+
+        for gid in exhausted:
+            del self.sources[gid]
+
+        return batch
@@ -1,93 +1,299 @@
+"""
+TCP work queue: a coordinator (`python sim.py serve`) hands out blocks to workers
+(`python sim.py worker --connect host:port`) that can run on any node with access to the targets
+
+Connections are authenticated with a key shared by the coordinator and its workers, and every message carries an HMAC
+that is verified before the message is unpickled (see numpipe.networking.channel). Unpickling a message runs code, so
+the key must be kept secret; the coordinator only listens on the loopback interface unless another host is given
+
+Messages are pickled and length-prefixed:
+    worker -> coordinator     ('ready',)                       the worker can take a block
+                              ('heartbeat',)                   the worker is alive (sent while a block runs)
+                              ('result', key, success, value)  runtime of the block, or the exception it raised
+    coordinator -> worker     ('task', key, func, args)        run func(*args)
+                              ('stop',)                        exit
+    client -> coordinator     ('status',)                      reply with a dictionary of counts (see bin/status.py)
+"""
+
 import socket
 import pickle
-import sys
+import logging
+import selectors
 import threading
-from time import sleep
-from networking import recv_msg, send_msg
- 
-HOST = 'localhost'
-PORT = 6000
- 
-s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-print('Socket created')
-
-# set socket to close properly
-s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-
-s.bind((HOST, PORT))
-print('Socket bind complete')
- 
-s.listen(10)
-print('Socket now listening')
-
-
-def client_thread(conn, idx):
-    print('thread created')
-    progress = {}
-    all_progress[idx] = progress
-
-    while conn:
-        data = conn.recv(1024)
-        if not data:
+from time import sleep, time
+
+import numpipe
+from numpipe.networking import channel, server_handshake, authentication_error
+
+HEARTBEAT_INTERVAL = 5      # seconds between heartbeats of a busy worker
+HEARTBEAT_TIMEOUT = 60      # seconds without a message after which a busy worker is considered dead
+
+def parse_address(address, default_port=6000):
+    """parse 'host:port' (or 'host') into (host, port)"""
+    host, _, port = address.rpartition(':')
+    if not host:
+        return port, default_port
+
+    return host, int(port)
+
+class tcp_executor:
+    def __init__(self, host='127.0.0.1', port=6000, timeout=HEARTBEAT_TIMEOUT, authkey=None):
+        """
+        Coordinator that hands out blocks to workers connected over TCP (see tcp_worker)
+
+        Blocks of workers that disconnect, or that stop sending heartbeats, are re-queued
+
+        Arguments:
+            host       address to listen on (default: loopback only; '' for all interfaces)
+            port       port to listen on
+            timeout    time (in seconds) without a message from a busy worker before its block is re-queued
+            authkey    key (bytes) that workers must have to connect (see numpipe.networking.load_authkey)
+        """
+        if not authkey:
+            raise ValueError('the coordinator needs a key to authenticate its workers')
+
+        self.timeout = timeout
+        self.authkey = authkey
+        self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.listener.bind((host, port))
+        self.listener.listen(128)
+        self.listener.setblocking(False)
+        self.address = self.listener.getsockname()
+
+        self.selector = selectors.DefaultSelector()
+        self.selector.register(self.listener, selectors.EVENT_READ)
+
+        self.pending = []           # tasks (key, func, args) not yet sent
+        self.idle = []              # connections of workers that are ready for a task
+        self.running = dict()       # {connection: (task, time of the last message)}
+        self.dispatched = []        # keys of the tasks sent since the last call of started
+        self.num_completed = 0
+        self.num_failed = 0
+        self.num_requeued = 0
+        self.handoff = None
+
+    @property
+    def num_workers(self):
+        return len(self.idle) + len(self.running)
+
+    @property
+    def capacity(self):
+        return 2*self.num_workers or 1
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def submit(self, key, func, args):
+        self.pending.append((key, func, args))
+        self._send()
+
+    def _send(self):
+        while self.idle and self.pending:
+            conn = self.idle.pop()
+            task = self.pending.pop(0)
+            try:
+                conn.send(pickle.dumps(('task',) + task))
+            except OSError:
+                self.pending.insert(0, task)
+                self._drop(conn)
+                continue
+            self.running[conn] = (task, time())
+            self.dispatched.append(task[0])
+
+    def started(self):
+        """return the keys of the blocks that a worker started since the last call (a block that is re-queued
+           is started again)"""
+        keys, self.dispatched = self.dispatched, []
+        return keys
+
+    def cancel(self, key):
+        """cancel a pending block; return False if the block already runs (it finishes, and its result is returned)"""
+        num_pending = len(self.pending)
+        self.pending = [task for task in self.pending if task[0] != key]
+        return len(self.pending) < num_pending
+
+    def _drop(self, conn):
+        """close the connection of a worker and re-queue its block"""
+        if conn in self.running:
+            task, _ = self.running.pop(conn)
+            self.pending.insert(0, task)
+            self.num_requeued += 1
+        if conn in self.idle:
+            self.idle.remove(conn)
+
+        self.selector.unregister(conn)
+        conn.close()
+
+    def _status(self):
+        return dict(workers=len(self.idle) + len(self.running), pending=len(self.pending), running=len(self.running),
+                    completed=self.num_completed, failed=self.num_failed, requeued=self.num_requeued)
+
+    def _receive(self, conn, results):
+        """handle a message from a connection"""
+        try:
+            message = conn.recv()
+        except (OSError, authentication_error) as err:
+            if isinstance(err, authentication_error):
+                logging.warning(f'dropped a connection to the coordinator: {err}')
+            message = None
+
+        if message is None:
+            self._drop(conn)
+            return
+
+        message = pickle.loads(message)
+        if message[0] == 'ready':
+            self.idle.append(conn)
+        elif message[0] == 'heartbeat':
+            if conn in self.running:
+                self.running[conn] = (self.running[conn][0], time())
+        elif message[0] == 'result':
+            _, key, success, value = message
+            if conn in self.running:
+                del self.running[conn]
+                results.append((key, success, value))
+                if success:
+                    self.num_completed += 1
+                else:
+                    self.num_failed += 1
+            self.idle.append(conn)
+        elif message[0] == 'status':
+            conn.send(pickle.dumps(self._status()))
+
+    def _authenticate(self, handshake, address):
+        """continue the handshake of a new connection"""
+        try:
+            conn = handshake.receive()
+        except authentication_error as err:
+            self._refuse(handshake, address, err)
+            return
+
+        if conn is not None:
+            self.selector.unregister(handshake)
+            self.selector.register(conn, selectors.EVENT_READ)
+
+    def _refuse(self, handshake, address, reason):
+        logging.warning(f'refused a connection from {address[0]}: {reason}')
+        self.selector.unregister(handshake)
+        handshake.close()
+
+    def wait(self, timeout):
+        """wait up to timeout seconds for results, and return all available results"""
+        deadline = time() + timeout
+        results = []
+        while True:
+            for key, _ in self.selector.select(timeout=max(0, deadline - time())):
+                if key.fileobj is self.listener:
+                    try:
+                        sock, address = self.listener.accept()
+                    except BlockingIOError:
+                        continue
+                    ### the handshake continues in this loop, so that slow clients do not hold up the workers
+                    try:
+                        handshake = server_handshake(sock, self.authkey)
+                    except OSError:
+                        sock.close()
+                        continue
+                    self.selector.register(handshake, selectors.EVENT_READ, data=address)
+                elif isinstance(key.fileobj, server_handshake):
+                    self._authenticate(key.fileobj, key.data)
+                else:
+                    self._receive(key.fileobj, results)
+
+            ### connections that do not authenticate in time are refused
+            for key in list(self.selector.get_map().values()):
+                if isinstance(key.fileobj, server_handshake) and key.fileobj.expired():
+                    self._refuse(key.fileobj, key.data, 'the handshake timed out')
+
+            ### workers that went silent are considered dead
+            for conn, (task, last_message) in list(self.running.items()):
+                if time() - last_message > self.timeout:
+                    self._drop(conn)
+
+            self._send()
+            if results or time() >= deadline:
+                return results
+
+    def close(self):
+        pass
+
+    def shutdown(self):
+        """stop all workers and stop listening"""
+        for key in list(self.selector.get_map().values()):
+            conn = key.fileobj
+            if isinstance(conn, server_handshake):
+                conn.close()
+            elif conn is not self.listener:
+                try:
+                    conn.send(pickle.dumps(('stop',)))
+                except OSError:
+                    pass
+                conn.close()
+
+        self.selector.close()
+        self.listener.close()
+
+def tcp_worker(host, port, authkey, connect_timeout=60):
+    """
+    Run blocks handed out by a coordinator (see tcp_executor) until it stops
+
+    Arguments:
+        host               address of the coordinator
+        port               port of the coordinator
+        authkey            key (bytes) shared with the coordinator (see numpipe.networking.load_authkey)
+        connect_timeout    time (in seconds) to keep trying to connect, e.g. while the coordinator starts
+    """
+    t_start = time()
+    while True:
+        try:
+            sock = socket.create_connection((host, port))
             break
+        except OSError:
+            if time() - t_start > connect_timeout:
+                raise
+            sleep(1)
 
-        data = pickle.loads(data)
-        progress.update(data)
-        print(all_progress)
-        send_msg(conn, b'good')
-        sleep(.1)
+    conn = channel.connect(sock, authkey)
+    def send(message):
+        conn.send(pickle.dumps(message))
 
-    print('closing connection')
-    conn.close()
+    running = threading.Event()
+    def heartbeat():
+        while True:
+            sleep(HEARTBEAT_INTERVAL)
+            if running.is_set():
+                try:
+                    send(('heartbeat',))
+                except OSError:
+                    return
 
+    threading.Thread(target=heartbeat, daemon=True).start()
 
-children = {}
-progress = {}
+    send(('ready',))
+    while True:
+        message = conn.recv()
+        if message is None:
+            break
 
-def get_progress_thread(conn, idx):
-    print('thread created')
-    send_msg(conn, b'ready')
+        message = pickle.loads(message)
+        if message[0] == 'stop':
+            break
 
-    while conn:
-        recv_msg(conn)
-        print('sending data')
-        update_progress()
-        send_msg(conn, pickle.dumps(progress))
+        _, key, func, args = message
 
-    print('closing connection')
-    conn.close()
+        ### a worker shows one progress bar at a time
+        numpipe._pbars.reset()
+        running.set()
+        try:
+            result = ('result', key, True, func(*args))
+        except Exception as err:
+            result = ('result', key, False, err)
+        running.clear()
 
+        send(result)
 
-def update_progress():
-    print('updating progress...')
-    for idx,conn in children.items():
-        if conn:
-            send_msg(conn, b'ready')
-            data = pickle.loads(recv_msg(conn))
-            print(data)
-            progress[idx].update(data)
-    print('progress updated!')
-
-
-while True:
-    conn, addr = s.accept()
-    print('Connected with ', addr)
-    request = pickle.loads(recv_msg(conn))
-    print(request)
-
-    if request[0] == 'new':
-        idx = request[1]
-        children[idx] = conn
-        progress[idx] = {}
-        
-        print('new child created')
-        # t = threading.Thread(target=client_thread, args=(conn, idx))
-        # t.start()
-
-    elif request[0] == 'get':
-        idx = request[1]
-        t = threading.Thread(target=get_progress_thread, args=(conn, idx))
-        t.start()
-
-     
-s.close()
+    conn.close()
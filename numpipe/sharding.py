@@ -0,0 +1,46 @@
+"""
+Deterministic partition of blocks into shards, for running a sweep across independent invocations
+(e.g. the elements of a Slurm job array) with `--shard i/n`
+"""
+
+import heapq
+import numpy as np
+
+def parse_shard(spec):
+    """parse a shard specification 'i/n' into (i, n), where 0 <= i < n"""
+    try:
+        index, num_shards = (int(x) for x in spec.split('/'))
+    except ValueError:
+        raise ValueError(f"Invalid shard '{spec}': must be formatted as {{index}}/{{number of shards}}, e.g. 3/64")
+
+    if num_shards < 1 or not 0 <= index < num_shards:
+        raise ValueError(f"Invalid shard '{spec}': the index must be between 0 and {num_shards-1}")
+
+    return index, num_shards
+
+def partition(num_items, num_shards, weights=None):
+    """
+    Assign items to shards, balancing the total weight of every shard
+
+    Without weights, items are dealt round-robin. With weights, the heaviest remaining item is
+    assigned to the lightest shard (ties are broken by item order), so the result only depends on the weights
+
+    Arguments:
+        num_items     number of items
+        num_shards    number of shards
+        weights       weight (e.g. estimated runtime) of every item (default: equal weights)
+
+    Returns the shard index of every item, as an array
+    """
+    if weights is None:
+        return np.arange(num_items) % num_shards
+
+    order = np.argsort(-np.asarray(weights, dtype=float), kind='stable')
+    shards = np.empty(num_items, dtype=np.int64)
+    loads = [(0.0, shard) for shard in range(num_shards)]
+    for item in order.tolist():
+        load, shard = heapq.heappop(loads)
+        shards[item] = shard
+        heapq.heappush(loads, (load + weights[item], shard))
+
+    return shards
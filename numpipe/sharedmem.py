@@ -0,0 +1,117 @@
+"""
+Large read-only array arguments placed once in shared memory, and sent to local worker processes by reference
+
+An array is shared if it is marked with numpipe.shared, or if it is larger than execution.shared_memory_threshold
+(in bytes) in the config. Workers receive read-only views of the shared memory, without a copy
+"""
+
+import io
+import pickle
+import weakref
+from multiprocessing import shared_memory
+import numpy as np
+
+_marked = weakref.WeakValueDictionary()     # {id: array} of the arrays marked with shared
+_views = weakref.WeakValueDictionary()      # {id of an array: its marked view}
+_attached = dict()                          # {segment name: (segment, array)} attached in this process
+
+def shared(array):
+    """
+    Mark a numpy array argument of job.add as a large read-only input, placed once in shared memory and
+    not copied to every worker process
+
+    Returns a read-only view of the array (the same view for every call with the same array), to be passed to job.add
+    """
+    if is_marked(array):
+        return array
+
+    view = _views.get(id(array))
+    if view is not None and view.base is array:
+        return view
+
+    view = np.asarray(array).view()
+    view.flags.writeable = False
+    _marked[id(view)] = view
+    _views[id(array)] = view
+    return view
+
+def is_marked(array):
+    """return true if an array was marked with shared"""
+    return _marked.get(id(array)) is array
+
+def attach(name, shape, dtype):
+    """a read-only view of an array in a shared memory segment; a segment is attached once per process"""
+    if name not in _attached:
+        segment = shared_memory.SharedMemory(name=name)
+        array = np.ndarray(shape, dtype=dtype, buffer=segment.buf)
+        array.flags.writeable = False
+        _attached[name] = (segment, array)
+
+    return _attached[name][1]
+
+class _pickler(pickle.Pickler):
+    """pickler that replaces shared arrays by references to their segment"""
+    def __init__(self, file, segments):
+        super().__init__(file, protocol=pickle.HIGHEST_PROTOCOL)
+        self.segments = segments
+
+    def reducer_override(self, obj):
+        entry = self.segments.get(id(obj))
+        if entry is None or entry[0] is not obj:
+            return NotImplemented
+
+        array, segment = entry
+        return attach, (segment.name, array.shape, array.dtype)
+
+class shared_arrays:
+    def __init__(self, arrays):
+        """
+        Copy arrays into shared memory segments, owned by this process until close is called; arrays that are views
+        of the same memory share a segment
+
+        Worker processes must be started after the segments are created, so that they share the resource tracker
+        of this process (which removes the segments if this process is killed)
+
+        Arguments:
+            arrays     list of numpy arrays
+        """
+        self.segments = dict()      # {id(array): (array, segment)}
+        by_memory = dict()          # {(address, shape, strides, dtype): segment}
+        for array in arrays:
+            if id(array) in self.segments or array.dtype.hasobject or array.nbytes == 0:
+                continue
+
+            memory = (array.__array_interface__['data'][0], array.shape, array.strides, array.dtype.str)
+            if memory not in by_memory:
+                segment = shared_memory.SharedMemory(create=True, size=array.nbytes)
+                np.ndarray(array.shape, dtype=array.dtype, buffer=segment.buf)[...] = array
+                by_memory[memory] = segment
+            self.segments[id(array)] = (array, by_memory[memory])
+
+    def __len__(self):
+        return len(self._unique())
+
+    @property
+    def nbytes(self):
+        return sum(segment.size for segment in self._unique())
+
+    def _unique(self):
+        """the distinct segments"""
+        return list({segment.name: segment for _, segment in self.segments.values()}.values())
+
+    def dumps(self, obj):
+        """pickle an object, with references to the segments in place of the shared arrays"""
+        if not self.segments:
+            return pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL)
+
+        f = io.BytesIO()
+        _pickler(f, self.segments).dump(obj)
+        return f.getvalue()
+
+    def close(self):
+        """release and remove the segments"""
+        for segment in self._unique():
+            segment.close()
+            segment.unlink()
+
+        self.segments = dict()
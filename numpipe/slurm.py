@@ -107,3 +107,152 @@ $parallel "$srun python {py_filename}.py -r {{1}} -p 1 --no-at-end --mininterval
         f.write(output)
 
     return sbatch_filename
+
+def pack(runtimes, capacity):
+    """
+    Pack blocks into bins whose total runtime fits a capacity (worst-fit decreasing): the longest
+    remaining block goes into the bin with the most remaining capacity, or into a new bin if it does not fit
+
+    Arguments:
+        runtimes     estimated runtime of every block
+        capacity     maximum total runtime of a bin (blocks that are longer get a bin of their own)
+
+    Returns a list of bins, where each bin is a list of block indices (in increasing order)
+    """
+    import heapq
+
+    bins = []
+    remaining = []      # heap of (-remaining capacity, bin index)
+    for idx in sorted(range(len(runtimes)), key=lambda i: -runtimes[i]):
+        runtime = runtimes[idx]
+        if remaining and -remaining[0][0] >= runtime:
+            space, b = heapq.heappop(remaining)
+            bins[b].append(idx)
+            heapq.heappush(remaining, (space + runtime, b))
+        else:
+            bins.append([idx])
+            heapq.heappush(remaining, (runtime - capacity, len(bins) - 1))
+
+    return [sorted(b) for b in bins]
+
+def render_job_array(py_filename, name, num_elements, time='36', memory=2, partition='broadwl'):
+    """
+    Return the sbatch script of a job array: element i runs the blocks on line i+1 of the lookup file
+
+    Arguments:
+        py_filename     name of the Python file (without extension)
+        name            name of the job array
+        num_elements    number of array elements
+        time            string representation of the wall time of an element, {hours}:{minutes}:{seconds}
+        memory          memory of an element, in GB
+        partition       name of partition to run on
+    """
+    mem_in_mb = int(memory*1000)
+    time_str = format_time(time)
+    output_dir = f'{py_filename}_output'
+
+    return f"""#!/bin/sh
+
+#SBATCH --job-name={py_filename}-{name}
+#SBATCH --partition={partition}
+#SBATCH --array=0-{num_elements-1}
+#SBATCH --ntasks=1
+#SBATCH --time={time_str}
+#SBATCH --mem-per-cpu={mem_in_mb}
+#SBATCH --output={output_dir}/{name}_%a.txt
+#SBATCH --error={output_dir}/{name}_%a.err
+
+labels=$(sed -n "$((SLURM_ARRAY_TASK_ID+1))p" {py_filename}-{name}-lookup.txt)
+python {py_filename}.py -r $labels -f --no-deps -p 1 --no-at-end --mininterval 60
+"""
+
+def render_at_end(py_filename, time='36', memory=2, partition='broadwl'):
+    """Return the sbatch script of the job that runs the at-end functions (see render_job_array)"""
+    mem_in_mb = int(memory*1000)
+    time_str = format_time(time)
+    output_dir = f'{py_filename}_output'
+
+    return f"""#!/bin/sh
+
+#SBATCH --job-name={py_filename}-at-end
+#SBATCH --partition={partition}
+#SBATCH --ntasks=1
+#SBATCH --time={time_str}
+#SBATCH --mem-per-cpu={mem_in_mb}
+#SBATCH --output={output_dir}/at_end.txt
+#SBATCH --error={output_dir}/at_end.err
+
+python {py_filename}.py --at-end --mininterval 60
+"""
+
+def render_submit(stages, at_end=None):
+    """
+    Return a shell script that submits job arrays in stages: every job of a stage starts after all
+    jobs of the previous stages completed successfully (--dependency=afterok), followed by the at-end job
+
+    Arguments:
+        stages      list of stages, where each stage is a list of sbatch filenames
+        at_end      sbatch filename of the at-end job (default: no at-end job)
+    """
+    lines = ['#!/bin/sh', '', 'set -e']
+    previous = []
+    num_jobs = 0
+    for stage in stages:
+        current = []
+        for sbatch_filename in stage:
+            dependency = f' --dependency=afterok:{":".join(previous)}' if previous else ''
+            lines.append(f'job{num_jobs}=$(sbatch --parsable{dependency} {sbatch_filename})')
+            current.append(f'$job{num_jobs}')
+            num_jobs += 1
+        previous.extend(current)
+
+    if at_end is not None:
+        dependency = f' --dependency=afterok:{":".join(previous)}' if previous else ''
+        lines.append(f'sbatch --parsable{dependency} {at_end}')
+
+    return '\n'.join(lines) + '\n'
+
+def create_job_arrays(py_filename, stages, time='36', partition='broadwl', at_end=False, at_end_memory=2):
+    """
+    Write the lookup and sbatch files of a set of job arrays, and the script that submits them
+
+    Arguments:
+        py_filename      name of the Python file (without extension)
+        stages           list of stages that run one after the other; each stage is a list of
+                         (memory in GB, list of elements), where each element is a list of block labels
+        time             string representation of the wall time of an element, {hours}:{minutes}:{seconds}
+        partition        name of partition to run on
+        at_end           if True, submit a job that runs the at-end functions after all job arrays
+        at_end_memory    memory of the at-end job, in GB
+
+    Returns the filename of the submit script
+    """
+    os.makedirs(f'{py_filename}_output', exist_ok=True)
+
+    sbatch_stages = []
+    for i, stage in enumerate(stages):
+        sbatch_stage = []
+        for j, (memory, elements) in enumerate(stage):
+            name = f'array{i}' if len(stage) == 1 else f'array{i}-{j}'
+            with open(f'{py_filename}-{name}-lookup.txt', 'w') as f:
+                for labels in elements:
+                    f.write(' '.join(labels) + '\n')
+
+            sbatch_filename = f'{py_filename}-{name}.sbatch'
+            with open(sbatch_filename, 'w') as f:
+                f.write(render_job_array(py_filename, name, len(elements), time=time, memory=memory, partition=partition))
+            sbatch_stage.append(sbatch_filename)
+
+        sbatch_stages.append(sbatch_stage)
+
+    at_end_filename = None
+    if at_end:
+        at_end_filename = f'{py_filename}-at-end.sbatch'
+        with open(at_end_filename, 'w') as f:
+            f.write(render_at_end(py_filename, time=time, memory=at_end_memory, partition=partition))
+
+    submit_filename = f'{py_filename}-submit.sh'
+    with open(submit_filename, 'w') as f:
+        f.write(render_submit(sbatch_stages, at_end_filename))
+
+    return submit_filename
@@ -0,0 +1,933 @@
+"""
+Storage backends for targets:
+    * h5_target       one HDF5 file per target (default)
+    * group_target    one group per target inside a container HDF5 file shared by all instances of a function
+    * npy_target      one directory of .npy files per target (no file locking, cheap partial reads)
+    * memory_target   in-memory storage of the current process (for tests and fast iteration)
+"""
+
+import os
+import copy
+import shutil
+import time
+import zlib
+from contextlib import contextmanager
+import numpy as np
+
+from numpipe.fileio import load_symbols, write_symbols, stream_symbols, record_selection, split_symbols, read_new_records
+from numpipe.h5cache import h5cache, npcache
+from numpipe.utility import Bunch, prefetch_iter, lazy_import
+from numpipe import config, streaming
+
+h5py = lazy_import('h5py')
+
+LIVE_ATTEMPTS = 5       # attempts to read a file that is being written, e.g. while the writer creates datasets
+
+class live_output(Bunch):
+    """symbols of a target that may still be written (see target.live); refresh reloads them"""
+    def __init__(self, load):
+        super().__init__(dict())
+        self._load = load
+        self.refresh()
+
+    def refresh(self):
+        """reload the symbols, and return self"""
+        self.__dict__.update(self._load().__dict__)
+        return self
+
+class target:
+    """
+    A target is the output of a cached function and determines whether it needs to be rerun
+    It specifies the type of storage file
+
+    Subclasses implement the storage backend interface below
+    """
+    extension = ''       # extension appended to the target path
+    shared = True        # True if data written by a worker process is visible to other processes
+    persistent = True    # True if the target outlives the process
+    linkable = False     # True if the target can be linked to another target (see link)
+
+    def __init__(self, filepath):
+        self.filepath = filepath
+        self.writepath = filepath
+
+    def __str__(self):
+        return self.filepath
+
+    def files(self):
+        """Return the paths on disk that belong to the target"""
+        return [self.filepath]
+
+    def size(self):
+        """Return the size of the target in bytes (None if unknown)"""
+        return None
+
+    def temporary_path(self):
+        """Return the path that the target is written to before it is committed"""
+        dirpath, basename = os.path.split(self.filepath)
+        return os.path.join(dirpath, f'.{basename}.tmp')
+
+    def speculative(self):
+        """Return a copy of the target written to a separate path, for a second execution of the same block"""
+        other = copy.copy(self)
+        dirpath, basename = os.path.split(self.filepath)
+        other.filepath = other.writepath = os.path.join(dirpath, f'.{basename}.speculative')
+        return other
+
+    def adopt(self, other):
+        """Replace the target with the committed output of a speculative copy (see speculative)"""
+        os.replace(other.filepath, self.filepath)
+
+    def discard(self, temporary_only=False):
+        """Remove the output written for the target by a worker that was stopped, and the committed output unless temporary_only"""
+        paths = [self.temporary_path()] if temporary_only else [self.filepath, self.temporary_path()]
+        for path in paths:
+            if os.path.isdir(path) and not os.path.islink(path):
+                shutil.rmtree(path)
+            elif os.path.lexists(path):
+                os.remove(path)
+
+    def prepare(self):
+        """Called in the worker process before the cached function is executed"""
+        pass
+
+    def commit(self):
+        """Called in the worker process after the cached function has written all of its output"""
+        pass
+
+    def finalize(self):
+        """Called in the parent process after the cached function has finished successfully"""
+        pass
+
+    @classmethod
+    def finalize_all(cls, targets):
+        """Finalize a list of targets of this class (e.g. the targets of a vectorized batch)"""
+        for target in targets:
+            target.finalize()
+
+    @classmethod
+    def remove_all(cls, targets):
+        """Remove a list of targets of this class"""
+        for target in targets:
+            target.remove()
+
+    def load(self, symbols=None, records=None, stride=None):
+        """Load symbols (see fileio.load_symbols)"""
+        raise NotImplementedError
+
+    def stream(self, symbols=None, chunk=None):
+        """Stream blocks of records (see fileio.stream_symbols)"""
+        raise NotImplementedError
+
+    def live(self, symbols=None, records=None, stride=None):
+        """Load symbols while the target may still be written, as a live_output that is reloaded with refresh
+           (default: the committed output)"""
+        return live_output(lambda: self.load(symbols=symbols, records=records, stride=stride))
+
+    def flushed(self, positions, names=None):
+        """Return {name: records} of the records past positions ({name: number of records}) that a running block has
+           flushed so far, or that the committed output holds (see numpipe.streaming)"""
+        raise NotImplementedError
+
+    def write(self, symbols):
+        """Write symbols"""
+        raise NotImplementedError
+
+    def write_args(self, symbols):
+        """Write instance argument symbols to args group"""
+        raise NotImplementedError
+
+    def cache(self, cache_time=300):
+        """Return a buffered cache (with add and flush methods) for records yielded by a generator"""
+        raise NotImplementedError
+
+    def exists(self):
+        """Return true if the target exists"""
+        raise NotImplementedError
+
+    def remove(self):
+        """Remove the target"""
+        raise NotImplementedError
+
+    def link(self, source):
+        """Make the target an alias of a complete source target with identical content, without copying it"""
+        raise NotImplementedError
+
+class h5_target(target):
+    """
+    target stored in a single HDF5 file
+
+    The file is written to a temporary path and atomically renamed when committed; a completion
+    marker attribute distinguishes committed files from files left behind by a killed worker
+
+    Files written by earlier versions, which wrote the target in place, have no marker; they are
+    complete unless a temporary file of the target exists (rerun a target to add the marker)
+    """
+    extension = '.h5'
+    marker = 'numpipe_complete'
+    linkable = True
+
+    def _swmr(self):
+        """records are written in SWMR mode if they are read while they are written: for live loads (hdf5.swmr in
+           the config), and by streaming dependents"""
+        return config.get_config()['hdf5']['swmr'] or streaming.is_spooled(self)
+
+    def prepare(self):
+        self.writepath = self.temporary_path()
+        if os.path.isfile(self.writepath):
+            os.remove(self.writepath)
+
+        ### SWMR mode needs the latest file format (see h5cache)
+        if self._swmr():
+            h5py.File(self.writepath, 'w', libver='latest').close()
+
+    def commit(self):
+        with h5py.File(self.writepath, 'a') as f:
+            f.attrs[self.marker] = True
+
+        os.replace(self.writepath, self.filepath)
+        self.writepath = self.filepath
+
+    def load(self, symbols=None, records=None, stride=None):
+        return load_symbols(self.filepath, symbols=symbols, records=records, stride=stride)
+
+    def stream(self, symbols=None, chunk=None):
+        return stream_symbols(self.filepath, symbols=symbols, chunk=chunk)
+
+    def live(self, symbols=None, records=None, stride=None):
+        """the records flushed so far by a running block (read in SWMR mode, if hdf5.swmr is enabled in the config),
+           or the committed output"""
+        def load():
+            path = self.temporary_path()
+            for attempt in range(LIVE_ATTEMPTS):
+                if not self._swmr() or not os.path.isfile(path):
+                    break
+                try:
+                    return load_symbols(path, symbols=symbols, records=records, stride=stride, swmr=True)
+                except OSError:
+                    if attempt == LIVE_ATTEMPTS - 1 and os.path.isfile(path):
+                        raise
+                    time.sleep(.1)
+
+            return self.load(symbols=symbols, records=records, stride=stride)
+
+        return live_output(load)
+
+    def flushed(self, positions, names=None):
+        for path, swmr in ((self.temporary_path(), True), (self.filepath, False)):
+            if os.path.isfile(path):
+                try:
+                    return read_new_records(path, positions, names, swmr=swmr)
+                except OSError:
+                    ### the file is being created, or was just committed: read it at the next call
+                    return dict()
+
+        return dict()
+
+    def write(self, symbols):
+        write_symbols(self.writepath, symbols)
+
+    def write_args(self, symbols):
+        with h5py.File(self.writepath, 'a') as f:
+            g = f.require_group('args')
+            for name,symbol in symbols.items():
+                try:
+                    g[name] = symbol
+                except TypeError:
+                    continue
+
+    def cache(self, cache_time=300):
+        return h5cache(self.writepath, cache_time=cache_time, swmr=self._swmr())
+
+    def exists(self):
+        if not os.path.isfile(self.filepath):
+            return False
+
+        try:
+            with h5py.File(self.filepath, 'r') as f:
+                if f.attrs.get(self.marker, False):
+                    return True
+        except OSError:
+            return False
+
+        return not os.path.exists(self.temporary_path())
+
+    def size(self):
+        return os.path.getsize(self.filepath)
+
+    def link(self, source):
+        if os.path.lexists(self.filepath):
+            os.remove(self.filepath)
+
+        try:
+            os.link(source.filepath, self.filepath)
+        except OSError:
+            ### no hard links on this filesystem: external links to the symbols of the source
+            writepath = self.temporary_path()
+            with h5py.File(source.filepath, 'r') as src, h5py.File(writepath, 'w') as f:
+                for name in src:
+                    f[name] = h5py.ExternalLink(os.path.basename(source.filepath), name)
+                f.attrs[self.marker] = True
+            os.replace(writepath, self.filepath)
+
+    def remove(self):
+        os.remove(self.filepath)
+
+@contextmanager
+def locked(filepath, blocking=True, remove=False):
+    """
+    Hold an exclusive lock on filepath (through a separate .lock file, see lock_path) across processes
+
+    Arguments:
+        filepath     path to lock
+        blocking     if False, raise BlockingIOError instead of waiting for another process that holds the lock
+        remove       if True, remove the lock file before the lock is released (kept on Windows, where open files
+                     cannot be removed)
+    """
+    path = lock_path(filepath)
+    if os.name == 'nt':
+        import msvcrt
+        with open(path, 'a') as lock:
+            lock.seek(0)
+            while True:
+                try:
+                    msvcrt.locking(lock.fileno(), msvcrt.LK_LOCK if blocking else msvcrt.LK_NBLCK, 1)
+                    break
+                except OSError:
+                    if not blocking:
+                        raise BlockingIOError(f"'{path}' is locked by another process")
+                    ### LK_LOCK gives up after 10 seconds
+                    continue
+            try:
+                yield
+            finally:
+                lock.seek(0)
+                msvcrt.locking(lock.fileno(), msvcrt.LK_UNLCK, 1)
+    else:
+        import fcntl
+        while True:
+            lock = open(path, 'a')
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except:
+                lock.close()
+                raise
+
+            ### the lock file may have been removed by its previous holder while this process waited for it
+            try:
+                current = os.path.samestat(os.fstat(lock.fileno()), os.stat(path))
+            except FileNotFoundError:
+                current = False
+            if current:
+                break
+            lock.close()
+
+        try:
+            yield
+            if remove:
+                os.remove(path)
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+            lock.close()
+
+def remove_lock(filepath):
+    """Remove the lock file of filepath unless another process holds the lock; return true if it was removed"""
+    try:
+        with locked(filepath, blocking=False, remove=True):
+            pass
+    except BlockingIOError:
+        return False
+
+    return not os.path.exists(lock_path(filepath))
+
+def lock_path(filepath):
+    """Return the path of the lock file of filepath; it is only removed by a process that holds the lock
+       (see locked and remove_lock)"""
+    return f'{filepath}.lock'
+
+_container_index = dict()
+
+def read_container_index(f):
+    """Return the set of committed group names stored in an open container file"""
+    if '_index' not in f:
+        return set()
+
+    return set(name.decode() for name in f['_index'][...])
+
+def container_index(container):
+    """Return the set of committed group names in a container file (read once per process, and re-read
+       by writers while they hold the lock of the container)"""
+    if container not in _container_index:
+        index = set()
+        if os.path.isfile(container):
+            with h5py.File(container, 'r') as f:
+                index = read_container_index(f)
+
+        _container_index[container] = index
+
+    return _container_index[container]
+
+def write_container_index(f, index):
+    """Overwrite the index dataset of an open container file"""
+    if '_index' in f:
+        del f['_index']
+    f.create_dataset('_index', data=sorted(index), dtype=h5py.string_dtype(), maxshape=(None,), chunks=(1024,))
+
+def append_container_index(f, names):
+    """Append a list of group names to the index dataset of an open container file"""
+    if '_index' not in f:
+        write_container_index(f, set())
+
+    dset = f['_index']
+    size = dset.shape[0]
+    dset.resize((size + len(names),))
+    dset[size:] = names
+
+def repack_container(container):
+    """Rewrite a container file with only its committed groups, to reclaim the space of removed and overwritten
+       groups (HDF5 does not reuse it), and remove its lock file
+
+    Returns the number of bytes reclaimed, or None if another process holds the lock of the container
+    """
+    dirpath, basename = os.path.split(container)
+    writepath = os.path.join(dirpath, f'.{basename}.tmp')
+    try:
+        with locked(container, blocking=False, remove=True):
+            reclaimed = _repack(container, writepath)
+    except BlockingIOError:
+        return None
+
+    _container_index.pop(container, None)
+    return reclaimed
+
+def _repack(container, writepath):
+    """copy the committed groups of a container to writepath, and replace the container if it is smaller"""
+    with h5py.File(container, 'r') as src, h5py.File(writepath, 'w') as dst:
+        index = read_container_index(src)
+        copied = dict()     # {object id: group name} to keep groups linked to each other (see group_target.link)
+        for name in sorted(index):
+            link = src.get(name, getlink=True)
+            if link is None:
+                continue
+            if isinstance(link, h5py.ExternalLink):
+                dst[name] = h5py.ExternalLink(link.filename, link.path)
+            elif src[name].id in copied:
+                dst[name] = dst[copied[src[name].id]]
+            else:
+                src.copy(src[name], dst, name=name)
+                copied[src[name].id] = name
+        write_container_index(dst, index)
+
+    reclaimed = os.path.getsize(container) - os.path.getsize(writepath)
+    if reclaimed > 0:
+        os.replace(writepath, container)
+    else:
+        os.remove(writepath)
+
+    return max(reclaimed, 0)
+
+def shard_filepath(filepath, group, shards=1):
+    """Return the container filepath for a group, sharded by a stable hash of the group name
+
+    Arguments:
+        filepath     container filepath (without extension)
+        group        name of the group
+        shards       number of container files (default: 1)
+    """
+    if shards <= 1:
+        return f'{filepath}.h5'
+
+    shard = zlib.crc32(group.encode()) % shards
+    return f'{filepath}-shard{shard}.h5'
+
+class group_target(h5_target):
+    """
+    target stored as a group inside a container HDF5 file that is shared by many targets
+
+    The worker writes to its own staging file (filepath); the parent process then copies it into
+    the container and records the group in the container's index, so the container only ever
+    has one writer. Existence is determined from the index instead of a filesystem stat
+    """
+    def __init__(self, filepath, container, group):
+        super().__init__(filepath)
+        self.container = container
+        self.group = group
+
+    def __str__(self):
+        return f'{self.container}:{self.group}'
+
+    def files(self):
+        return [self.container, self.filepath]
+
+    def size(self):
+        return None
+
+    def prepare(self):
+        super().prepare()
+        if os.path.isfile(self.filepath):
+            os.remove(self.filepath)
+
+    def finalize(self):
+        self.finalize_all([self])
+
+    @classmethod
+    def finalize_all(cls, targets):
+        """copy the staging files into their containers, opening every container only once"""
+        containers = dict()
+        for target in targets:
+            containers.setdefault(target.container, []).append(target)
+
+        for container, group_targets in containers.items():
+            index = container_index(container)
+            with locked(container):
+                with h5py.File(container, 'a') as dst:
+                    ### other processes (e.g. shards) may have added groups since the index was read
+                    index.update(read_container_index(dst))
+                    for target in group_targets:
+                        with h5py.File(target.filepath, 'r') as src:
+                            if target.group in dst:
+                                del dst[target.group]
+                            g = dst.create_group(target.group)
+                            for name in src:
+                                src.copy(src[name], g, name=name)
+
+                    new_groups = [target.group for target in group_targets if target.group not in index]
+                    if new_groups:
+                        append_container_index(dst, new_groups)
+                    index.update(new_groups)
+
+            for target in group_targets:
+                os.remove(target.filepath)
+
+    def link(self, source):
+        """link the group to the source group: a hard link inside the same container, an external link otherwise"""
+        index = container_index(self.container)
+        with locked(self.container):
+            with h5py.File(self.container, 'a') as f:
+                index.update(read_container_index(f))
+                if self.group in f:
+                    del f[self.group]
+
+                if source.container == self.container:
+                    f[self.group] = f[source.group]
+                else:
+                    f[self.group] = h5py.ExternalLink(os.path.basename(source.container), source.group)
+
+                if self.group not in index:
+                    append_container_index(f, [self.group])
+                index.add(self.group)
+
+    def load(self, symbols=None, records=None, stride=None):
+        return load_symbols(self.container, symbols=symbols, records=records, stride=stride, group=self.group)
+
+    def stream(self, symbols=None, chunk=None):
+        return stream_symbols(self.container, symbols=symbols, chunk=chunk, group=self.group)
+
+    def flushed(self, positions, names=None):
+        ### the staging file is copied into the container once the block has finished
+        if os.path.isfile(self.temporary_path()) or os.path.isfile(self.filepath):
+            return super().flushed(positions, names)
+
+        try:
+            return read_new_records(self.container, positions, names, group=self.group)
+        except (OSError, KeyError):
+            return dict()
+
+    def exists(self):
+        return self.group in container_index(self.container)
+
+    def remove(self):
+        self.remove_all([self])
+
+    @classmethod
+    def remove_all(cls, targets):
+        """remove groups from their containers, rewriting every container index only once"""
+        containers = dict()
+        for target in targets:
+            containers.setdefault(target.container, []).append(target.group)
+
+        for container, groups in containers.items():
+            index = container_index(container)
+            with locked(container):
+                with h5py.File(container, 'a') as f:
+                    for group in groups:
+                        if group in f:
+                            del f[group]
+                    index.update(read_container_index(f))
+                    index.difference_update(groups)
+                    write_container_index(f, index)
+
+class npy_target(target):
+    """
+    target stored in a directory of .npy files:
+        {name}.npy                      symbols written once
+        {name}/{start}-{stop}.npy       records [start, stop) yielded by a generator
+        args/{name}.npy                 instance arguments
+
+    Every target is its own directory, so no locking is needed between concurrent writers
+    and records can be read partially by memory-mapping only the overlapping chunk files.
+    The directory is written to a temporary path and renamed when committed, together with a
+    completion marker file
+    """
+    extension = '.npydir'
+    marker = '.complete'
+    linkable = True
+
+    def _path(self, *names):
+        return os.path.join(self.filepath, *names)
+
+    def _write_path(self, *names):
+        return os.path.join(self.writepath, *names)
+
+    def prepare(self):
+        self.writepath = self.temporary_path()
+        if os.path.isdir(self.writepath):
+            shutil.rmtree(self.writepath)
+        os.makedirs(self.writepath)
+
+    def _remove_path(self):
+        """remove the target directory, or the symbolic link if the target is linked"""
+        if os.path.islink(self.filepath):
+            os.remove(self.filepath)
+        elif os.path.isdir(self.filepath):
+            shutil.rmtree(self.filepath)
+
+    def commit(self):
+        open(self._write_path(self.marker), 'w').close()
+
+        self._remove_path()
+        os.replace(self.writepath, self.filepath)
+        self.writepath = self.filepath
+
+    def _chunks(self, name):
+        """Return a sorted list of (start, stop, filepath) for the record chunks of a symbol"""
+        chunks = []
+        for filename in os.listdir(self._path(name)):
+            if filename.startswith('.'):
+                ### a chunk that is being written (see npy_cache)
+                continue
+            start, stop = os.path.splitext(filename)[0].split('-')
+            chunks.append((int(start), int(stop), self._path(name, filename)))
+
+        return sorted(chunks)
+
+    def _is_record(self, name):
+        return os.path.isdir(self._path(name)) and name != 'args'
+
+    def _symbol_names(self):
+        names = []
+        for filename in sorted(os.listdir(self.filepath)):
+            if filename == 'args':
+                continue
+            if filename.endswith('.npy'):
+                names.append(filename[:-4])
+            elif os.path.isdir(self._path(filename)):
+                names.append(filename)
+
+        return names
+
+    def _read_records(self, name, selection):
+        chunks = self._chunks(name)
+        num_records = chunks[-1][1]
+        indices = np.arange(*selection.indices(num_records))
+
+        pieces = []
+        for start, stop, filepath in chunks:
+            idx = indices[(indices >= start) & (indices < stop)]
+            if len(idx) or not pieces:
+                pieces.append(np.load(filepath, mmap_mode='r')[idx - start])
+
+        return np.concatenate(pieces)
+
+    def _read(self, name, selection):
+        if self._is_record(name):
+            return self._read_records(name, selection)
+
+        filepath = self._path(f'{name}.npy')
+        if not os.path.isfile(filepath):
+            raise KeyError(f"Invalid symbol: '{name}' does not exist in '{self.filepath}'")
+
+        return np.load(filepath)
+
+    def load(self, symbols=None, records=None, stride=None):
+        names, arg_names = split_symbols(symbols)
+        selection = record_selection(records, stride)
+
+        if names is None:
+            names = self._symbol_names()
+
+        bunch = Bunch({name: self._read(name, selection) for name in names})
+
+        args_path = self._path('args')
+        if os.path.isdir(args_path) and (arg_names is None or arg_names):
+            if arg_names is None:
+                arg_names = [os.path.splitext(filename)[0] for filename in os.listdir(args_path)]
+
+            args = {name: np.load(self._path('args', f'{name}.npy')) for name in arg_names}
+            if args:
+                bunch['args'] = Bunch(args)
+
+        return bunch
+
+    def stream(self, symbols=None, chunk=None):
+        names, _ = split_symbols(symbols)
+        if names is None:
+            names = [name for name in self._symbol_names() if self._is_record(name)]
+
+        for name in names:
+            if not self._is_record(name):
+                raise ValueError(f"Invalid symbol: '{name}' was not yielded by a generator function and cannot be streamed")
+
+        if not names:
+            return iter(())
+
+        num_records = min(self._chunks(name)[-1][1] for name in names)
+        if chunk is None:
+            chunk = max(1, max(stop - start for start, stop, _ in self._chunks(names[0])))
+
+        def read(start):
+            selection = slice(start, min(start + chunk, num_records))
+            return Bunch({name: self._read_records(name, selection) for name in names})
+
+        return prefetch_iter(read(start) for start in range(0, num_records, chunk))
+
+    def flushed(self, positions, names=None):
+        for path in (self.temporary_path(), self.filepath):
+            if os.path.isdir(path):
+                break
+        else:
+            return dict()
+
+        source = copy.copy(self)
+        source.filepath = path
+        try:
+            if names is None:
+                names = [name for name in source._symbol_names() if source._is_record(name)]
+
+            records = dict()
+            for name in names:
+                if os.path.isdir(source._path(name)):
+                    position = positions.get(name, 0)
+                    records[name] = source._read_records(name, slice(position, max(position, source._chunks(name)[-1][1])))
+        except FileNotFoundError:
+            ### the directory was just committed: read it at the next call
+            return dict()
+
+        return records
+
+    def _save(self, filepath, symbol):
+        np.save(filepath, np.asarray(symbol), allow_pickle=False)
+
+    def write(self, symbols):
+        os.makedirs(self.writepath, exist_ok=True)
+        for name, symbol in symbols.items():
+            self._save(self._write_path(f'{name}.npy'), symbol)
+
+    def write_args(self, symbols):
+        os.makedirs(self._write_path('args'), exist_ok=True)
+        for name, symbol in symbols.items():
+            try:
+                self._save(self._write_path('args', f'{name}.npy'), symbol)
+            except (TypeError, ValueError):
+                continue
+
+    def cache(self, cache_time=300):
+        return npy_cache(self.writepath, cache_time=cache_time)
+
+    def exists(self):
+        return os.path.isfile(self._path(self.marker))
+
+    def size(self):
+        size = 0
+        for dirpath, _, filenames in os.walk(self.filepath):
+            size += sum(os.path.getsize(os.path.join(dirpath, filename)) for filename in filenames)
+
+        return size
+
+    def remove(self):
+        self._remove_path()
+
+    def adopt(self, other):
+        self._remove_path()
+        os.replace(other.filepath, self.filepath)
+
+    def link(self, source):
+        self._remove_path()
+        try:
+            os.symlink(os.path.basename(source.filepath), self.filepath)
+        except OSError:
+            shutil.copytree(source.filepath, self.filepath)
+
+def save_chunk(filepath, records):
+    """save a chunk file of records atomically, so that it can be read while records are written"""
+    dirpath, basename = os.path.split(filepath)
+    writepath = os.path.join(dirpath, f'.{basename}')
+    with open(writepath, 'wb') as f:
+        np.save(f, records)
+    os.replace(writepath, filepath)
+
+class npy_cache(h5cache):
+    """h5cache that flushes each cached block of records to a new .npy chunk file"""
+    def __init__(self, filepath, cache_size='100M', cache_time=300):
+        super().__init__(filepath, cache_size=cache_size, cache_time=cache_time)
+        self.offsets = dict()
+
+    def add(self, records, group='/', chunk_size=None):
+        for name, record in records.items():
+            if name not in self.cache:
+                record = np.asarray(record)
+                dirpath = os.path.join(self.filepath, name)
+                os.makedirs(dirpath, exist_ok=True)
+                save_chunk(os.path.join(dirpath, f'{0:012d}-{0:012d}.npy'), np.empty((0,) + record.shape, dtype=record.dtype))
+
+                self.offsets[name] = 0
+                self.cache[name] = npcache(record.shape, record.dtype)
+
+            is_full = self.cache[name].add(record)
+            if is_full:
+                self._flush_symbol(name)
+
+        if (time.time() - self.time_start) > self.cache_time:
+            self.flush()
+            self.time_start = time.time()
+
+    def _flush_symbol(self, name):
+        cache = self.cache[name]
+        if cache.current_record == 0:
+            return
+
+        start = self.offsets[name]
+        stop = start + cache.current_record
+        filepath = os.path.join(self.filepath, name, f'{start:012d}-{stop:012d}.npy')
+        save_chunk(filepath, cache.data[:cache.current_record])
+
+        self.offsets[name] = stop
+        cache.clear()
+
+    def flush(self):
+        for name in self.cache.keys():
+            self._flush_symbol(name)
+
+_memory_storage = dict()
+
+class memory_target(target):
+    """target stored in memory of the current process (cached functions are run serially)"""
+    shared = False
+    persistent = False
+    linkable = True
+
+    def _data(self):
+        """the output being written, which is only published to the target once it is committed"""
+        return _memory_storage.setdefault(self.temporary_path(), dict(symbols=dict(), records=dict(), args=dict()))
+
+    def prepare(self):
+        _memory_storage.pop(self.temporary_path(), None)
+
+    def commit(self):
+        _memory_storage[self.filepath] = self._data()
+        del _memory_storage[self.temporary_path()]
+
+    def adopt(self, other):
+        _memory_storage[self.filepath] = _memory_storage.pop(other.filepath)
+
+    def discard(self, temporary_only=False):
+        _memory_storage.pop(self.temporary_path(), None)
+        if not temporary_only:
+            _memory_storage.pop(self.filepath, None)
+
+    def load(self, symbols=None, records=None, stride=None):
+        data = _memory_storage[self.filepath]
+        names, arg_names = split_symbols(symbols)
+        selection = record_selection(records, stride)
+
+        if names is None:
+            names = list(data['symbols']) + list(data['records'])
+
+        collection = dict()
+        for name in names:
+            if name in data['records']:
+                collection[name] = np.asarray(data['records'][name])[selection]
+            elif name in data['symbols']:
+                collection[name] = data['symbols'][name]
+            else:
+                raise KeyError(f"Invalid symbol: '{name}' does not exist in '{self.filepath}'")
+
+        bunch = Bunch(collection)
+        if data['args'] and (arg_names is None or arg_names):
+            if arg_names is None:
+                arg_names = list(data['args'])
+            bunch['args'] = Bunch({name: data['args'][name] for name in arg_names})
+
+        return bunch
+
+    def stream(self, symbols=None, chunk=None):
+        data = _memory_storage[self.filepath]
+        names, _ = split_symbols(symbols)
+        if names is None:
+            names = list(data['records'])
+
+        for name in names:
+            if name not in data['records']:
+                raise ValueError(f"Invalid symbol: '{name}' was not yielded by a generator function and cannot be streamed")
+
+        if not names:
+            return iter(())
+
+        chunk = 1000 if chunk is None else chunk
+        num_records = min(len(data['records'][name]) for name in names)
+        return (Bunch({name: np.asarray(data['records'][name][start:start+chunk]) for name in names})
+                    for start in range(0, num_records, chunk))
+
+    def write(self, symbols):
+        self._data()['symbols'].update({name: np.asarray(symbol) for name, symbol in symbols.items()})
+
+    def write_args(self, symbols):
+        self._data()['args'].update({name: np.asarray(symbol) for name, symbol in symbols.items()})
+
+    def cache(self, cache_time=300):
+        return memory_cache(self._data()['records'])
+
+    def exists(self):
+        return self.filepath in _memory_storage
+
+    def remove(self):
+        _memory_storage.pop(self.filepath, None)
+
+    def link(self, source):
+        _memory_storage[self.filepath] = _memory_storage[source.filepath]
+
+class memory_cache:
+    """cache that appends records directly to a memory_target"""
+    def __init__(self, records):
+        self.records = records
+
+    def add(self, records):
+        for name, record in records.items():
+            self.records.setdefault(name, []).append(np.asarray(record))
+
+    def flush(self):
+        pass
+
+storage_backends = {
+    'hdf5': h5_target,
+    'h5': h5_target,
+    'npy': npy_target,
+    'memory': memory_target,
+}
+
+def get_storage(storage=None):
+    """get the target class for a storage backend
+
+    Arguments:
+        storage     name of the backend ('hdf5', 'npy', 'memory') or a subclass of target (default: 'hdf5')
+    """
+    if storage is None:
+        return h5_target
+
+    if isinstance(storage, type) and issubclass(storage, target):
+        return storage
+
+    try:
+        return storage_backends[storage]
+    except KeyError:
+        raise ValueError(f"Invalid storage backend: '{storage}' (options: {', '.join(storage_backends)})")
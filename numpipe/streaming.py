@@ -0,0 +1,184 @@
+"""
+Streaming dependencies: the blocks of a function cached with stream=True consume the records of the generator
+functions they depend on while those run
+
+A block with streaming dependents (a producer) flushes its records to its temporary target every
+execution.stream_interval seconds in the config (HDF5 targets are written in SWMR mode), and its dependents read
+the flushed records from there, so that records are only written once. A small spool file next to the target
+signals the state of the producer: the producer appends a frame once it writes its target, and the scheduler
+appends a final frame once the producer has finished (or failed). The scheduler starts the dependents once their
+producers run on a worker. Inside a dependent, job.stream iterates over the records as they are flushed, and
+job.load waits for the producer to finish
+
+A spool is a sequence of frames, each an 8-byte length followed by a pickled message:
+    ('started',)                              the producer writes its temporary target
+    ('end',)                                  the target of the producer is complete
+    ('failed', message)                       the producer failed
+"""
+
+import os
+import pickle
+import struct
+from time import sleep
+import numpy as np
+
+from numpipe import config
+from numpipe.fileio import split_symbols
+from numpipe.utility import Bunch
+
+POLL_INTERVAL = .05     # seconds between reads of a spool that has no new frames
+
+_spooled = set()        # target paths of the running blocks that have streaming dependents
+_live = set()           # target paths of the producers that the running block streams from
+
+def spool_path(target):
+    """the path of the spool of a target"""
+    dirpath, basename = os.path.split(target.filepath)
+    return os.path.join(dirpath, f'.{basename}.stream')
+
+def execute_with_streams(spooled, live, func, args):
+    """
+    Call an execution function with the blocks that have streaming dependents, and with live producers to stream from
+
+    Arguments:
+        spooled      set of target paths of the blocks that have streaming dependents
+        live         set of target paths of the running producers that the blocks depend on
+        func         execution function
+        args         arguments of the execution function
+    """
+    global _spooled, _live
+    _spooled, _live = spooled, live
+    try:
+        return func(*args)
+    finally:
+        _spooled, _live = set(), set()
+
+def _write_frame(path, message):
+    data = pickle.dumps(message, protocol=pickle.HIGHEST_PROTOCOL)
+    with open(path, 'ab') as f:
+        f.write(struct.pack('<Q', len(data)) + data)
+
+def create(path):
+    """create an empty spool (called by the scheduler before the producer starts); the spool of a previous attempt
+       is replaced by a new file, so that dependents that still read it see its final frame"""
+    remove(path)
+    open(path, 'wb').close()
+
+def finish(path):
+    _write_frame(path, ('end',))
+
+def abort(path, message):
+    _write_frame(path, ('failed', str(message)))
+
+def remove(path):
+    if os.path.exists(path):
+        os.remove(path)
+
+def is_spooled(target):
+    """return true if the target is written by the running block, and has streaming dependents"""
+    return str(target) in _spooled
+
+def started(target):
+    """called by the producer once its temporary target is prepared"""
+    if is_spooled(target):
+        _write_frame(spool_path(target), ('started',))
+
+def cache_time(target, cache_time):
+    """the time (in seconds) to hold the cache of records of a target: records of producers are flushed every
+       execution.stream_interval seconds"""
+    if is_spooled(target):
+        return min(cache_time, config.get_config()['execution']['stream_interval'])
+
+    return cache_time
+
+def _read_frames(path):
+    """iterate over the messages of a spool as they are appended, with None whenever no new frame is complete"""
+    with open(path, 'rb') as f:
+        while True:
+            position = f.tell()
+            header = f.read(8)
+            if len(header) == 8:
+                size, = struct.unpack('<Q', header)
+                data = f.read(size)
+                if len(data) == size:
+                    yield pickle.loads(data)
+                    continue
+
+            ### the frame is not complete yet
+            f.seek(position)
+            yield None
+
+def _check(target, message):
+    if message[0] == 'failed':
+        raise RuntimeError(f"streamed dependency '{target}' failed: {message[1]}")
+
+def stream(target, symbols=None, chunk=None):
+    """
+    Iterate over blocks of records of a running producer as they are flushed (see numpipe.storage.target.stream)
+
+    Returns None if the target is not produced while the block runs, so that the target is streamed instead
+    """
+    if str(target) not in _live:
+        return None
+
+    return _stream_flushed(target, symbols, chunk)
+
+def _stream_flushed(target, symbols, chunk):
+    names, _ = split_symbols(symbols)
+    size = 1 if chunk is None else chunk
+    positions = dict()      # {name: number of records read}
+    pending = dict()        # {name: list of arrays of records not yet returned}
+
+    def available():
+        if not pending or (names is not None and any(name not in pending for name in names)):
+            return 0
+        return min(sum(len(array) for array in arrays) for arrays in pending.values())
+
+    def take(count):
+        block = dict()
+        for name, arrays in pending.items():
+            records = np.concatenate(arrays)
+            block[name] = records[:count]
+            pending[name] = [records[count:]]
+        return Bunch(block)
+
+    writing = finished = False
+    frames = _read_frames(spool_path(target))
+    while not finished:
+        for message in frames:
+            if message is None:
+                break
+            _check(target, message)
+            writing = True
+            finished = message[0] == 'end'
+
+        ### records are read once the producer writes its target, and a last time from the committed target
+        if writing:
+            for name, records in target.flushed(positions, names).items():
+                pending.setdefault(name, [])
+                if len(records):
+                    pending[name].append(records)
+                    positions[name] = positions.get(name, 0) + len(records)
+
+            while available() >= size:
+                yield take(size if chunk is not None else available())
+
+        if not finished:
+            sleep(POLL_INTERVAL)
+
+    if available():
+        yield take(available())
+
+def wait(target):
+    """wait for a running producer to finish, before its target is loaded; return immediately if it is not produced
+       while the block runs"""
+    if str(target) not in _live:
+        return
+
+    for message in _read_frames(spool_path(target)):
+        if message is None:
+            sleep(POLL_INTERVAL)
+            continue
+        _check(target, message)
+        if message[0] == 'end':
+            return
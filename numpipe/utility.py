@@ -4,6 +4,10 @@ Utility functions and classes
 
 from functools import wraps
 import traceback
+import sys
+import importlib.util
+import queue
+import threading
 import numpy as np
 
 class once(dict):
@@ -21,6 +25,20 @@ class Bunch:
     def __setitem__(self, key, value):
         self.__dict__[key] = value
 
+def lazy_import(name):
+    """import a module on first attribute access, to keep heavy dependencies out of `import numpipe`"""
+    if name in sys.modules:
+        return sys.modules[name]
+
+    spec = importlib.util.find_spec(name)
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+
+    return module
+
 def doublewrap(func):
     """
     a decorator decorator, can be used as @decorator(...) or @decorator
@@ -89,3 +107,46 @@ def flatten_along(arr, axis=None):
             shape = arr.shape[len(axis):]
             arr = arr.reshape((-1,) + shape)
         return arr
+
+def prefetch_iter(iterable, size=1):
+    """iterate over an iterable while evaluating the next item(s) in a background thread
+
+    Arguments:
+        iterable     iterable to consume
+        size         number of items to evaluate ahead of time (default: 1)
+    """
+    items = queue.Queue(maxsize=size)
+    stop = threading.Event()
+    done = object()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                items.put(item, timeout=.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def producer():
+        try:
+            for item in iterable:
+                if not put(item):
+                    return
+            put(done)
+        except Exception as err:
+            put(err)
+
+    thread = threading.Thread(target=producer, daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = items.get()
+            if item is done:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        stop.set()
+        thread.join()
@@ -0,0 +1,19 @@
+import os
+import sys
+import subprocess
+import textwrap
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+@pytest.fixture
+def script(tmp_path):
+    """write a numpipe script into a temporary directory, and return a function that runs it with arguments"""
+    def run(source, *args, name='sim'):
+        path = tmp_path / f'{name}.py'
+        path.write_text(textwrap.dedent(source))
+        env = dict(os.environ, MPLBACKEND='Agg', PYTHONPATH=ROOT + os.pathsep + os.environ.get('PYTHONPATH', ''))
+        return subprocess.run([sys.executable, path.name, *args], cwd=tmp_path, env=env,
+                              capture_output=True, text=True, timeout=120)
+
+    return run
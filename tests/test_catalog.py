@@ -0,0 +1,27 @@
+"""Catalog of targets (numpipe.catalog)"""
+
+from numpipe.catalog import catalog
+
+def test_sync_is_not_stale(tmp_path):
+    """writes to the catalog itself do not make it stale"""
+    db = catalog(str(tmp_path / 'sim.catalog'), str(tmp_path))
+    assert db.is_stale()
+
+    db.sync()
+    assert not db.is_stale()
+
+    db.sync()
+    assert not db.is_stale()
+    db.close()
+
+    db = catalog(str(tmp_path / 'sim.catalog'), str(tmp_path))
+    assert not db.is_stale()
+    db.close()
+
+def test_new_file_is_stale(tmp_path):
+    db = catalog(str(tmp_path / 'sim.catalog'), str(tmp_path))
+    db.sync()
+
+    (tmp_path / 'sim-A.h5').write_bytes(b'')
+    assert db.is_stale()
+    db.close()
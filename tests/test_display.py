@@ -0,0 +1,32 @@
+"""python sim.py display"""
+
+SOURCE = """
+import numpy as np
+import numpipe
+from numpipe import scheduler
+
+job = scheduler()
+
+@job.cache()
+def A():
+    \"\"\"a single block\"\"\"
+    return dict(x=1)
+
+@job.cache()
+def sweep(x):
+    \"\"\"an adaptive sweep\"\"\"
+    return dict(y=x**2)
+
+job.add(sweep, 'adaptive', **numpipe.adaptive('x', (0, 1), metric=lambda out: out['y'], budget=6))
+
+if __name__ == '__main__':
+    job.run()
+"""
+
+def test_display_adaptive(script):
+    """the values of an adaptive parameter are not chosen before the blocks run"""
+    result = script(SOURCE, 'display')
+    assert result.returncode == 0, result.stderr
+    assert 'A -- a single block' in result.stdout
+    assert 'sweep -- an adaptive sweep' in result.stdout
+    assert '[6 instances]' in result.stdout
@@ -0,0 +1,66 @@
+"""Staging of Slurm job arrays (python sim.py slurm --batch)"""
+
+import pytest
+
+SOURCE = """
+from numpipe import scheduler
+
+job = scheduler()
+
+@job.cache()
+def A():
+    return dict(x=1)
+
+@job.cache(depends=A)
+def B():
+    return dict(x=1)
+
+@job.cache(depends=A)
+def C(i):
+    return dict(x=i)
+
+@job.cache(depends=C)
+def D():
+    return dict(x=1)
+
+job.add(C, i=0)
+job.add(C, i=1).depends(B)
+job.add(C, i=2)
+job.add(C, i=3).depends('C-2')
+
+if __name__ == '__main__':
+    job.run()
+"""
+
+@pytest.fixture
+def stages(script, tmp_path):
+    """the set of block labels of every stage, in order"""
+    result = script(SOURCE, 'slurm', '--batch', '--no-submit', '--runtime-estimate', '1')
+    assert result.returncode == 0, result.stderr
+
+    stages = dict()
+    for path in tmp_path.glob('sim-array*-lookup.txt'):
+        i = int(path.name[len('sim-array'):].split('-')[0])
+        stages.setdefault(i, set()).update(path.read_text().split())
+
+    return [stages[i] for i in sorted(stages)]
+
+def stage_of(stages, label):
+    return next(i for i, stage in enumerate(stages) if label in stage)
+
+def test_function_dependencies(stages):
+    assert stage_of(stages, 'A') < stage_of(stages, 'B')
+    assert stage_of(stages, 'A') < stage_of(stages, 'C-0')
+    assert stage_of(stages, 'C-0') == stage_of(stages, 'C-2')
+
+def test_block_depends_on_function(stages):
+    """a block that depends on a function runs in a later stage than all blocks of the function"""
+    assert stage_of(stages, 'B') < stage_of(stages, 'C-1')
+
+def test_block_depends_on_block(stages):
+    assert stage_of(stages, 'C-2') < stage_of(stages, 'C-3')
+
+def test_dependents_of_delayed_blocks(stages):
+    """dependents of a function run after its delayed blocks"""
+    assert stage_of(stages, 'C-1') < stage_of(stages, 'D')
+    assert stage_of(stages, 'C-3') < stage_of(stages, 'D')
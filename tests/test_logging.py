@@ -0,0 +1,27 @@
+"""Log files of a run"""
+
+SOURCE = """
+from numpipe import scheduler
+
+job = scheduler()
+
+@job.cache()
+def A(i):
+    return dict(x=i)
+
+for i in range(4):
+    job.add(A, i=i)
+
+if __name__ == '__main__':
+    job.run()
+"""
+
+def test_shard_logs(script, tmp_path):
+    """shards that run at the same time do not truncate each other's log"""
+    for shard in ('0/2', '1/2'):
+        result = script(SOURCE, '--shard', shard)
+        assert result.returncode == 0, result.stderr
+
+    assert (tmp_path / 'sim-shard0.log').exists()
+    assert (tmp_path / 'sim-shard1.log').exists()
+    assert not (tmp_path / 'sim.log').exists()
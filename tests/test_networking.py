@@ -0,0 +1,57 @@
+"""Authenticated connections to the TCP coordinator (numpipe.networking, numpipe.server)"""
+
+import socket
+import pickle
+import threading
+from time import time
+import pytest
+
+from numpipe.networking import channel, authentication_error
+from numpipe.server import tcp_executor
+
+KEY = b'0123456789abcdef'
+
+@pytest.fixture
+def executor():
+    executor = tcp_executor('127.0.0.1', 0, authkey=KEY)
+    yield executor
+    executor.shutdown()
+
+def connect(address, key, results):
+    try:
+        conn = channel.connect(socket.create_connection(address), key)
+        conn.send(pickle.dumps(('ready',)))
+        results.append(conn)
+    except authentication_error as err:
+        results.append(err)
+
+def wait_for_workers(executor, number, timeout=5):
+    t_start = time()
+    while executor.num_workers < number and time() - t_start < timeout:
+        executor.wait(.1)
+
+def test_silent_client(executor):
+    """a client that never completes the handshake does not hold up other connections"""
+    t_start = time()
+    silent = socket.create_connection(executor.address)
+    executor.wait(.1)
+
+    results = []
+    thread = threading.Thread(target=connect, args=(executor.address, KEY, results))
+    thread.start()
+    wait_for_workers(executor, 1)
+    thread.join()
+
+    assert executor.num_workers == 1
+    assert time() - t_start < 2
+    silent.close()
+
+def test_wrong_key(executor):
+    results = []
+    thread = threading.Thread(target=connect, args=(executor.address, b'wrong key', results))
+    thread.start()
+    wait_for_workers(executor, 1, timeout=1)
+    thread.join()
+
+    assert executor.num_workers == 0
+    assert isinstance(results[0], (authentication_error, OSError))
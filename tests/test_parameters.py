@@ -0,0 +1,41 @@
+"""Grids of instances (numpipe.parameters)"""
+
+import numpy as np
+from numpipe import parameter
+from numpipe.parameters import grid
+
+def test_unique_names_chunks():
+    """names and their occurrences do not depend on the chunk size"""
+    labels = ['a', 'b', 'a', 'c', 'b', '', 'a']
+    instances = grid('x', dict(a=parameter(range(7), labels=labels), b=parameter(range(3), outer=True, labels=['p', 'q', 'p'])))
+    totals, occurrences = instances.unique_names()
+    for chunk in (1, 2, 5):
+        assert instances.unique_names(chunk=chunk)[0] == totals
+        assert np.array_equal(instances.unique_names(chunk=chunk)[1], occurrences)
+
+    names = [instances.row_name(row) for row in range(len(instances))]
+    assert totals == {name: names.count(name) for name in set(names)}
+    assert [occurrences[row] for row in range(len(names))] == [names[:row].count(name) for row, name in enumerate(names)]
+
+def test_unique_names_distinct():
+    """no occurrences are stored if every name is distinct"""
+    instances = grid('x', dict(a=parameter(range(1000), labels=[str(i) for i in range(1000)])))
+    totals, occurrences = instances.unique_names(chunk=64)
+    assert len(totals) == 1000
+    assert occurrences is None
+
+def test_lazy_values_released():
+    """values of a generator parameter are only held until their block completes"""
+    instances = grid('x', dict(a=parameter((i**2 for i in range(100)), length=100)))
+    complete = set(range(10))       # e.g. cached blocks
+    instances.bind(lambda row: row in complete)
+    values = instances.kwargs['a'].arg
+
+    assert instances.row_kwargs(20)['a'] == 400
+    assert sorted(values.values) == list(range(10, 21))
+
+    for row in range(10, 21):
+        assert instances.row_kwargs(row)['a'] == row**2
+        complete.add(row)
+        instances.release(row)
+    assert not values.values
@@ -0,0 +1,95 @@
+"""Block registry and dispatch queue (numpipe.registry)"""
+
+import pytest
+from numpipe import parameter
+from numpipe.parameters import grid
+from numpipe.registry import block_registry, dispatch_queue, COMPLETE
+
+def A():
+    pass
+
+def B(i):
+    pass
+
+def C():
+    pass
+
+@pytest.fixture
+def registry():
+    registry = block_registry(lambda label, func_name: label)
+    registry.register(A, is_instance=False)
+    registry.register(B, is_instance=True, dependencies=A)
+    registry.register(C, is_instance=False, dependencies=[B])
+    registry.add('A')
+    registry.add_grid('B', grid('', dict(i=parameter(range(3)))))
+    registry.add('C')
+    return registry
+
+def drain(queue):
+    """ids returned by a dispatch queue until no block is ready"""
+    ids = []
+    while True:
+        id = queue.next()
+        if id is None:
+            return ids
+        ids.append(id)
+
+def test_labels(registry):
+    assert list(registry.keys()) == ['A', 'B-0', 'B-1', 'B-2', 'C']
+    assert registry.function_size(registry.function_index['B']) == 3
+    assert registry.label(registry.id('B-1')) == 'B-1'
+
+def test_dependencies(registry):
+    assert sorted(registry.dependencies(registry.id('C'))) == [registry.id(f'B-{i}') for i in range(3)]
+    assert registry.children(registry.id('A')) == [registry.id(f'B-{i}') for i in range(3)]
+
+def test_block_dependency_on_function(registry):
+    """a block-level dependency on a function is resolved to the function, not to its blocks"""
+    id = registry.id('B-1')
+    registry.add_dependencies(id, C)
+    dep_fids, dep_ids = registry.direct_dependencies(id)
+    assert registry.function_index['C'] in dep_fids
+    assert dep_ids == []
+
+def test_dispatch_order(registry):
+    """blocks are returned once their dependencies are complete"""
+    queue = dispatch_queue(registry)
+    assert drain(queue) == [registry.id('A')]
+
+    registry.set_status(registry.id('A'), COMPLETE)
+    ids = drain(queue)
+    assert ids == [registry.id(f'B-{i}') for i in range(3)]
+
+    for id in ids:
+        registry.set_status(id, COMPLETE)
+    assert drain(queue) == [registry.id('C')]
+    assert queue.empty() or queue.next() is None
+
+def test_dispatch_skip(registry):
+    """skipped blocks are marked complete without being returned"""
+    queue = dispatch_queue(registry, skip=lambda id: registry.label(id) in ('A', 'B-1'))
+    ids = drain(queue)
+    assert ids == [registry.id('B-0'), registry.id('B-2')]
+    assert registry.is_complete(registry.id('A'))
+    assert registry.is_complete(registry.id('B-1'))
+
+def test_dispatch_failed_dependency(registry):
+    """the dependents of a failed block are skipped"""
+    queue = dispatch_queue(registry)
+    assert drain(queue) == [registry.id('A')]
+    registry.set_status(registry.id('A'), COMPLETE)
+
+    ids = drain(queue)
+    registry.fail([ids[0]])
+    for id in ids[1:]:
+        registry.set_status(id, COMPLETE)
+
+    assert drain(queue) == []
+    assert queue.skipped == [registry.id('C')]
+
+def test_dispatch_selection(registry):
+    """only the selected blocks are returned"""
+    registry.set_status(registry.id('A'), COMPLETE)
+    queue = dispatch_queue(registry, selection=[registry.id('B-2'), registry.id('B-0')])
+    assert drain(queue) == [registry.id('B-0'), registry.id('B-2')]
+    assert not registry.is_needed(registry.id('B-1'))
@@ -0,0 +1,102 @@
+"""Runs of a scheduler (python sim.py)"""
+
+SOURCE = """
+import sys
+from numpipe import scheduler
+
+job = scheduler(storage=sys.argv.pop(1) if len(sys.argv) > 1 and sys.argv[1] in ('hdf5', 'npy', 'memory') else None)
+
+@job.cache()
+def A(i):
+    return dict(x=i)
+
+@job.cache(depends=A)
+def B():
+    return dict(total=sum(out['x'] for _, out in job.load(A)))
+
+for i in range(3):
+    job.add(A, i=i)
+
+@job.at_end
+def show():
+    print('total', int(job.load(B)['total']))
+
+if __name__ == '__main__':
+    job.run()
+"""
+
+FAILING = """
+from numpipe import scheduler
+
+job = scheduler()
+
+@job.cache()
+def A():
+    return dict(x=1)
+
+@job.cache(depends=A)
+def B():
+    raise RuntimeError('B fails')
+
+@job.cache(depends=B)
+def C():
+    return dict(x=1)
+
+if __name__ == '__main__':
+    job.run()
+"""
+
+MEMORY = """
+from numpipe import scheduler
+
+job = scheduler(storage='memory')
+attempts = []
+
+@job.cache()
+def A():
+    yield dict(x=1)
+    if not attempts:
+        attempts.append(1)
+        raise RuntimeError('the first attempt fails')
+    yield dict(x=2)
+
+if __name__ == '__main__':
+    job.run()
+    print('cached after failure', job.blocks['A'].target.exists())
+    job.run()
+    print('records', job.load(A)['x'].tolist())
+"""
+
+def test_cached(script, tmp_path):
+    """blocks run once, and are loaded from their targets afterwards"""
+    for args in ((), ('-p', '2')):
+        result = script(SOURCE, *args)
+        assert result.returncode == 0, result.stderr
+        assert 'total 3' in result.stdout
+
+    assert sorted(path.name for path in tmp_path.glob('sim-*.h5')) == ['sim-A-0.h5', 'sim-A-1.h5', 'sim-A-2.h5', 'sim-B.h5']
+    result = script(SOURCE, '-p', '2')
+    assert 'Execution summary' not in result.stdout
+
+def test_storage_backends(script):
+    for storage in ('npy', 'memory'):
+        result = script(SOURCE, storage)
+        assert result.returncode == 0, result.stderr
+        assert 'total 3' in result.stdout
+
+def test_failed_dependency(script, tmp_path):
+    """the dependents of a failed block are skipped, and the failed block is not cached"""
+    for args in ((), ('-p', '2')):
+        result = script(FAILING, *args)
+        assert result.returncode == 0, result.stderr
+        assert '1 failure, 1 skipped' in result.stdout
+
+    assert sorted(path.name for path in tmp_path.glob('sim-*.h5')) == ['sim-A.h5']
+    assert not list(tmp_path.glob('.sim-*.tmp'))
+
+def test_memory_failure(script):
+    """the partial output of a failed block in memory is not cached"""
+    result = script(MEMORY)
+    assert result.returncode == 0, result.stderr
+    assert 'cached after failure False' in result.stdout
+    assert 'records [1, 2]' in result.stdout
@@ -0,0 +1,92 @@
+"""Storage backends (numpipe.storage)"""
+
+import os
+import h5py
+import numpy as np
+import pytest
+from numpipe import storage
+from numpipe.storage import memory_target
+
+def test_memory_target_commit():
+    """the output of a memory target is only visible once it is committed"""
+    target = memory_target('test_memory_target_commit')
+    target.prepare()
+    target.write_args(dict(x=1))
+    target.write(dict(y=np.arange(3)))
+    assert not target.exists()
+
+    target.commit()
+    assert target.exists()
+    assert np.array_equal(target.load().y, np.arange(3))
+    assert target.load().args.x == 1
+    target.remove()
+
+def test_memory_target_failed_rerun():
+    """output written by an attempt that failed is not kept by the next attempt"""
+    target = memory_target('test_memory_target_failed_rerun')
+    target.prepare()
+    target.write(dict(partial=1))
+
+    target.prepare()
+    target.write(dict(y=2))
+    target.commit()
+    assert set(vars(target.load())) == {'y'}
+    target.remove()
+
+def test_memory_target_discard():
+    """discarding the temporary output of a failed block keeps the committed output"""
+    target = memory_target('test_memory_target_discard')
+    target.prepare()
+    target.write(dict(y=1))
+    target.commit()
+
+    target.prepare()
+    target.write(dict(y=2))
+    target.discard(temporary_only=True)
+    assert target.temporary_path() not in storage._memory_storage
+    assert target.load().y == 1
+
+    target.prepare()
+    target.write(dict(y=3))
+    target.discard()
+    assert not target.exists()
+    assert target.temporary_path() not in storage._memory_storage
+
+def test_remove_lock(tmp_path):
+    """a lock file is only removed when no process holds the lock"""
+    filepath = str(tmp_path / 'container.h5')
+    with storage.locked(filepath):
+        assert not storage.remove_lock(filepath)
+        assert os.path.exists(storage.lock_path(filepath))
+
+    assert storage.remove_lock(filepath)
+    assert not os.path.exists(storage.lock_path(filepath))
+
+def test_locked_after_removal(tmp_path):
+    """a lock file removed by its holder is recreated by the next process"""
+    filepath = str(tmp_path / 'container.h5')
+    with storage.locked(filepath, remove=True):
+        pass
+    assert not os.path.exists(storage.lock_path(filepath))
+
+    with storage.locked(filepath):
+        assert os.path.exists(storage.lock_path(filepath))
+        with pytest.raises(BlockingIOError):
+            with storage.locked(filepath, blocking=False):
+                pass
+
+def test_repack_held_container(tmp_path):
+    """a container whose lock is held is not repacked"""
+    container = str(tmp_path / 'container.h5')
+    with h5py.File(container, 'w') as f:
+        storage.write_container_index(f, {'A'})
+        f.create_group('A')['x'] = np.arange(10)
+        f.create_group('B')['x'] = np.arange(10**5)
+
+    with storage.locked(container):
+        assert storage.repack_container(container) is None
+
+    assert storage.repack_container(container) > 0
+    assert not os.path.exists(storage.lock_path(container))
+    with h5py.File(container, 'r') as f:
+        assert set(f) == {'A', '_index'}